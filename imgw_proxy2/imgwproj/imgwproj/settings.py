@@ -124,8 +124,55 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Response cache for the /teryt/ endpoints (METEO_RESPONSE_CACHE below) and upstream circuit
+# breaker state (METEO_UPSTREAMS breaker_cache). LocMemCache is per process: every worker has
+# its own breaker and cache. Use RedisCache/PyMemcacheCache (or DatabaseCache) to share them
+# between workers and nodes.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
 REST_FRAMEWORK = {
-    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_RENDERER_CLASSES": ["meteo.renderers.FastJSONRenderer"],  # orjson; falls back to JSONRenderer
 }
 
-METEO_CACHE_ENABLED = True  # toggle use of TERYT - lat/lon cache
\ No newline at end of file
+METEO_CACHE_ENABLED = True  # toggle use of TERYT - lat/lon cache
+METEO_TERYT_LRU_SIZE = 10000  # in-process tier in front of TerytCache; 0 = disabled
+METEO_TERYT_LRU_TTL = 3600  # seconds
+METEO_TERYT_LRU_NEGATIVE_TTL = 300  # seconds, for "no county" answers
+METEO_TERYT_CACHE_MODE = "exact"  # "exact" = per (lat, lon); "cell" = per verified grid cell
+METEO_TERYT_CELL_DEG = 0.01  # cell size for METEO_TERYT_CACHE_MODE = "cell"
+METEO_TERYT_HITS_FLUSH_INTERVAL = 30  # seconds TerytCache hits/last_used may sit in memory; 0 = write-through
+METEO_TERYT_HITS_FLUSH_THRESHOLD = 1000  # flush earlier after this many buffered hits
+METEO_REQUEST_DEADLINE = 10  # seconds; point endpoints wait this long in total for geocoding and the shared IMGW refresh
+METEO_REQUEST_WORKERS = 8  # threads per process for geocoding and /warnings/live fetches (the IMGW refresh has its own thread)
+METEO_POINT_BBOX = (14.0, 48.9, 24.2, 54.9)  # lon_min, lat_min, lon_max, lat_max; points outside -> 404 without Geoportal/IMGW; None = off
+METEO_IMGW_MAX_STALE = 300  # seconds; older than REFRESH_TTL but younger -> serve now, refresh in background (?max_stale=)
+METEO_IMGW_REFRESH_TTL = 60  # seconds; IMGW feed is not refetched while the last fetch is younger
+METEO_INGEST_LEASE_TTL = 90  # seconds; only the IngestLease holder fetches IMGW, taken over once expired; 0 = off
+METEO_INGEST_FOLLOWER_WAIT = 10  # seconds a non-holder waits for the holder's fetch before imgw_available=false
+METEO_WARNING_INDEX_ENABLED = True  # answer current/future/history from the in-process interval index
+METEO_WARNING_INDEX_HISTORY_DAYS = 30  # index only warnings ended within this many days (~1-2 KB each per process); None = all
+METEO_GENERATION_POLL = 1.0  # seconds between reads of IngestState.generation per process
+METEO_RESPONSE_CACHE = "default"  # CACHES alias for cached /teryt/ responses; None = disabled
+METEO_RESPONSE_CACHE_TIMEOUT = 300  # seconds; entries also expire at the next valid_from/valid_to
+# upstream HTTP clients (meteo.upstream.DEFAULTS for all keys)
+METEO_UPSTREAMS = {
+    "imgw": {"read_timeout": 20, "pool_maxsize": 4},
+    "geoportal": {"read_timeout": 10, "pool_maxsize": 16},
+}
+METEO_SNAPSHOT_DIR = None  # also write warnings-all.json[.gz|.br] here (brotli needs the 'brotli' package)
+METEO_BATCH_MAX_POINTS = 1000  # POST /warnings/batch
+METEO_BATCH_GEOCODE_WORKERS = 8  # parallel Geoportal lookups for uncached batch points
+METEO_HISTORY_PAGE_SIZE = 100  # default history page (limit=...); next pages via the "next" cursor
+METEO_HISTORY_MAX_PAGE_SIZE = 1000
+METEO_WARNING_FRAGMENT_CACHE_SIZE = 5000  # per-process cache of serialized warnings; 0 = disabled
+
+# local PRG county boundaries (GeoJSON or .shp in EPSG:4326) for offline lat/lon -> TERYT;
+# None = Geoportal only, e.g. BASE_DIR / "data" / "powiaty.geojson"
+METEO_PRG_PATH = None
+METEO_GEOPORTAL_FALLBACK = True  # ask Geoportal when the point is outside local boundaries
+# precompiled lat/lon -> TERYT raster built by `manage.py build_teryt_grid`; None = disabled
+METEO_TERYT_GRID_PATH = None
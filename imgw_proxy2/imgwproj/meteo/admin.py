@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Powiat, Warning, WarningCoverage, PointSnapshot, TerytCache
+from .models import Powiat, Warning, WarningCoverage, PointSnapshot, TerytCache, TerytCell, IngestState, IngestLease
 
 @admin.register(Powiat)
 class PowiatAdmin(admin.ModelAdmin):
@@ -26,3 +26,17 @@ class TerytCacheAdmin(admin.ModelAdmin):
     list_display = ("lat","lon","teryt4","area_name","hits","first_seen","last_used")
     search_fields = ("teryt4","area_name")
     list_filter = ("teryt4",)
+
+@admin.register(TerytCell)
+class TerytCellAdmin(admin.ModelAdmin):
+    list_display = ("cell_udeg", "lat_idx", "lon_idx", "teryt4", "area_name", "homogeneous", "first_seen")
+    list_filter = ("homogeneous", "cell_udeg")
+    search_fields = ("teryt4", "area_name")
+
+@admin.register(IngestState)
+class IngestStateAdmin(admin.ModelAdmin):
+    list_display = ("source", "fetched_at", "changed_at", "etag", "last_modified")
+
+@admin.register(IngestLease)
+class IngestLeaseAdmin(admin.ModelAdmin):
+    list_display = ("source", "holder", "token", "expires_at")
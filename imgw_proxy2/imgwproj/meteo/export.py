@@ -0,0 +1,112 @@
+# meteo/export.py
+"""
+Strumieniowy eksport ostrzezen (NDJSON albo CSV) - dla widoku export_warnings_view
+i komendy manage.py export_warnings.
+
+Wiersze sa czytane przez QuerySet.iterator(chunk_size=...) i wysylane od razu,
+wiec pamiec nie zalezy od zakresu dat. Kolejnosc: (valid_from, id).
+- per_teryt=False: jeden wiersz na ostrzezenie + lista TERYT-4 ("teryt"),
+  pokrycie doczytywane jednym zapytaniem na paczke chunk_size ostrzezen
+- per_teryt=True: jeden wiersz na pare (ostrzezenie, TERYT-4) ("teryt4"), jedno zapytanie z joinem
+Daty w tym samym formacie co w API (WarningSerializer).
+"""
+from __future__ import annotations
+
+import csv
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterator, Optional
+
+from django.db.models import Q
+
+from .models import Warning, WarningCoverage
+from .renderers import FastJSONRenderer
+from .serializers import serialize_warnings
+from .warning_index import WARNING_FIELDS
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+_renderer = FastJSONRenderer()
+
+
+class _Echo:
+    """csv.writer pisze do "pliku", ktory tylko zwraca linie."""
+
+    def write(self, value):
+        return value
+
+
+def _period_filter(prefix: str, since: Optional[datetime], until: Optional[datetime]) -> Q:
+    # przeciecie przedzialow, jak w historii (_history_qs_for_teryt)
+    if since and until and since > until:
+        since, until = until, since
+    cond = Q()
+    if since:
+        cond &= Q(**{f"{prefix}valid_to__gte": since})
+    if until:
+        cond &= Q(**{f"{prefix}valid_from__lte": until})
+    return cond
+
+
+def _warning_chunks(since, until, teryt4, chunk_size) -> Iterator[list[dict]]:
+    qs = Warning.objects.filter(_period_filter("", since, until))
+    if teryt4:
+        qs = qs.filter(coverage__teryt4=teryt4)
+    qs = qs.order_by("valid_from", "id").values_list(*WARNING_FIELDS)
+    chunk = []
+    for values in qs.iterator(chunk_size=chunk_size):
+        chunk.append(dict(zip(WARNING_FIELDS, values)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _rows(since, until, teryt4, per_teryt, chunk_size) -> Iterator[dict]:
+    if per_teryt:
+        qs = WarningCoverage.objects.filter(_period_filter("warning__", since, until))
+        if teryt4:
+            qs = qs.filter(powiat_id=teryt4)
+        qs = qs.order_by("warning__valid_from", "warning_id", "powiat_id").values_list(
+            *[f"warning__{f}" for f in WARNING_FIELDS], "powiat_id",
+        )
+        for values in qs.iterator(chunk_size=chunk_size):
+            row = serialize_warnings([dict(zip(WARNING_FIELDS, values))])[0]
+            row["teryt4"] = values[-1]
+            yield row
+        return
+
+    for chunk in _warning_chunks(since, until, teryt4, chunk_size):
+        coverage = defaultdict(list)
+        for wid, t4 in (
+            WarningCoverage.objects.filter(warning_id__in=[r["id"] for r in chunk])
+            .order_by("powiat_id").values_list("warning_id", "powiat_id")
+        ):
+            coverage[wid].append(t4)
+        for row in serialize_warnings(chunk):
+            row["teryt"] = coverage.get(row["id"], [])
+            yield row
+
+
+def export_warnings(fmt: str = "ndjson", *, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, teryt4: Optional[str] = None,
+                    per_teryt: bool = False, chunk_size: int = 2000) -> Iterator[bytes]:
+    """Generator kolejnych linii eksportu (bajty UTF-8) w formacie fmt ("ndjson" albo "csv")."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    rows = _rows(since, until, teryt4, per_teryt, chunk_size)
+
+    if fmt == "ndjson":
+        for row in rows:
+            yield _renderer.render(row) + b"\n"
+        return
+
+    columns = WARNING_FIELDS + ["teryt4" if per_teryt else "teryt"]
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns).encode("utf-8")
+    for row in rows:
+        if not per_teryt:
+            row["teryt"] = " ".join(row["teryt"])
+        yield writer.writerow([row[c] for c in columns]).encode("utf-8")
@@ -0,0 +1,64 @@
+# meteo/fragments.py
+"""
+Cache gotowych fragmentow JSON pojedynczych ostrzezen.
+
+Ostrzezenie zmienia sie tylko przy ingescie, a content/comment maja czesto kilka KB,
+wiec kazde ostrzezenie serializujemy raz: wpis w LRU (per proces) pod id trzyma
+(fingerprint, strefa, bajty JSON). Inny fingerprint (ingest zapisal nowa wersje,
+takze w innym procesie) = wpis nieaktualny; ingest_imgw() dodatkowo usuwa
+zmienione id z lokalnego cache po commicie. Listy w odpowiedziach to listy
+JSONFragment, ktore FastJSONRenderer wkleja bez ponownej serializacji.
+Rozmiar: settings.METEO_WARNING_FRAGMENT_CACHE_SIZE (0 = wylaczony).
+"""
+from __future__ import annotations
+
+import threading
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .lru import LRUCache, MISS
+from .renderers import FastJSONRenderer, JSONFragment
+from .serializers import serialize_warnings
+
+_renderer = FastJSONRenderer()
+_cache: Optional[LRUCache] = None
+_cache_lock = threading.Lock()
+
+
+def fragment_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LRUCache(int(getattr(settings, "METEO_WARNING_FRAGMENT_CACHE_SIZE", 5000)))
+    return _cache
+
+
+def warning_fragments(rows: Iterable[dict]) -> list[JSONFragment]:
+    """
+    Wiersze z ROW_FIELDS (indeks albo .values()) -> zserializowane ostrzezenia
+    w schemacie WarningSerializer. Bez fingerprintu (rekord sprzed ingestu) - bez cache.
+    """
+    cache = fragment_cache()
+    tz = str(timezone.get_current_timezone())
+    out = []
+    for r in rows:
+        fp = r.get("fingerprint")
+        entry = cache.get(r["id"]) if fp else MISS
+        if entry is not MISS and entry[0] == fp and entry[1] == tz:
+            out.append(entry[2])
+            continue
+        frag = JSONFragment(_renderer.render(serialize_warnings([r])[0]))
+        if fp:
+            cache.set(r["id"], (fp, tz, frag))
+        out.append(frag)
+    return out
+
+
+def forget_fragments(ids: Iterable[str]) -> None:
+    """Usuwa fragmenty podanych ostrzezen z cache tego procesu."""
+    cache = fragment_cache()
+    for wid in ids:
+        cache.delete(wid)
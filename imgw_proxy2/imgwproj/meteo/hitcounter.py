@@ -0,0 +1,145 @@
+# meteo/hitcounter.py
+"""
+Odroczony zapis licznikow TerytCache (hits, last_used).
+
+Trafienie w cache tylko zwieksza licznik w pamieci procesu; zebrane liczniki
+trafiaja do DB jednym UPDATE ... CASE WHEN co METEO_TERYT_HITS_FLUSH_INTERVAL
+sekund albo po METEO_TERYT_HITS_FLUSH_THRESHOLD trafieniach, a takze przy
+zamykaniu procesu (atexit; SIGTERM bez wlasnego handlera zamieniany na SystemExit,
+zeby atexit w ogole sie wykonal). Okno utraty = interwal flush.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import signal
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, DateTimeField, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from .models import TerytCache
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK = 500  # max. liczba wierszy w jednym UPDATE
+
+
+class HitBuffer:
+    def __init__(self, flush_interval: float, flush_threshold: int):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending: dict[int, tuple[int, datetime]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._hooks_installed = False
+
+    def record(self, pk: int) -> None:
+        """Zapamietuje jedno trafienie w wiersz TerytCache o danym pk."""
+        now = timezone.now()
+        with self._lock:
+            hits, _ = self._pending.get(pk, (0, now))
+            self._pending[pk] = (hits + 1, now)
+            self._count += 1
+            due = self.flush_interval <= 0 or self._count >= self.flush_threshold
+        self._install_hooks()
+        if due:
+            self.flush()
+        else:
+            self._schedule()
+
+    def flush(self) -> int:
+        """Zapisuje zebrane liczniki do DB; zwraca liczbe zaktualizowanych wierszy."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._count = 0
+            if not pending:
+                return 0
+            try:
+                items = list(pending.items())
+                for i in range(0, len(items), FLUSH_CHUNK):
+                    chunk = items[i:i + FLUSH_CHUNK]
+                    TerytCache.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                        hits=F("hits") + Case(
+                            *[When(pk=pk, then=Value(n)) for pk, (n, _) in chunk],
+                            default=Value(0),
+                            output_field=PositiveIntegerField(),
+                        ),
+                        last_used=Case(
+                            *[When(pk=pk, then=Value(ts)) for pk, (_, ts) in chunk],
+                            default=F("last_used"),
+                            output_field=DateTimeField(),
+                        ),
+                    )
+            except Exception:
+                logger.exception("TerytCache hit flush failed; keeping counters for the next try")
+                with self._lock:
+                    for pk, (n, ts) in pending.items():
+                        hits, last = self._pending.get(pk, (0, ts))
+                        self._pending[pk] = (hits + n, max(last, ts))
+                        self._count += n
+                return 0
+            return len(pending)
+
+    def pending(self) -> int:
+        return self._count
+
+    def _schedule(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_interval, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # watek timera ma wlasne polaczenie do DB - nie zostawiamy go otwartego
+            connections.close_all()
+        if self._count:
+            self._schedule()
+
+    def _install_hooks(self) -> None:
+        if self._hooks_installed:
+            return
+        self._hooks_installed = True
+        atexit.register(self.flush)
+        if threading.current_thread() is not threading.main_thread():
+            return  # sygnaly mozna podpiac tylko z watku glownego
+        # Domyslny SIGTERM konczy proces bez atexit. Handler nie zapisuje do DB (moglby
+        # trafic w record()/flush() trzymajace blokady) - tylko zamienia sygnal na SystemExit,
+        # a flush robi atexit po zwinieciu stosu. Wlasne handlery (np. gunicorn) zostaja;
+        # SIGINT i tak konczy sie KeyboardInterrupt -> atexit.
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            def _handler(signum, frame):
+                signal.signal(signum, signal.SIG_DFL)
+                raise SystemExit(128 + signum)
+
+            signal.signal(signal.SIGTERM, _handler)
+
+
+_buffer: HitBuffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def hit_buffer() -> HitBuffer:
+    """Wspoldzielony (per proces) bufor trafien TerytCache."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = HitBuffer(
+                    flush_interval=float(getattr(settings, "METEO_TERYT_HITS_FLUSH_INTERVAL", 30)),
+                    flush_threshold=int(getattr(settings, "METEO_TERYT_HITS_FLUSH_THRESHOLD", 1000)),
+                )
+    return _buffer
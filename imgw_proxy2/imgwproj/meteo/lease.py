@@ -0,0 +1,142 @@
+# meteo/lease.py
+"""
+Dzierzawa pobierania feedu w DB (IngestLease): w danej chwili pobiera i zapisuje
+tylko jeden proces (sposrod wszystkich workerow i wezlow), reszta czyta DB
+i obserwuje IngestState.generation.
+
+- acquire_lease(): warunkowy UPDATE - wolna albo wygasla dzierzawa (albo nasza) -> nasza
+  na settings.METEO_INGEST_LEASE_TTL sekund; przejecie od innego posiadacza zwieksza token
+- check_fence(): pierwszy zapis w transakcji ingestu; token nieaktualny -> LeaseLost
+  i wycofanie transakcji (posiadacz, ktory "zasnal" dluzej niz TTL, nic nie nadpisze)
+- release_lease(): zwolnienie (tez przy zamykaniu procesu), nastepca nie czeka na TTL
+Cudza wazna dzierzawa jest zapamietywana w procesie (najwyzej OBSERVE_MAX s), wiec
+nieudane proby nie pisza do DB przy kazdym zapytaniu.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from .models import IngestLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Dzierzawe przejal inny proces - zapis z tym tokenem jest odrzucany."""
+
+
+_holder = {"pid": None, "id": ""}
+_held: dict[str, int] = {}  # source -> token dzierzaw tego procesu (do zwolnienia przy wyjsciu)
+_hook_installed = False
+_known: set[str] = set()  # zrodla, dla ktorych wiersz IngestLease na pewno istnieje
+_observed: dict[str, float] = {}  # source -> time.monotonic(), do kiedy dzierzawe ma ktos inny
+
+OBSERVE_MAX = 10.0  # s; najdluzej wierzymy zapamietanej cudzej dzierzawie (moze byc zwolniona wczesniej)
+
+
+def holder_id() -> str:
+    """Identyfikator tego procesu (host:pid:sufiks); nowy po fork()."""
+    pid = os.getpid()
+    if _holder["pid"] != pid:
+        _holder.update(pid=pid, id=f"{socket.gethostname()}:{pid}:{secrets.token_hex(4)}"[-128:])
+        _held.clear()
+    return _holder["id"]
+
+
+def lease_ttl() -> float:
+    """settings.METEO_INGEST_LEASE_TTL w sekundach; 0/None = dzierzawa wylaczona."""
+    return float(getattr(settings, "METEO_INGEST_LEASE_TTL", 90) or 0)
+
+
+def acquire_lease(source: str, ttl: Optional[float] = None, *, steal: bool = False) -> Optional[int]:
+    """
+    Bierze albo przedluza dzierzawe source; zwraca token ogrodzenia albo None,
+    gdy waznej dzierzawy uzywa inny proces (wtedy bez zapytan do DB az do jej konca,
+    najwyzej OBSERVE_MAX s). steal=True -> przejecie takze waznej cudzej dzierzawy
+    (nowy token, zapisy dotychczasowego posiadacza beda odrzucone).
+    """
+    me = holder_id()
+    if not steal and _observed.get(source, 0.0) > time.monotonic():
+        return None
+    now = timezone.now()
+    ttl = lease_ttl() if ttl is None else ttl
+    if source not in _known:
+        IngestLease.objects.get_or_create(source=source)
+        _known.add(source)
+    qs = IngestLease.objects.filter(source=source)
+    if not steal:
+        qs = qs.filter(Q(holder=me) | Q(expires_at__isnull=True) | Q(expires_at__lte=now))
+    updated = qs.update(
+        token=Case(When(holder=me, then=F("token")), default=F("token") + 1),
+        holder=me,
+        expires_at=now + timedelta(seconds=ttl),
+    )
+    if not updated:
+        expires_at = IngestLease.objects.filter(source=source).values_list("expires_at", flat=True).first()
+        if expires_at is not None:
+            remaining = min((expires_at - now).total_seconds(), OBSERVE_MAX)
+            _observed[source] = time.monotonic() + max(0.0, remaining)
+        return None
+    _observed.pop(source, None)
+    token = IngestLease.objects.filter(source=source, holder=me).values_list("token", flat=True).first()
+    if token is not None:
+        _install_release_hook()
+        _held[source] = token
+    return token
+
+
+def check_fence(source: str, token: int) -> None:
+    """
+    Wywolywane w transakcji zapisu: sprawdza token i przedluza dzierzawe; UPDATE blokuje
+    wiersz dzierzawy do commitu (przejecie czeka). Nieaktualny token -> LeaseLost.
+    """
+    expires_at = timezone.now() + timedelta(seconds=lease_ttl())
+    if not IngestLease.objects.filter(source=source, token=token).update(expires_at=expires_at):
+        raise LeaseLost(f"{source}: lease token {token} is no longer current")
+
+
+def release_lease(source: str, token: int) -> None:
+    """Zwalnia dzierzawe (tylko wlasna, z tym tokenem); token zostaje."""
+    IngestLease.objects.filter(source=source, holder=holder_id(), token=token).update(
+        expires_at=timezone.now(),
+    )
+    _held.pop(source, None)
+
+
+def _install_release_hook() -> None:
+    global _hook_installed
+    if not _hook_installed:
+        _hook_installed = True
+        atexit.register(_release_all)
+
+
+def _release_all() -> None:
+    for source, token in list(_held.items()):
+        try:
+            release_lease(source, token)
+        except Exception:
+            logger.exception("Releasing ingest lease %s failed; it expires on its own", source)
+
+
+def lease_status(source: str) -> Optional[dict]:
+    """Stan dzierzawy source (do /status); None = jeszcze nikt jej nie bral."""
+    lease = IngestLease.objects.filter(source=source).first()
+    if lease is None:
+        return None
+    return {
+        "holder": lease.holder,
+        "token": lease.token,
+        "expires_at": lease.expires_at,
+        "held_here": lease.holder == holder_id() and bool(lease.expires_at and lease.expires_at > timezone.now()),
+    }
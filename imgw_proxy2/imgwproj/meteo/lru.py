@@ -0,0 +1,83 @@
+# meteo/lru.py
+"""Maly, watkowo bezpieczny cache LRU z TTL (osobny TTL dla wpisow negatywnych)."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISS = object()  # zwracane przez get(), gdy brak (waznego) wpisu
+
+
+class LRUCache:
+    """
+    - maxsize: maksymalna liczba wpisow (najdawniej uzywane wypadaja pierwsze)
+    - ttl: czas zycia wpisu w sekundach (None = bez limitu)
+    - negative_ttl: czas zycia wpisu negatywnego (set(..., negative=True))
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, negative_ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float | None, bool]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: Hashable) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            value, expires, negative = entry
+            if expires is not None and expires <= now:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            if negative:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, *, negative: bool = False) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.negative_ttl if negative else self.ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires, negative)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+        }
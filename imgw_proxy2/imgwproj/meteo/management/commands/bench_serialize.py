@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from meteo.fragments import warning_fragments
+from meteo.models import Warning
+from meteo.renderers import FastJSONRenderer
+from meteo.serializers import WarningSerializer, serialize_warnings
+from meteo.warning_index import ROW_FIELDS
+
+
+def _synthetic_rows(n):
+    base = timezone.now().replace(microsecond=0)
+    return [{
+        "id": f"bench-{i}",
+        "event_name": "Intensywne opady deszczu",
+        "level": 1 + i % 3,
+        "probability": 80,
+        "valid_from": base + timedelta(hours=i % 240),
+        "valid_to": base + timedelta(hours=i % 240 + 12),
+        "published_at": base - timedelta(minutes=i % 90) if i % 5 else None,
+        "content": "Prognozowane sa opady deszczu od 30 mm do 40 mm, lokalnie do 50 mm. " * 3,
+        "comment": "",
+        "office": "CMPiSM w Krakowie",
+        "fingerprint": f"{i:064x}",
+    } for i in range(n)]
+
+
+class Command(BaseCommand):
+    help = ("Compare WarningSerializer + JSONRenderer with serialize_warnings + FastJSONRenderer "
+            "and with cached per-warning fragments.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="synthetic rows (ignored with --db)")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--db", action="store_true", help="use Warning rows from the database")
+
+    def handle(self, *args, **opts):
+        if opts["db"]:
+            rows = list(Warning.objects.order_by("-valid_from", "-id").values(*ROW_FIELDS))
+        else:
+            rows = _synthetic_rows(opts["rows"])
+        payload = lambda items: {"count": len(items), "items": items}
+
+        slow = JSONRenderer().render(payload(WarningSerializer(rows, many=True).data))
+        fast = FastJSONRenderer().render(payload(serialize_warnings(rows)))
+        frag = FastJSONRenderer().render(payload(warning_fragments(rows)))
+        if not slow == fast == frag:
+            self.stderr.write(self.style.ERROR("Output differs between serializers"))
+            return
+
+        def bench(fn):
+            best = float("inf")
+            for _ in range(opts["repeat"]):
+                t0 = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - t0)
+            return best * 1000
+
+        t_slow = bench(lambda: JSONRenderer().render(payload(WarningSerializer(rows, many=True).data)))
+        t_fast = bench(lambda: FastJSONRenderer().render(payload(serialize_warnings(rows))))
+        t_frag = bench(lambda: FastJSONRenderer().render(payload(warning_fragments(rows))))
+        self.stdout.write(f"rows={len(rows)} bytes={len(fast)} (best of {opts['repeat']})")
+        self.stdout.write(f"  WarningSerializer + JSONRenderer:     {t_slow:8.2f} ms")
+        self.stdout.write(f"  serialize_warnings + FastJSONRenderer: {t_fast:8.2f} ms")
+        self.stdout.write(f"  warning_fragments (cached):            {t_frag:8.2f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"  speedup x{t_slow / t_fast:.1f} / x{t_slow / t_frag:.1f}, identical output"
+        ))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from meteo.prg import load_parts
+from meteo.teryt_grid import build_grid
+
+class Command(BaseCommand):
+    help = "Rasterize PRG county boundaries into the mmap TERYT lookup grid."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", help="PRG GeoJSON/.shp in EPSG:4326 (default: METEO_PRG_PATH)")
+        parser.add_argument("--out", help="output grid file (default: METEO_TERYT_GRID_PATH)")
+        parser.add_argument("--cell-m", type=float, default=100.0, help="cell size in metres (default 100)")
+        parser.add_argument(
+            "--bbox", type=float, nargs=4, metavar=("LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"),
+            help="grid extent (default: extent of the boundaries)",
+        )
+
+    def handle(self, *args, **opts):
+        source = opts["source"] or getattr(settings, "METEO_PRG_PATH", None)
+        out = opts["out"] or getattr(settings, "METEO_TERYT_GRID_PATH", None)
+        if not source or not out:
+            raise CommandError("set --source/--out or METEO_PRG_PATH/METEO_TERYT_GRID_PATH")
+
+        info = build_grid(load_parts(source), out, cell_m=opts["cell_m"], bbox=opts["bbox"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {out}: {info['cols']}x{info['rows']} cells, {info['counties']} counties, "
+            f"{info['boundary_cells']} boundary cells, {info['bytes']} bytes"
+        ))
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meteo.export import FORMATS, export_warnings
+from meteo.services import parse_dt_local_utc
+
+
+class Command(BaseCommand):
+    help = "Stream warnings (optionally one row per TERYT-4) as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="output file, '-' = stdout")
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--since", help="YYYY-MM-DD[THH:MM:SS], local PL time")
+        parser.add_argument("--until", help="YYYY-MM-DD[THH:MM:SS], local PL time")
+        parser.add_argument("--teryt", help="only warnings covering this TERYT-4")
+        parser.add_argument("--per-teryt", action="store_true", help="one row per (warning, TERYT-4)")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        since = parse_dt_local_utc(opts["since"])
+        until = parse_dt_local_utc(opts["until"])
+        if (opts["since"] and since is None) or (opts["until"] and until is None):
+            raise CommandError("since/until must be YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
+
+        lines = export_warnings(
+            opts["format"], since=since, until=until, teryt4=opts["teryt"],
+            per_teryt=opts["per_teryt"], chunk_size=opts["chunk_size"],
+        )
+        n = 0
+        out = sys.stdout.buffer if opts["path"] == "-" else open(opts["path"], "wb")
+        try:
+            for line in lines:
+                out.write(line)
+                n += 1
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if opts["path"] != "-":
+            self.stderr.write(self.style.SUCCESS(f"Exported {n} lines to {opts['path']}"))
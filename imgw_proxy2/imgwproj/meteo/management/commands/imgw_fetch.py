@@ -1,10 +1,37 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from meteo.services import fetch_imgw, upsert_imgw
+from meteo.lease import acquire_lease, lease_ttl, release_lease
+from meteo.services import IMGW_SOURCE, sync_imgw
+from meteo.snapshot import build_snapshot
 
 class Command(BaseCommand):
-    help = "Fetch IMGW warnings and upsert into DB."
+    help = "Fetch IMGW warnings and upsert changed ones into DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="ignore ETag/Last-Modified and stored fingerprints, rewrite every warning; "
+                 "takes the ingest lease over from its current holder",
+        )
 
     def handle(self, *args, **opts):
-        items = fetch_imgw()
-        n = upsert_imgw(items)
-        self.stdout.write(self.style.SUCCESS(f"Upserted {n} warnings"))
\ No newline at end of file
+        fence = None
+        if lease_ttl():
+            # nie dublujemy pobierania z workerem/innym wezlem, ktory trzyma dzierzawe;
+            # --force przejmuje ja (zapis dotychczasowego posiadacza zostanie odrzucony)
+            fence = acquire_lease(IMGW_SOURCE, steal=opts["force"])
+            if fence is None:
+                self.stderr.write(self.style.WARNING(
+                    "IMGW ingest lease held by another process; skipping (use --force to take it over)"
+                ))
+                return
+        try:
+            stats = sync_imgw(force=opts["force"], fence=fence)
+        finally:
+            if fence is not None:
+                release_lease(IMGW_SOURCE, fence)
+        self.stdout.write(self.style.SUCCESS(f"Upserted {stats}"))
+        if getattr(settings, "METEO_SNAPSHOT_DIR", None):
+            # pliki /warnings/all odswiezane tez przy kazdym uruchomieniu (granice valid_from/valid_to)
+            snap = build_snapshot()
+            self.stdout.write(f"Snapshot: {snap.generation=} {len(snap.body)} B, gzip {len(snap.gzip)} B")
@@ -0,0 +1,56 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from meteo.models import Powiat
+from meteo.prg import load_parts
+from meteo.services import county_geometry, geoportal_county, geoportal_county_list
+
+GEOMETRY_FIELDS = [
+    "name", "centroid_lat", "centroid_lon",
+    "bbox_min_lat", "bbox_min_lon", "bbox_max_lat", "bbox_max_lon",
+]
+
+class Command(BaseCommand):
+    help = "Precompute county (Powiat) names, area-weighted centroids and extents."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            help="PRG GeoJSON/.shp in EPSG:4326 (default: METEO_PRG_PATH; without it Geoportal is used)",
+        )
+        parser.add_argument("--delay", type=float, default=0.2, help="pause between Geoportal requests (s)")
+
+    def handle(self, *args, **opts):
+        source = opts["source"] or getattr(settings, "METEO_PRG_PATH", None)
+        rows: dict[str, dict] = {}
+
+        if source:
+            polygons = defaultdict(list)
+            names = {}
+            for teryt4, name, rings in load_parts(source):
+                polygons[teryt4].append(rings)
+                names.setdefault(teryt4, name)
+            for teryt4, polys in polygons.items():
+                rows[teryt4] = {"name": names[teryt4], **county_geometry(polys)}
+        else:
+            counties = geoportal_county_list()
+            self.stdout.write(f"Geoportal: {len(counties)} counties")
+            for n, (teryt4, name) in enumerate(counties, 1):
+                try:
+                    geo = geoportal_county(teryt4)
+                except Exception as e:
+                    self.stderr.write(f"{teryt4}: {e}")
+                    continue
+                if geo:
+                    rows[teryt4] = {**geo, "name": geo.get("name") or name}
+                if n % 50 == 0:
+                    self.stdout.write(f"{n}/{len(counties)}")
+                time.sleep(opts["delay"])
+
+        objs = [Powiat(teryt4=t4, **{f: row.get(f) for f in GEOMETRY_FIELDS}) for t4, row in rows.items()]
+        Powiat.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=["teryt4"], update_fields=GEOMETRY_FIELDS,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Stored geometry for {len(objs)} counties"))
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+from meteo.models import TerytCache
+
+class Command(BaseCommand):
+    help = "Export TerytCache as JSONL, hottest rows first (input for teryt_prewarm on another node)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="output JSONL file")
+        parser.add_argument("--top", type=int, help="only the N most used rows")
+
+    def handle(self, *args, **opts):
+        qs = TerytCache.objects.order_by("-hits", "-last_used").values_list("lat", "lon", "teryt4", "area_name", "hits")
+        if opts["top"] is not None:
+            qs = qs[:opts["top"]]
+        n = 0
+        with open(opts["path"], "w", encoding="utf-8") as fh:
+            for lat, lon, teryt4, area_name, hits in qs.iterator(chunk_size=2000):
+                fh.write(json.dumps({
+                    "lat": float(lat), "lon": float(lon),
+                    "teryt4": teryt4, "area_name": area_name, "hits": hits,
+                }, ensure_ascii=False) + "\n")
+                n += 1
+        self.stdout.write(self.style.SUCCESS(f"Exported {n} rows to {opts['path']}"))
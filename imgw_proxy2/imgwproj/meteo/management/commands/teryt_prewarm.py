@@ -0,0 +1,151 @@
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from meteo.models import TerytCache
+from meteo.services import geoportal_teryt
+
+
+class _RateLimiter:
+    """Globalny limit zapytan/s dla wszystkich watkow (token bucket)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _read_rows(path: Path):
+    """Wiersze jako dict z pliku CSV (naglowek) albo JSONL."""
+    with open(path, encoding="utf-8", newline="") as fh:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(fh)
+        else:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def cached_points(lats: set, wanted: set) -> set:
+    """Punkty z wanted, ktore juz sa w TerytCache."""
+    return {
+        (float(lat), float(lon))
+        for lat, lon in TerytCache.objects.filter(lat__in=lats).values_list("lat", "lon")
+    } & wanted
+
+
+class Command(BaseCommand):
+    help = (
+        "Prewarm TerytCache from a CSV/JSONL file of points (lat, lon) resolved via Geoportal, "
+        "or from another node's export (rows that already carry teryt4, see teryt_cache_export)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV with a lat,lon header or JSONL with {lat, lon[, teryt4, area_name]}")
+        parser.add_argument("--workers", type=int, default=4, help="parallel Geoportal requests (default 4)")
+        parser.add_argument("--rate", type=float, default=5.0, help="max Geoportal requests per second (default 5)")
+        parser.add_argument("--batch", type=int, default=500, help="rows per DB batch (default 500)")
+        parser.add_argument("--top", type=int, help="only the first N rows (exports are sorted hottest first)")
+        parser.add_argument(
+            "--checkpoint",
+            help="file with the number of input rows already done; resume from it and keep it updated",
+        )
+
+    def handle(self, *args, **opts):
+        path = Path(opts["path"])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+        checkpoint = Path(opts["checkpoint"]) if opts["checkpoint"] else None
+        done = int(checkpoint.read_text().strip() or 0) if checkpoint and checkpoint.exists() else 0
+
+        rows = _read_rows(path)
+        if opts["top"] is not None:
+            rows = islice(rows, opts["top"])
+        rows = islice(rows, done, None)
+
+        limiter = _RateLimiter(opts["rate"])
+
+        def resolve(point):
+            limiter.wait()
+            try:
+                return point, geoportal_teryt(*point), None
+            except Exception as e:
+                return point, (None, None), e
+
+        inserted = failed = skipped = 0
+        processed = 0  # wiersze z tego uruchomienia (bez pominietych przez checkpoint) - do tempa
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, opts["workers"])) as pool:
+            while True:
+                batch = list(islice(rows, opts["batch"]))
+                if not batch:
+                    break
+
+                known: dict[tuple[float, float], tuple] = {}
+                todo: set[tuple[float, float]] = set()
+                for row in batch:
+                    try:
+                        point = (round(float(row["lat"]), 6), round(float(row["lon"]), 6))
+                    except (KeyError, TypeError, ValueError):
+                        failed += 1
+                        continue
+                    if "teryt4" in row:
+                        known[point] = (row["teryt4"] or None, row.get("area_name") or "")
+                    else:
+                        todo.add(point)
+
+                # juz w cache -> nie pytamy Geoportalu drugi raz (takze po wznowieniu)
+                wanted = set(known) | todo
+                lats = {lat for lat, _ in wanted}
+                existing = cached_points(lats, wanted)
+                skipped += len(existing)
+                todo -= existing
+
+                for point, (teryt, name), err in pool.map(resolve, sorted(todo)):
+                    if err is not None:
+                        failed += 1
+                        continue
+                    known[point] = (teryt, name or "")
+
+                objs = [
+                    TerytCache(lat=lat, lon=lon, teryt4=teryt, area_name=name)
+                    for (lat, lon), (teryt, name) in known.items()
+                    if (lat, lon) not in existing
+                ]
+                # ignore_conflicts nie mowi, ile wierszy pominal: liczymy przyrost wsrod punktow
+                # partii tuz przed i po zapisie (w czasie pytan do Geoportalu mogl je zapisac ktos inny)
+                before = cached_points(lats, wanted)
+                TerytCache.objects.bulk_create(objs, ignore_conflicts=True)
+                added = len(cached_points(lats, wanted) - before)
+                inserted += added
+                skipped += len(objs) - added
+
+                done += len(batch)
+                processed += len(batch)
+                if checkpoint:
+                    checkpoint.write_text(str(done))
+                rate = processed / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(
+                    f"{done} rows: {inserted} inserted, {skipped} already cached, "
+                    f"{failed} failed ({rate:.1f} rows/s)"
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Prewarm done: {inserted} inserted, {skipped} already cached, {failed} failed"
+            + (" (rerun without --checkpoint to retry failed points)" if failed else "")
+        ))
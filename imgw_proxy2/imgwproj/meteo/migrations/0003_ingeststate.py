@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0002_terytcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestState',
+            fields=[
+                ('source', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('body_hash', models.CharField(blank=True, max_length=64)),
+                ('item_hashes', models.JSONField(blank=True, default=dict)),
+                ('fetched_at', models.DateTimeField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0003_ingeststate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerytCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_udeg', models.PositiveIntegerField()),
+                ('lat_idx', models.IntegerField()),
+                ('lon_idx', models.IntegerField()),
+                ('teryt4', models.CharField(blank=True, max_length=4, null=True)),
+                ('area_name', models.CharField(blank=True, max_length=120)),
+                ('homogeneous', models.BooleanField(default=False)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('cell_udeg', 'lat_idx', 'lon_idx')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0004_terytcell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='powiat',
+            name='bbox_max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='powiat',
+            name='bbox_max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='powiat',
+            name='bbox_min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='powiat',
+            name='bbox_min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='powiat',
+            name='centroid_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='powiat',
+            name='centroid_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
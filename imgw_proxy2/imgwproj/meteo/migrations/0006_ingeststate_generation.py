@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0005_powiat_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingeststate',
+            name='generation',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
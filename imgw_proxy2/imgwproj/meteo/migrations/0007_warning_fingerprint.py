@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0006_ingeststate_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warning',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0007_warning_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='warning',
+            index=models.Index(fields=['-valid_from', '-id'], name='warning_history_keyset'),
+        ),
+    ]
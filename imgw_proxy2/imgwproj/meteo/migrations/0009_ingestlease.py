@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0008_warning_history_keyset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestLease',
+            fields=[
+                ('source', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=128)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('token', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:17
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_valid_from(apps, schema_editor):
+    Warning = apps.get_model('meteo', 'Warning')
+    WarningCoverage = apps.get_model('meteo', 'WarningCoverage')
+    WarningCoverage.objects.update(valid_from=Subquery(
+        Warning.objects.filter(id=OuterRef('warning_id')).values('valid_from')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meteo', '0009_ingestlease'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='warning',
+            name='warning_history_keyset',
+        ),
+        migrations.AddField(
+            model_name='warningcoverage',
+            name='valid_from',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_valid_from, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='warningcoverage',
+            index=models.Index(fields=['powiat', '-valid_from', '-warning'], name='coverage_history_keyset'),
+        ),
+    ]
@@ -7,6 +7,14 @@ class Powiat(models.Model):
     teryt4 = models.CharField(max_length=4, primary_key=True)
     name = models.CharField(max_length=120, blank=True)
 
+    # geometria liczona raz (manage.py powiat_precompute), WGS84
+    centroid_lat = models.FloatField(null=True, blank=True)
+    centroid_lon = models.FloatField(null=True, blank=True)
+    bbox_min_lat = models.FloatField(null=True, blank=True)
+    bbox_min_lon = models.FloatField(null=True, blank=True)
+    bbox_max_lat = models.FloatField(null=True, blank=True)
+    bbox_max_lon = models.FloatField(null=True, blank=True)
+
     def __str__(self):
         return f"{self.teryt4} {self.name}".strip()
 
@@ -25,15 +33,25 @@ class Warning(models.Model):
     content = models.TextField(blank=True)
     comment = models.TextField(blank=True)
     office = models.CharField(max_length=120, blank=True)
+    # odcisk rekordu IMGW z ostatniego ingestu (sha256) - klucz cache fragmentow JSON
+    fingerprint = models.CharField(max_length=64, blank=True, editable=False)
 
     coverage = models.ManyToManyField(
         'Powiat', through='WarningCoverage', related_name='warnings', blank=True
     )
 
     class Meta:
-        indexes = [models.Index(fields=['valid_from', 'valid_to'])]
+        indexes = [
+            models.Index(fields=['valid_from', 'valid_to']),
+        ]
         ordering = ['-valid_from']
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # kopia valid_from w pokryciu (WarningCoverage.valid_from) musi nadazac za zmiana
+        WarningCoverage.objects.filter(warning=self).exclude(valid_from=self.valid_from) \
+            .update(valid_from=self.valid_from)
+
     @classmethod
     def current_for_powiat(cls, teryt4: str):
         now = timezone.now()
@@ -44,20 +62,29 @@ class Warning(models.Model):
                 coverage__teryt4=teryt4,
             )
             .distinct()
-            .order_by('-level', 'valid_to')
+            .order_by('-level', 'valid_to', 'id')
         )
 
 class WarningCoverage(models.Model):
     warning = models.ForeignKey(Warning, on_delete=models.CASCADE)
     powiat = models.ForeignKey(Powiat, on_delete=models.CASCADE)
+    # kopia Warning.valid_from (utrzymuje ingest_imgw i Warning.save): historia powiatu
+    # filtruje, sortuje i stronicuje po jednym indeksie, bez joinu + DISTINCT + sortowania
+    valid_from = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         unique_together = [('warning', 'powiat')]
         indexes = [
             models.Index(fields=['warning']),
             models.Index(fields=['powiat']),
+            models.Index(fields=['powiat', '-valid_from', '-warning'], name='coverage_history_keyset'),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.valid_from is None:
+            self.valid_from = self.warning.valid_from
+        super().save(*args, **kwargs)
+
 class PointSnapshot(models.Model):
     lat = models.DecimalField(max_digits=9, decimal_places=6)
     lon = models.DecimalField(max_digits=9, decimal_places=6)
@@ -93,4 +120,65 @@ class TerytCache(models.Model):
         indexes = [models.Index(fields=['lat', 'lon'])]
 
     def __str__(self):
-        return f"{self.lat},{self.lon} -> {self.teryt4 or '-'}"
\ No newline at end of file
+        return f"{self.lat},{self.lon} -> {self.teryt4 or '-'}"
+
+
+class TerytCell(models.Model):
+    # komorka siatki lat/lon (bok cell_udeg mikrostopni) dla trybu METEO_TERYT_CACHE_MODE="cell"
+    cell_udeg = models.PositiveIntegerField()
+    lat_idx = models.IntegerField()
+    lon_idx = models.IntegerField()
+
+    teryt4 = models.CharField(max_length=4, null=True, blank=True)
+    area_name = models.CharField(max_length=120, blank=True)
+
+    # True tylko gdy naroza i srodek komorki potwierdzono w tym samym powiecie;
+    # komorki graniczne (False) rozwiazujemy dokladnie dla kazdego punktu
+    homogeneous = models.BooleanField(default=False)
+
+    first_seen = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('cell_udeg', 'lat_idx', 'lon_idx')]
+
+    def __str__(self):
+        state = (self.teryt4 or '-') if self.homogeneous else 'boundary'
+        return f"cell {self.lat_idx},{self.lon_idx} @{self.cell_udeg}udeg -> {state}"
+
+
+class IngestState(models.Model):
+    # stan pobierania zrodla danych (jeden wiersz na feed, np. "imgw")
+    source = models.CharField(max_length=32, primary_key=True)
+
+    # naglowki do zapytan warunkowych (If-None-Match / If-Modified-Since)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+
+    # odciski: calej odpowiedzi i pojedynczych ostrzezen {id: sha256}
+    body_hash = models.CharField(max_length=64, blank=True)
+    item_hashes = models.JSONField(default=dict, blank=True)
+
+    fetched_at = models.DateTimeField(null=True, blank=True)  # ostatnie udane pobranie
+    changed_at = models.DateTimeField(null=True, blank=True)  # ostatnia zmiana w DB
+
+    # numer wersji danych; kazdy zapis ingest_imgw() zwieksza go o 1
+    # (cache w procesach porownuja go, zeby wiedziec, ze trzeba sie przebudowac)
+    generation = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.source} @ {self.fetched_at or '-'}"
+
+
+class IngestLease(models.Model):
+    # dzierzawa pobierania feedu (jeden wiersz na zrodlo): tylko posiadacz pobiera i zapisuje,
+    # pozostale procesy/wezly czytaja DB i obserwuja IngestState.generation
+    source = models.CharField(max_length=32, primary_key=True)
+    holder = models.CharField(max_length=128, blank=True)  # host:pid:losowy sufiks
+    expires_at = models.DateTimeField(null=True, blank=True)  # po tym czasie przejmuje kazdy
+
+    # token ogrodzenia (fencing token): rosnie przy kazdym przejeciu; zapis z nieaktualnym
+    # tokenem (posiadacz, ktory stracil dzierzawe) jest odrzucany
+    token = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.source}: {self.holder or '-'} #{self.token} until {self.expires_at or '-'}"
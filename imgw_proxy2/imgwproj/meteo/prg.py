@@ -0,0 +1,251 @@
+# meteo/prg.py
+"""
+Lokalne mapowanie (lat, lon) -> (teryt4, nazwa) na podstawie granic powiatow z PRG.
+
+Zrodlo: eksport PRG (GeoJSON albo shapefile) w EPSG:4326 (lon/lat).
+Indeks: siatka o boku cell_deg stopni; kazda komorka trzyma liste wielokatow,
+ktorych bbox na nia zachodzi. Dla komorek, przez ktore nie przechodzi zadna
+krawedz danego wielokata, wynik jest staly w calej komorce i zapamietywany,
+wiec typowe zapytanie to odczyt z dict. W komorkach granicznych liczymy
+ray casting tylko po krawedziach z pasa (wiersza) siatki, w ktorym lezy punkt.
+"""
+from __future__ import annotations
+
+import json
+import math
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+
+# klucze atrybutow spotykane w eksportach PRG i w starym prototypie
+TERYT_KEYS = ("teryt_powiat", "teryt", "JPT_KOD_JE", "jpt_kod_je")
+NAME_KEYS = ("name", "nazwa", "JPT_NAZWA_", "jpt_nazwa_")
+
+Ring = list[tuple[float, float]]
+
+
+class CountyPart:
+    """Jeden wielokat (z dziurami) powiatu; regula parzystosci po wszystkich pierscieniach."""
+
+    __slots__ = ("teryt4", "name", "bbox", "row_edges", "edge_cells")
+
+    def __init__(self, teryt4: str, name: str, rings: list[Ring], cell_deg: float):
+        self.teryt4 = teryt4
+        self.name = name
+        xs = [x for ring in rings for x, _ in ring]
+        ys = [y for ring in rings for _, y in ring]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        # krawedzie pogrupowane po wierszach siatki + komorki, ktore krawedzie dotykaja
+        self.row_edges: dict[int, list[tuple[float, float, float, float]]] = {}
+        self.edge_cells: set[tuple[int, int]] = set()
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if (x1, y1) == (x2, y2):
+                    continue
+                ix1, ix2 = sorted((_cell(x1, cell_deg), _cell(x2, cell_deg)))
+                iy1, iy2 = sorted((_cell(y1, cell_deg), _cell(y2, cell_deg)))
+                for iy in range(iy1, iy2 + 1):
+                    if y1 != y2:
+                        self.row_edges.setdefault(iy, []).append((x1, y1, x2, y2))
+                    for ix in range(ix1, ix2 + 1):
+                        self.edge_cells.add((ix, iy))
+
+    def contains(self, lon: float, lat: float, iy: int) -> bool:
+        """Ray casting w kierunku +x po krawedziach z wiersza iy (zawierajacego lat)."""
+        inside = False
+        for x1, y1, x2, y2 in self.row_edges.get(iy, ()):
+            if (y1 > lat) != (y2 > lat):
+                if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+
+def _cell(v: float, cell_deg: float) -> int:
+    return math.floor(v / cell_deg)
+
+
+class CountyIndex:
+    """Indeks przestrzenny powiatow: jednorodna siatka + prefiltr po bbox."""
+
+    def __init__(self, parts: Iterable[tuple[str, str, list[Ring]]], cell_deg: float = 0.1):
+        self.cell_deg = cell_deg
+        self.parts: list[CountyPart] = []
+        self.grid: dict[tuple[int, int], list[int]] = {}
+        # (indeks czesci, komorka) -> czy komorka w calosci lezy w tej czesci
+        self._uniform: dict[tuple[int, tuple[int, int]], bool] = {}
+
+        for teryt4, name, rings in parts:
+            rings = [r for r in rings if len(r) >= 3]
+            if not rings:
+                continue
+            idx = len(self.parts)
+            part = CountyPart(teryt4, name, rings, cell_deg)
+            self.parts.append(part)
+            xmin, ymin, xmax, ymax = part.bbox
+            for ix in range(_cell(xmin, cell_deg), _cell(xmax, cell_deg) + 1):
+                for iy in range(_cell(ymin, cell_deg), _cell(ymax, cell_deg) + 1):
+                    self.grid.setdefault((ix, iy), []).append(idx)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def lookup(self, lat: float, lon: float) -> Optional[tuple[str, str]]:
+        """Zwraca (teryt4, nazwa) albo None, gdy punkt nie lezy w zadnym powiecie."""
+        key = (_cell(lon, self.cell_deg), _cell(lat, self.cell_deg))
+        for idx in self.grid.get(key, ()):
+            part = self.parts[idx]
+            xmin, ymin, xmax, ymax = part.bbox
+            if not (xmin <= lon <= xmax and ymin <= lat <= ymax):
+                continue
+            if key in part.edge_cells:
+                inside = part.contains(lon, lat, key[1])
+            else:
+                inside = self._uniform.get((idx, key))
+                if inside is None:
+                    inside = part.contains(lon, lat, key[1])
+                    self._uniform[(idx, key)] = inside
+            if inside:
+                return part.teryt4, part.name
+        return None
+
+    @classmethod
+    def from_file(cls, path, cell_deg: float = 0.1) -> "CountyIndex":
+        return cls(load_parts(path), cell_deg=cell_deg)
+
+
+def load_parts(path) -> Iterable[tuple[str, str, list[Ring]]]:
+    """Wielokaty powiatow z pliku PRG jako (teryt4, nazwa, pierscienie)."""
+    path = Path(path)
+    if path.suffix.lower() == ".shp":
+        return _parts_from_shapefile(path)
+    return _parts_from_geojson(path)
+
+
+def polygon_centroid(polygons: Iterable[list[Ring]]) -> Optional[tuple[float, float, float]]:
+    """
+    Srodek ciezkosci (wazony polem) wielokatow: (lon, lat, pole w stopniach^2).
+    W kazdym wielokacie pierscien o najwiekszym polu wyznacza orientacje zewnetrznych;
+    pierscienie o przeciwnej orientacji sa dziurami (konwencja GeoJSON i ArcGIS/shapefile).
+    """
+    total = cx = cy = 0.0
+    origin = None  # liczymy wzgledem pierwszego wierzcholka - mniejsze bledy zaokraglen
+    for rings in polygons:
+        stats = []
+        for ring in rings:
+            pts = np.asarray(ring, dtype=float)
+            if len(pts) < 3:
+                continue
+            if origin is None:
+                origin = pts[0].copy()
+            pts = pts - origin
+            x0, y0 = pts[:, 0], pts[:, 1]
+            x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+            cross = x0 * y1 - x1 * y0
+            a = cross.sum() / 2.0
+            if a == 0:
+                continue
+            stats.append((a, ((x0 + x1) * cross).sum() / (6 * a), ((y0 + y1) * cross).sum() / (6 * a)))
+        if not stats:
+            continue
+        outer_sign = math.copysign(1.0, max(stats, key=lambda t: abs(t[0]))[0])
+        for a, rx, ry in stats:
+            w = a * outer_sign  # dodatnie dla zewnetrznych, ujemne dla dziur
+            total += w
+            cx += w * rx
+            cy += w * ry
+    if total <= 0:
+        return None
+    return float(cx / total + origin[0]), float(cy / total + origin[1]), float(total)
+
+
+def rings_bbox(polygons: Iterable[list[Ring]]) -> Optional[tuple[float, float, float, float]]:
+    """(lon_min, lat_min, lon_max, lat_max) wszystkich pierscieni."""
+    arrays = [np.asarray(ring, dtype=float) for rings in polygons for ring in rings if len(ring)]
+    if not arrays:
+        return None
+    pts = np.concatenate(arrays)
+    (xmin, ymin), (xmax, ymax) = pts.min(axis=0), pts.max(axis=0)
+    return float(xmin), float(ymin), float(xmax), float(ymax)
+
+
+def _attr(props: dict, keys: tuple[str, ...]) -> str:
+    for k in keys:
+        v = props.get(k)
+        if v not in (None, ""):
+            return str(v).strip()
+    return ""
+
+
+def _check_lonlat(ring: Ring) -> Ring:
+    x, y = ring[0]
+    if not (-180 <= x <= 180 and -90 <= y <= 90):
+        raise ValueError("PRG boundaries must be exported in EPSG:4326 (lon/lat)")
+    return ring
+
+
+def _parts_from_geojson(path: Path):
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    for feat in data.get("features") or []:
+        props = feat.get("properties") or {}
+        teryt4 = _attr(props, TERYT_KEYS)[:4]
+        name = _attr(props, NAME_KEYS)
+        geom = feat.get("geometry") or {}
+        if geom.get("type") == "Polygon":
+            polygons = [geom["coordinates"]]
+        elif geom.get("type") == "MultiPolygon":
+            polygons = geom["coordinates"]
+        else:
+            continue
+        for poly in polygons:
+            rings = [_check_lonlat([(float(p[0]), float(p[1])) for p in ring]) for ring in poly if ring]
+            yield teryt4, name, rings
+
+
+def _parts_from_shapefile(path: Path):
+    try:
+        import shapefile  # pyshp
+    except ImportError as e:
+        raise ImportError("reading PRG shapefiles requires the 'pyshp' package") from e
+
+    with shapefile.Reader(str(path), encoding="utf-8") as sf:
+        for sr in sf.iterShapeRecords():
+            props = sr.record.as_dict()
+            teryt4 = _attr(props, TERYT_KEYS)[:4]
+            name = _attr(props, NAME_KEYS)
+            pts = sr.shape.points
+            bounds = list(sr.shape.parts) + [len(pts)]
+            # wszystkie pierscienie rekordu razem: regula parzystosci obsluzy dziury
+            rings = [
+                _check_lonlat([(float(x), float(y)) for x, y in pts[a:b]])
+                for a, b in zip(bounds, bounds[1:])
+                if b > a
+            ]
+            yield teryt4, name, rings
+
+
+_index: Optional[CountyIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_county_index() -> Optional[CountyIndex]:
+    """
+    Wspoldzielony (per proces) indeks z settings.METEO_PRG_PATH.
+    None, gdy sciezka nie jest ustawiona; ladowany leniwie przy pierwszym uzyciu.
+    """
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            path = getattr(settings, "METEO_PRG_PATH", None)
+            if path:
+                cell_deg = float(getattr(settings, "METEO_PRG_CELL_DEG", 0.1))
+                _index = CountyIndex.from_file(path, cell_deg=cell_deg)
+            _index_loaded = True
+    return _index
@@ -0,0 +1,59 @@
+# meteo/renderers.py
+"""
+JSONRenderer na orjson (gdy zainstalowany) - ten sam wynik co rest_framework.renderers.JSONRenderer
+przy ustawieniach domyslnych (UNICODE_JSON, COMPACT_JSON), kilka razy szybciej.
+Typy spoza JSON (datetime, Decimal, ...) koduje encoder DRF, wiec format dat sie nie zmienia.
+JSONFragment (gotowe bajty JSON, zob. meteo.fragments) jest wklejany bez zmian przez
+orjson.Fragment (orjson >= 3.9.14); bez niego fragment jest dekodowany i kodowany ponownie.
+"""
+import json
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - bez orjson zwykly JSONRenderer
+    orjson = None
+
+_orjson_fragment = getattr(orjson, "Fragment", None)
+
+
+class JSONFragment(bytes):
+    """Poprawny, zserializowany JSON wstawiany do odpowiedzi w calosci."""
+
+
+class _FragmentEncoder(encoders.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, JSONFragment):
+            return json.loads(obj)
+        return super().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder_class = _FragmentEncoder
+    _encoder = _FragmentEncoder()
+
+    def _default(self, obj):
+        if isinstance(obj, JSONFragment):
+            if _orjson_fragment is not None:
+                return _orjson_fragment(bytes(obj))
+            return orjson.loads(bytes(obj))
+        return self._encoder.default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data,
+            default=self._default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+        # jak JSONRenderer: U+2028/U+2029 escapowane (poprawny JavaScript)
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -0,0 +1,160 @@
+# meteo/response_cache.py
+"""
+Cache gotowych odpowiedzi endpointow /teryt/ (Django cache framework)
+oraz walidatory warunkowego GET (ETag / Last-Modified) i Cache-Control
+dla endpointow ostrzezen.
+
+Klucz: nazwa widoku + znormalizowane parametry + IngestState.generation
++ najblizsza granica valid_from/valid_to dla powiatu. Nowy ingest albo
+uplyw granicy zmienia klucz, wiec wpis przestaje byc uzywany sam z siebie;
+TTL wpisu konczy sie najpozniej na tej granicy. Wpis trzyma payload razem z ETag
+i Last-Modified, a widok szuka go przed zapytaniem o wiersze (cached_response()).
+Backend wybiera settings.METEO_RESPONSE_CACHE (alias z CACHES, None = wylaczony).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .services import current_generation, generation_changed_at
+from .warning_index import next_transition, previous_transition
+
+KEY_PREFIX = "meteo:resp:"
+
+
+def _normalize(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+@dataclass
+class Validators:
+    etag: str
+    last_modified: Optional[datetime]
+    max_age: int
+
+
+def _digest(view: str, teryt4: str, params: dict, generation: int, boundary: Optional[datetime]) -> str:
+    raw = json.dumps(
+        [view, teryt4, sorted((k, _normalize(v)) for k, v in params.items()),
+         generation, _normalize(boundary)],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _max_age(now: datetime, boundary: Optional[datetime], data_age: Optional[float]) -> int:
+    """
+    Sekundy do najblizszej granicy valid_from/valid_to w powiecie (boundary), ale nie dluzej
+    niz do mozliwego kolejnego ingestu (METEO_IMGW_REFRESH_TTL minus wiek danych).
+    """
+    ttl = float(getattr(settings, "METEO_IMGW_REFRESH_TTL", 60))
+    limit = ttl - data_age if data_age is not None else ttl
+    if boundary is not None:
+        limit = min(limit, (boundary - now).total_seconds())
+    return max(0, math.floor(limit))
+
+
+def response_validators(view: str, teryt4: str, params: dict,
+                        *, data_age: Optional[float] = None) -> Validators:
+    """
+    Walidatory odpowiedzi bez zapytania o wiersze: w ramach jednej generacji danych wynik
+    dla powiatu i parametrow zmienia sie tylko na granicy valid_from/valid_to, wiec slaby ETag
+    = generacja + najblizsza granica (+ parametry widoku, ktore trafiaja do tresci),
+    Last-Modified = pozniejsza z chwil: zapis generacji albo ostatnia granica w powiecie.
+    Slaby, bo data_age_s zmienia sie przy kazdym zapytaniu. Z cieplym indeksem (warning_index)
+    304 nie kosztuje zadnego zapytania do DB.
+    max_age: czas, przez ktory odpowiedz na pewno sie nie zmieni (Cache-Control).
+    """
+    now = timezone.now()
+    boundary = next_transition(teryt4, now)
+    digest = _digest(view, teryt4, params, current_generation(), boundary)
+    return _validators(digest, teryt4, now, boundary, data_age)
+
+
+def _validators(digest: str, teryt4: str, now: datetime, boundary: Optional[datetime],
+                data_age: Optional[float]) -> Validators:
+    stamps = [t for t in (generation_changed_at(), previous_transition(teryt4, now)) if t]
+    return Validators('W/"%s"' % digest, max(stamps) if stamps else None, _max_age(now, boundary, data_age))
+
+
+class CachedResponse:
+    """
+    Wynik cached_response(): walidatory zawsze, payload tylko przy trafieniu (inaczej None);
+    po zbudowaniu payloadu widok zapisuje go przez store().
+    """
+
+    def __init__(self, key: Optional[str], validators: Validators, payload: Optional[dict], timeout: int):
+        self.key = key
+        self.validators = validators
+        self.payload = payload
+        self._timeout = timeout
+
+    def store(self, payload: dict) -> dict:
+        if self.key is not None:
+            v = self.validators
+            entry = {"payload": payload, "etag": v.etag, "last_modified": v.last_modified}
+            caches[_alias()].set(self.key, entry, self._timeout)
+        self.payload = payload
+        return payload
+
+
+def _alias() -> Optional[str]:
+    return getattr(settings, "METEO_RESPONSE_CACHE", "default")
+
+
+def cached_response(view: str, teryt4: str, params: dict, *, data_age: Optional[float] = None) -> CachedResponse:
+    """
+    Wpis cache dla widoku, szukany przed zapytaniem o wiersze. params: wszystko, co trafia
+    do tresci lub walidatorow (juz sparsowane), np. {"since": dt}. Trafienie -> payload
+    i zapisane z nim ETag/Last-Modified (bez zapytan poza generacja i granica);
+    brak -> walidatory jak response_validators() i payload=None - widok sprawdza 304,
+    pobiera wiersze i zapisuje payload przez store().
+    """
+    now = timezone.now()
+    boundary = next_transition(teryt4, now)
+    digest = _digest(view, teryt4, params, current_generation(), boundary)
+    alias = _alias()
+    if not alias:
+        return CachedResponse(None, _validators(digest, teryt4, now, boundary, data_age), None, 0)
+
+    key = KEY_PREFIX + digest
+    timeout = float(getattr(settings, "METEO_RESPONSE_CACHE_TIMEOUT", 300))
+    if boundary is not None:
+        timeout = min(timeout, (boundary - now).total_seconds() + 1)
+    timeout = max(1, int(timeout))
+    entry = caches[alias].get(key)
+    if entry is None:
+        return CachedResponse(key, _validators(digest, teryt4, now, boundary, data_age), None, timeout)
+    validators = Validators(entry["etag"], entry["last_modified"], _max_age(now, boundary, data_age))
+    return CachedResponse(key, validators, entry["payload"], timeout)
+
+
+def not_modified(request, validators: Validators):
+    """304 z naglowkami walidatorow i Cache-Control, gdy If-None-Match / If-Modified-Since pasuja; inaczej None."""
+    lm = validators.last_modified
+    response = get_conditional_response(
+        request, etag=validators.etag, last_modified=int(lm.timestamp()) if lm else None,
+    )
+    if response is not None:
+        set_validators(response, validators)
+    return response
+
+
+def set_validators(response, validators: Validators):
+    response["ETag"] = validators.etag
+    if validators.last_modified:
+        response["Last-Modified"] = http_date(validators.last_modified.timestamp())
+    patch_cache_control(response, public=True, max_age=validators.max_age)
+    return response
@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Warning
 
@@ -8,4 +11,38 @@ class WarningSerializer(serializers.ModelSerializer):
             "id","event_name","level","probability",
             "valid_from","valid_to","published_at",
             "content","comment","office"
-        ]
\ No newline at end of file
+        ]
+
+
+@lru_cache(maxsize=8192)
+def _format_dt(value, tz):
+    # to samo co serializers.DateTimeField.to_representation (ISO 8601, strefa biezaca)
+    s = value.astimezone(tz).isoformat()
+    if s.endswith("+00:00"):
+        s = s[:-6] + "Z"
+    return s
+
+
+def serialize_warnings(rows) -> list[dict]:
+    """
+    Szybka sciezka dla list: wiersze z .values(*WarningSerializer.Meta.fields)
+    (albo z indeksu) -> dict w schemacie WarningSerializer, bez maszynerii pol DRF.
+    Daty formatowane raz na wartosc (cache), reszta pol przepisywana.
+    """
+    tz = timezone.get_current_timezone()
+    out = []
+    for r in rows:
+        published = r["published_at"]
+        out.append({
+            "id": r["id"],
+            "event_name": r["event_name"],
+            "level": r["level"],
+            "probability": r["probability"],
+            "valid_from": _format_dt(r["valid_from"], tz),
+            "valid_to": _format_dt(r["valid_to"], tz),
+            "published_at": _format_dt(published, tz) if published is not None else None,
+            "content": r["content"],
+            "comment": r["comment"],
+            "office": r["office"],
+        })
+    return out
@@ -1,24 +1,280 @@
 # meteo/services.py
 from __future__ import annotations
 
+import hashlib
 import json
+import math
+import threading
+import time
 import requests
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from typing import Optional
 
 from django.conf import settings
-from django.db import transaction
-from django.db.models import F
+from django.db import connection, connections, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.utils import timezone
 
-from .models import Warning, Powiat, TerytCache
+from .models import Warning, WarningCoverage, Powiat, TerytCache, TerytCell, IngestState
+from .fragments import forget_fragments
+from .hitcounter import hit_buffer
+from .lease import LeaseLost, acquire_lease, check_fence, lease_ttl
+from .lru import LRUCache, MISS
+from .prg import get_county_index, polygon_centroid, rings_bbox
+from .teryt_grid import BOUNDARY, get_teryt_grid
+from .upstream import upstream
 
 # --- zrodla danych ---
 IMGW_URL = "https://danepubliczne.imgw.pl/api/data/warningsmeteo"
+IMGW_SOURCE = "imgw"  # klucz w IngestState
 GEO_URL  = "https://mapy.geoportal.gov.pl/wss/ims/maps/PRG_gugik_wyszukiwarka/MapServer/1/query"
 
 
+def geoportal_teryt(lat: float, lon: float) -> tuple[Optional[str], Optional[str]]:
+    """Pyta Geoportal (PRG, warstwa powiatow) o (teryt4, nazwa) dla punktu; bez cache."""
+    geom = json.dumps({"x": lon, "y": lat})  # ArcGIS: x=lon, y=lat
+    params = {
+        "f": "pjson",
+        "geometry": geom,
+        "geometryType": "esriGeometryPoint",
+        "inSR": 4326,
+        "spatialRel": "esriSpatialRelIntersects",
+        "outFields": "teryt,nazwa",
+        "returnGeometry": "false",
+    }
+    r = upstream("geoportal").get(GEO_URL, params=params)
+    r.raise_for_status()
+    feats = r.json().get("features") or []
+    if not feats:
+        return None, None
+    attrs = feats[0]["attributes"]
+    return str(attrs.get("teryt")), (attrs.get("nazwa") or "").strip()
+
+
+def county_geometry(polygons) -> dict:
+    """Pola geometrii Powiat (centroid wazony polem + bbox) z wielokatow lon/lat."""
+    fields = {}
+    c = polygon_centroid(polygons)
+    if c is not None:
+        fields["centroid_lon"], fields["centroid_lat"], _ = c
+    bbox = rings_bbox(polygons)
+    if bbox is not None:
+        (fields["bbox_min_lon"], fields["bbox_min_lat"],
+         fields["bbox_max_lon"], fields["bbox_max_lat"]) = bbox
+    return fields
+
+
+def geoportal_county(teryt4: str) -> Optional[dict]:
+    """
+    Nazwa i geometria powiatu z Geoportalu: {"name", "centroid_lat", "centroid_lon", "bbox_*"}.
+    Centroid: z serwera (returnCentroid), inaczej wazony polem z polygonu,
+    a gdy brak geometrii - srodek zasiegu (returnExtentOnly). None = brak powiatu.
+    """
+    params = {
+        "f": "pjson",
+        "where": f"teryt='{teryt4}'",
+        "outFields": "teryt,nazwa",
+        "returnGeometry": "true",
+        "returnCentroid": "true",
+        "outSR": 4326,  # WGS84 (lon/lat)
+    }
+    r = upstream("geoportal").get(GEO_URL, params=params)
+    r.raise_for_status()
+    feats = r.json().get("features") or []
+    if not feats:
+        return None
+
+    a = feats[0].get("attributes") or {}
+    rings = (feats[0].get("geometry") or {}).get("rings") or []
+    # ArcGIS: jedna lista pierscieni, dziury rozpoznajemy po orientacji
+    out = {"name": (a.get("nazwa") or "").strip(), **county_geometry([rings] if rings else [])}
+
+    c = feats[0].get("centroid")
+    if isinstance(c, dict) and c.get("x") is not None and c.get("y") is not None:
+        out["centroid_lon"], out["centroid_lat"] = float(c["x"]), float(c["y"])
+
+    if "centroid_lat" not in out or "bbox_min_lat" not in out:
+        r2 = upstream("geoportal").get(
+            GEO_URL,
+            params={
+                "f": "pjson",
+                "where": f"teryt='{teryt4}'",
+                "returnExtentOnly": "true",
+                "outSR": 4326,
+            },
+        )
+        r2.raise_for_status()
+        ext = r2.json().get("extent") or {}
+        xmin, xmax = ext.get("xmin"), ext.get("xmax")
+        ymin, ymax = ext.get("ymin"), ext.get("ymax")
+        if None not in (xmin, xmax, ymin, ymax):
+            out.setdefault("bbox_min_lon", xmin)
+            out.setdefault("bbox_min_lat", ymin)
+            out.setdefault("bbox_max_lon", xmax)
+            out.setdefault("bbox_max_lat", ymax)
+            out.setdefault("centroid_lon", (xmin + xmax) / 2.0)
+            out.setdefault("centroid_lat", (ymin + ymax) / 2.0)
+    return out
+
+
+def geoportal_county_list() -> list[tuple[str, str]]:
+    """Wszystkie powiaty (teryt4, nazwa) z warstwy PRG w Geoportalu."""
+    params = {
+        "f": "pjson",
+        "where": "1=1",
+        "outFields": "teryt,nazwa",
+        "returnGeometry": "false",
+    }
+    r = upstream("geoportal").get(GEO_URL, params=params, read_timeout=30)
+    r.raise_for_status()
+    out = []
+    for f in r.json().get("features") or []:
+        a = f.get("attributes") or {}
+        if a.get("teryt"):
+            out.append((str(a["teryt"]), (a.get("nazwa") or "").strip()))
+    return out
+
+
+_teryt_lru: Optional[LRUCache] = None
+_teryt_lru_lock = threading.Lock()
+
+
+def teryt_lru() -> LRUCache:
+    """
+    Pierwszy (per proces) poziom cache TERYT przed tabela TerytCache, klucz: (lat, lon).
+    Rozmiar i TTL: METEO_TERYT_LRU_SIZE / METEO_TERYT_LRU_TTL / METEO_TERYT_LRU_NEGATIVE_TTL.
+    """
+    global _teryt_lru
+    if _teryt_lru is None:
+        with _teryt_lru_lock:
+            if _teryt_lru is None:
+                _teryt_lru = LRUCache(
+                    maxsize=int(getattr(settings, "METEO_TERYT_LRU_SIZE", 10000)),
+                    ttl=getattr(settings, "METEO_TERYT_LRU_TTL", 3600),
+                    negative_ttl=getattr(settings, "METEO_TERYT_LRU_NEGATIVE_TTL", 300),
+                )
+    return _teryt_lru
+
+
+def teryt_cell_key(lat: float, lon: float) -> tuple[int, int, int]:
+    """(cell_udeg, lat_idx, lon_idx) komorki o boku settings.METEO_TERYT_CELL_DEG."""
+    udeg = max(1, round(float(getattr(settings, "METEO_TERYT_CELL_DEG", 0.01)) * 1_000_000))
+    return udeg, math.floor(round(lat * 1_000_000) / udeg), math.floor(round(lon * 1_000_000) / udeg)
+
+
+def _cell_samples(key: tuple[int, int, int]) -> list[tuple[float, float]]:
+    """Naroza (lekko do srodka) i srodek komorki."""
+    udeg, i, j = key
+    deg = udeg / 1_000_000
+    lat0, lon0 = i * deg, j * deg
+    inset = deg * 0.001
+    return [
+        (round(lat0 + inset, 6), round(lon0 + inset, 6)),
+        (round(lat0 + inset, 6), round(lon0 + deg - inset, 6)),
+        (round(lat0 + deg - inset, 6), round(lon0 + inset, 6)),
+        (round(lat0 + deg - inset, 6), round(lon0 + deg - inset, 6)),
+        (round(lat0 + deg / 2, 6), round(lon0 + deg / 2, 6)),
+    ]
+
+
+CELL_CHECK_QUEUE = 1000  # max. komorek czekajacych na sprawdzenie w tle (nadmiar pomijamy)
+
+_cell_checks: Optional[ThreadPoolExecutor] = None
+_cell_pending: set[tuple[int, int, int]] = set()
+_cell_lock = threading.Lock()
+
+
+def _remember_cell(key: tuple[int, int, int], teryt: Optional[str], name: Optional[str]) -> None:
+    """
+    Zapisuje komorke po rozwiazaniu pierwszego punktu w jej wnetrzu.
+    Jednorodna tylko, gdy wszystkie probki trafiaja w ten sam powiat co punkt.
+    Probki sprawdza siatka/PRG, jesli odpowiadaja dla wszystkich; inaczej Geoportal
+    w jednym watku w tle - nigdy w watku zapytania.
+    """
+    samples = [_teryt_offline(a, b) for a, b in _cell_samples(key)]
+    if all(hit is not MISS for hit in samples):
+        _store_cell(key, teryt, name, all(hit[0] == teryt for hit in samples))
+        return
+
+    global _cell_checks
+    with _cell_lock:
+        if key in _cell_pending or len(_cell_pending) >= CELL_CHECK_QUEUE:
+            return
+        _cell_pending.add(key)
+        if _cell_checks is None:
+            _cell_checks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="meteo-cells")
+    _cell_checks.submit(_check_cell, key, teryt, name)
+
+
+def _check_cell(key: tuple[int, int, int], teryt: Optional[str], name: Optional[str]) -> None:
+    # blad Geoportalu -> nic nie zapisujemy (sprobujemy przy kolejnym punkcie)
+    try:
+        homogeneous = all(geoportal_teryt(a, b)[0] == teryt for a, b in _cell_samples(key))
+    except Exception:
+        return
+    else:
+        _store_cell(key, teryt, name, homogeneous)
+    finally:
+        with _cell_lock:
+            _cell_pending.discard(key)
+        connections.close_all()  # watek ma wlasne polaczenie do DB
+
+
+def _store_cell(key: tuple[int, int, int], teryt: Optional[str], name: Optional[str], homogeneous: bool) -> None:
+    udeg, i, j = key
+    TerytCell.objects.get_or_create(
+        cell_udeg=udeg, lat_idx=i, lon_idx=j,
+        defaults={"teryt4": teryt, "area_name": name or "", "homogeneous": homogeneous},
+    )
+    teryt_lru().set(("cell",) + key, (teryt, name, homogeneous), negative=teryt is None)
+
+
+def _cell_lookup(key: tuple[int, int, int]):
+    """(teryt4, nazwa, homogeneous) dla znanej komorki albo None."""
+    lru = teryt_lru()
+    cached = lru.get(("cell",) + key)
+    if cached is not MISS:
+        return cached
+    udeg, i, j = key
+    rec = (
+        TerytCell.objects.filter(cell_udeg=udeg, lat_idx=i, lon_idx=j)
+        .values_list("teryt4", "area_name", "homogeneous")
+        .first()
+    )
+    if rec is not None:
+        lru.set(("cell",) + key, rec, negative=rec[0] is None)
+    return rec
+
+
+def _teryt_offline(lat: float, lon: float):
+    """Siatka TERYT i indeks PRG (bez sieci i DB); MISS = trzeba pytac dalej."""
+    fallback = getattr(settings, "METEO_GEOPORTAL_FALLBACK", True)
+
+    # 0a) prekompilowana siatka (mmap); komorki graniczne ida do dokladnego sprawdzenia
+    grid = get_teryt_grid()
+    if grid is not None:
+        hit = grid.lookup(lat, lon)
+        if hit is not BOUNDARY:
+            if hit is not None:
+                return hit
+            if not fallback:
+                return None, None
+
+    # 0b) lokalne granice PRG
+    index = get_county_index()
+    if index is not None:
+        hit = index.lookup(lat, lon)
+        if hit is not None:
+            return hit
+        if not fallback:
+            return None, None
+    return MISS
+
+
 def teryt4_from_latlon(
     lat: float,
     lon: float,
@@ -26,10 +282,16 @@ def teryt4_from_latlon(
     use_cache: Optional[bool] = None,
 ) -> tuple[Optional[str], Optional[str]]:
     """
-    Mapuje (lat, lon) -> (teryt4, nazwa_pow) z wykorzystaniem trwalego cache'u w DB.
+    Mapuje (lat, lon) -> (teryt4, nazwa_pow).
+    Kolejnosc: siatka TERYT (settings.METEO_TERYT_GRID_PATH, mmap),
+    lokalny indeks PRG (settings.METEO_PRG_PATH) - oba bez sieci i DB,
+    potem trwaly cache w DB, na koncu Geoportal (jesli METEO_GEOPORTAL_FALLBACK).
+    use_cache dotyczy tylko cache (LRU/komorki/TerytCache); siatka i PRG odpowiadaja zawsze pierwsze:
     - use_cache=True  -> korzysta z TerytCache (read/write)
-    - use_cache=False -> pomija cache, pyta Geoportal i NIE zapisuje do cache
+    - use_cache=False -> pomija cache; poza siatka/PRG pyta Geoportal i NIE zapisuje do cache
     - use_cache=None  -> decyzja wg settings.METEO_CACHE_ENABLED (domyslnie True)
+    Przy METEO_TERYT_CACHE_MODE="cell" punkty w jednorodnych komorkach siatki
+    (METEO_TERYT_CELL_DEG) dostaja wynik komorki; komorki graniczne jak wyzej.
     """
     if use_cache is None:
         use_cache = getattr(settings, "METEO_CACHE_ENABLED", True)
@@ -38,69 +300,175 @@ def teryt4_from_latlon(
     lat = round(float(lat), 6)
     lon = round(float(lon), 6)
 
-    # 1) proba odczytu z cache (DB)
+    hit = _teryt_offline(lat, lon)
+    if hit is not MISS:
+        return hit
+
+    # 1) proba odczytu z cache: najpierw LRU w procesie, (komorka), potem DB;
+    #    licznik hits/last_used idzie do bufora (hitcounter), nie do DB
+    lru = teryt_lru()
+    cell_key = None
+    if use_cache and getattr(settings, "METEO_TERYT_CACHE_MODE", "exact") == "cell":
+        cell_key = teryt_cell_key(lat, lon)
     if use_cache:
+        cached = lru.get((lat, lon))
+        if cached is not MISS:
+            teryt, name, pk = cached
+            hit_buffer().record(pk)
+            return teryt, name
+        if cell_key is not None:
+            cell = _cell_lookup(cell_key)
+            if cell is not None:
+                if cell[2]:
+                    return cell[0], cell[1]
+                cell_key = None  # komorka graniczna juz znana -> tylko dokladny wynik
         try:
-            rec = TerytCache.objects.get(lat=lat, lon=lon)
-            TerytCache.objects.filter(pk=rec.pk).update(
-                hits=F("hits") + 1,
-                last_used=timezone.now(),
-            )
+            rec = TerytCache.objects.only("pk", "teryt4", "area_name").get(lat=lat, lon=lon)
+            hit_buffer().record(rec.pk)
+            lru.set((lat, lon), (rec.teryt4, rec.area_name, rec.pk), negative=rec.teryt4 is None)
             return rec.teryt4, rec.area_name
         except TerytCache.DoesNotExist:
             pass
 
     # 2) zapytanie do Geoportalu
-    geom = json.dumps({"x": lon, "y": lat})  # ArcGIS: x=lon, y=lat
-    params = {
-        "f": "pjson",
-        "geometry": geom,
-        "geometryType": "esriGeometryPoint",
-        "inSR": 4326,
-        "spatialRel": "esriSpatialRelIntersects",
-        "outFields": "teryt,nazwa",
-        "returnGeometry": "false",
-    }
-    r = requests.get(GEO_URL, params=params, timeout=10)
-    r.raise_for_status()
-    feats = r.json().get("features") or []
-    if not feats:
-        # zapisujemy „brak” tylko gdy cache wlaczony; dzieki temu nie spamujemy Geoportalu
-        if use_cache:
-            with transaction.atomic():
-                obj, created = TerytCache.objects.get_or_create(
-                    lat=lat,
-                    lon=lon,
-                    defaults={"teryt4": None, "area_name": ""},
-                )
-                if not created:
-                    TerytCache.objects.filter(pk=obj.pk).update(
-                        last_used=timezone.now(),
-                        hits=F("hits") + 1,
-                    )
-        return None, None
+    teryt, name = geoportal_teryt(lat, lon)
+    if use_cache:
+        _remember_teryt(lat, lon, teryt, name, cell_key)
+    return (teryt, name) if teryt else (None, None)
 
-    attrs = feats[0]["attributes"]
-    teryt = str(attrs.get("teryt"))
-    name  = (attrs.get("nazwa") or "").strip()
 
-    # 3) zapis do cache (jesli wlaczony)
-    if use_cache:
-        with transaction.atomic():
-            obj, created = TerytCache.objects.get_or_create(
-                lat=lat,
-                lon=lon,
-                defaults={"teryt4": teryt, "area_name": name, "hits": 1},
+def _remember_teryt(lat: float, lon: float, teryt: Optional[str], name: Optional[str],
+                    cell_key: Optional[tuple[int, int, int]]) -> None:
+    """Zapis wyniku Geoportalu do TerytCache i LRU (+ komorka, jesli cell_key); "brak" tez."""
+    if not teryt:
+        # zapisujemy „brak”; dzieki temu nie spamujemy Geoportalu
+        teryt, name = None, None
+        defaults = {"teryt4": None, "area_name": ""}
+        changes = {}
+    else:
+        defaults = {"teryt4": teryt, "area_name": name, "hits": 1}
+        changes = {"teryt4": teryt, "area_name": name}
+    with transaction.atomic():
+        obj, created = TerytCache.objects.get_or_create(lat=lat, lon=lon, defaults=defaults)
+        if not created:
+            TerytCache.objects.filter(pk=obj.pk).update(
+                **changes,
+                last_used=timezone.now(),
+                hits=F("hits") + 1,
             )
-            if not created:
-                TerytCache.objects.filter(pk=obj.pk).update(
-                    teryt4=teryt,
-                    area_name=name,
-                    last_used=timezone.now(),
-                    hits=F("hits") + 1,
-                )
+    teryt_lru().set((lat, lon), (teryt, name, obj.pk), negative=teryt is None)
+    if cell_key is not None:
+        _remember_cell(cell_key, teryt, name)
+
+
+def teryt4_from_latlon_many(
+    points: list[tuple[float, float]],
+    *,
+    timeout: Optional[float] = None,
+) -> list[Optional[tuple[Optional[str], Optional[str]]]]:
+    """
+    teryt4_from_latlon dla wielu punktow naraz, wynik w kolejnosci wejscia.
+    Powtorzone punkty liczone raz; siatka/PRG/LRU bez DB, brakujace punkty
+    jednym zapytaniem do TerytCache (i TerytCell w trybie "cell"), dopiero reszta
+    (Geoportal) rownolegle (settings.METEO_BATCH_GEOCODE_WORKERS) w limicie timeout sekund.
+    None zamiast wyniku = punkt nierozwiazany (blad Geoportalu albo koniec czasu).
+    """
+    keys = [(round(float(lat), 6), round(float(lon), 6)) for lat, lon in points]
+    use_cache = getattr(settings, "METEO_CACHE_ENABLED", True)
+    cell_mode = getattr(settings, "METEO_TERYT_CACHE_MODE", "exact") == "cell"
+    lru = teryt_lru()
+    found: dict[tuple[float, float], tuple[Optional[str], Optional[str]]] = {}
+    pending = []
+    for key in dict.fromkeys(keys):
+        hit = _teryt_offline(*key)
+        if hit is MISS and use_cache:
+            cached = lru.get(key)
+            if cached is not MISS:
+                hit_buffer().record(cached[2])
+                hit = cached[:2]
+        if hit is MISS:
+            pending.append(key)
+        else:
+            found[key] = hit
+
+    if use_cache and pending:
+        wanted = set(pending)
+        for i in range(0, len(pending), 500):
+            chunk = pending[i:i + 500]
+            for pk, lat, lon, teryt, name in TerytCache.objects.filter(
+                lat__in=[k[0] for k in chunk], lon__in=[k[1] for k in chunk],
+            ).values_list("pk", "lat", "lon", "teryt4", "area_name"):
+                key = (round(float(lat), 6), round(float(lon), 6))
+                if key in wanted and key not in found:
+                    hit_buffer().record(pk)
+                    lru.set(key, (teryt, name, pk), negative=teryt is None)
+                    found[key] = (teryt, name)
+        if cell_mode:
+            found.update(_cell_lookup_many([key for key in pending if key not in found]))
+
+    misses = [key for key in pending if key not in found]
+    if misses:
+        # Geoportal rownolegle, zapis do cache w tym watku (rownolegle zapisy blokuja SQLite)
+        for key, (teryt, name) in _geoportal_many(misses, timeout).items():
+            if use_cache:
+                cell_key = teryt_cell_key(*key) if cell_mode else None
+                if cell_key is not None and _cell_lookup(cell_key) is not None:
+                    cell_key = None  # komorka juz znana (graniczna)
+                _remember_teryt(*key, teryt, name, cell_key)
+            found[key] = (teryt, name) if teryt else (None, None)
+    return [found.get(key) for key in keys]
+
+
+def _cell_lookup_many(keys: list[tuple[float, float]]) -> dict[tuple[float, float], tuple]:
+    """Punkty w znanych jednorodnych komorkach (LRU, potem jedno zapytanie do TerytCell na 500 komorek)."""
+    lru = teryt_lru()
+    by_cell: dict[tuple[int, int, int], list[tuple[float, float]]] = {}
+    for key in keys:
+        by_cell.setdefault(teryt_cell_key(*key), []).append(key)
+    cells = {}
+    unknown = []
+    for cell_key in by_cell:
+        cached = lru.get(("cell",) + cell_key)
+        if cached is not MISS:
+            cells[cell_key] = cached
+        else:
+            unknown.append(cell_key)
+    for i in range(0, len(unknown), 500):
+        chunk = unknown[i:i + 500]
+        wanted = set(chunk)
+        for udeg, lat_idx, lon_idx, teryt, name, homogeneous in TerytCell.objects.filter(
+            cell_udeg=chunk[0][0],
+            lat_idx__in=[c[1] for c in chunk], lon_idx__in=[c[2] for c in chunk],
+        ).values_list("cell_udeg", "lat_idx", "lon_idx", "teryt4", "area_name", "homogeneous"):
+            cell_key = (udeg, lat_idx, lon_idx)
+            if cell_key in wanted:
+                cells[cell_key] = (teryt, name, homogeneous)
+                lru.set(("cell",) + cell_key, cells[cell_key], negative=teryt is None)
+    return {
+        key: (cell[0], cell[1])
+        for cell_key, cell in cells.items() if cell[2]
+        for key in by_cell[cell_key]
+    }
+
 
-    return teryt, name
+def _geoportal_many(keys: list[tuple[float, float]], timeout: Optional[float]) -> dict:
+    """geoportal_teryt dla keys we wlasnej puli (bez DB); bledy i punkty po czasie pomijane."""
+    workers = max(1, min(len(keys), int(getattr(settings, "METEO_BATCH_GEOCODE_WORKERS", 8))))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="meteo-geocode")
+    futures = {pool.submit(geoportal_teryt, *key): key for key in keys}
+    out = {}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                out[futures[future]] = future.result()
+            except Exception:
+                pass  # np. Geoportal niedostepny - punkt zostaje nierozwiazany
+    except FutureTimeout:
+        pass
+    finally:
+        # nieruszone punkty anulujemy; trwajace zapytania koncza sie w tle (timeout klienta)
+        pool.shutdown(wait=False, cancel_futures=True)
+    return out
 
 
 def _pl_to_utc(s: str) -> Optional[datetime]:
@@ -113,51 +481,536 @@ def _pl_to_utc(s: str) -> Optional[datetime]:
     return dt_local.astimezone(ZoneInfo("UTC"))
 
 
+def parse_dt_local_utc(s: Optional[str]) -> Optional[datetime]:
+    """
+    Przyjmuje np. '2025-09-14' albo '2025-09-14T12:30:00' (czas lokalny PL)
+    i zwraca aware UTC. Gdy podano sama date – 00:00:00 lokalnie; bledny format -> None.
+    """
+    if not s:
+        return None
+    try:
+        if len(s) == 10:
+            dt = datetime.strptime(s, "%Y-%m-%d")
+        else:
+            dt = datetime.fromisoformat(s)
+    except Exception:
+        return None
+    return dt.replace(tzinfo=ZoneInfo("Europe/Warsaw")).astimezone(ZoneInfo("UTC"))
+
+
 def fetch_imgw() -> list[dict]:
     """Pobiera surowy feed IMGW (lista ostrzezen dla calej Polski)."""
-    r = requests.get(IMGW_URL, timeout=20)
+    r = upstream("imgw").get(IMGW_URL)
     r.raise_for_status()
     return r.json()
 
 
+def fetch_imgw_conditional(etag: str = "", last_modified: str = "") -> requests.Response:
+    """
+    Jak fetch_imgw(), ale zwraca cala odpowiedz i wysyla naglowki warunkowe,
+    jesli znamy ETag / Last-Modified z poprzedniego pobrania (304 = bez zmian).
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    r = upstream("imgw").get(IMGW_URL, headers=headers)
+    r.raise_for_status()
+    return r
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _item_hash(it: dict) -> str:
+    """Odcisk pojedynczego ostrzezenia niezalezny od kolejnosci kluczy w JSON."""
+    return _sha256(json.dumps(it, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+
+_WARNING_FIELDS = [
+    "event_name", "level", "probability",
+    "valid_from", "valid_to", "published_at",
+    "content", "comment", "office", "fingerprint",
+]
+
+
+@dataclass
+class IngestStats:
+    """Podsumowanie ingest_imgw(): co zapisano i ile to kosztowalo."""
+    upserted: int = 0
+    unchanged: int = 0          # ostrzezenia pominiete, bo ich odcisk sie nie zmienil
+    feed_unchanged: bool = False  # 304 albo identyczna tresc calego feedu -> DB nietknieta
+    coverage_added: int = 0
+    coverage_removed: int = 0
+    queries: int = 0
+    duration_ms: float = 0.0
+
+    def __str__(self):
+        if self.feed_unchanged:
+            return "feed unchanged"
+        return (
+            f"{self.upserted} warnings ({self.unchanged} unchanged), "
+            f"+{self.coverage_added}/-{self.coverage_removed} coverage, "
+            f"{self.queries} queries, {self.duration_ms:.1f} ms"
+        )
+
+
+def _warning_from_item(it: dict) -> Warning:
+    return Warning(
+        id=str(it.get("id") or "").strip(),
+        event_name=(it.get("nazwa_zdarzenia") or "").strip(),
+        level=int(str(it.get("stopien") or "0")),
+        probability=int(str(it.get("prawdopodobienstwo") or "0")),
+        valid_from=_pl_to_utc(it.get("obowiazuje_od")),
+        valid_to=_pl_to_utc(it.get("obowiazuje_do")),
+        published_at=_pl_to_utc(it.get("opublikowano")),
+        content=it.get("tresc") or "",
+        comment=it.get("komentarz") or "",
+        office=it.get("biuro") or "",
+        fingerprint=_item_hash(it),
+    )
+
+
+def _teryts_from_item(it: dict) -> list[str]:
+    return [
+        str(x).strip()
+        for x in (it.get("teryt") or [])
+        if str(x).isdigit() and len(str(x)) == 4
+    ]
+
+
+_generation = {"value": None, "changed_at": None, "fetched_at": None, "checked": 0.0}  # per proces, odczyt throttlowany
+
+
+def _bump_generation() -> None:
+    """Zwieksza IngestState.generation (wywolywane w transakcji zapisu ostrzezen)."""
+    now = timezone.now()
+    updated = IngestState.objects.filter(source=IMGW_SOURCE).update(
+        generation=F("generation") + 1, changed_at=now,
+    )
+    if not updated:
+        IngestState.objects.create(source=IMGW_SOURCE, generation=1, changed_at=now)
+    # po commicie nasz proces od razu widzi nowa wartosc
+    transaction.on_commit(lambda: _generation.update(checked=0.0))
+
+
+def current_generation() -> int:
+    """
+    Aktualny numer wersji danych ostrzezen (IngestState.generation).
+    Czytany z DB najwyzej raz na settings.METEO_GENERATION_POLL sekund (domyslnie 1).
+    """
+    poll = float(getattr(settings, "METEO_GENERATION_POLL", 1.0))
+    now = time.monotonic()
+    if _generation["value"] is None or now - _generation["checked"] >= poll:
+        value, changed_at, fetched_at = (
+            IngestState.objects.filter(source=IMGW_SOURCE)
+            .values_list("generation", "changed_at", "fetched_at")
+            .first()
+        ) or (0, None, None)
+        _generation.update(value=value, changed_at=changed_at, fetched_at=fetched_at, checked=now)
+    return _generation["value"]
+
+
+def generation_changed_at() -> Optional[datetime]:
+    """Czas zapisu aktualnej generacji danych (IngestState.changed_at), odczytany z current_generation()."""
+    current_generation()
+    return _generation["changed_at"]
+
+
+def ingest_imgw(items: list[dict]) -> IngestStats:
+    """
+    Zbiorczy upsert rekordow IMGW po id + M2M z powiatami (TERYT-4).
+    Stala liczba zapytan niezaleznie od rozmiaru feedu, wszystko w jednej transakcji:
+      1) bulk_create Powiat (ignore_conflicts)
+      2) bulk_create Warning (update_conflicts po id)
+      3) odczyt istniejacego pokrycia dla tych ostrzezen (+ jeden update kopii valid_from,
+         jesli ktores ostrzezenie zmienilo poczatek)
+      4) delete nieaktualnych par + bulk_create nowych par WarningCoverage
+    Ostrzezenie bez listy TERYT zachowuje dotychczasowe pokrycie (jak coverage.set()).
+    """
+    stats = IngestStats()
+    started = time.perf_counter()
+
+    # ostatni rekord o danym id wygrywa (bulk upsert nie moze dotknac wiersza 2x)
+    warnings: dict[str, Warning] = {}
+    wanted: dict[str, set[str]] = {}
+    for it in items:
+        w = _warning_from_item(it)
+        if not w.id:
+            continue
+        warnings[w.id] = w
+        teryts = _teryts_from_item(it)
+        if teryts:
+            wanted[w.id] = set(teryts)
+        else:
+            wanted.pop(w.id, None)
+
+    if not warnings:
+        return stats
+
+    def _count_queries(execute, sql, params, many, context):
+        stats.queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(_count_queries), transaction.atomic():
+        all_teryts = set().union(*wanted.values()) if wanted else set()
+        if all_teryts:
+            Powiat.objects.bulk_create(
+                [Powiat(teryt4=t4) for t4 in sorted(all_teryts)],
+                ignore_conflicts=True,
+            )
+
+        Warning.objects.bulk_create(
+            list(warnings.values()),
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=_WARNING_FIELDS,
+        )
+
+        existing: dict[tuple[str, str], int] = {}
+        drifted = set()  # ostrzezenia, ktorym zmienil sie valid_from (kopia w pokryciu)
+        for pk, wid, t4, valid_from in (
+            WarningCoverage.objects.filter(warning_id__in=list(warnings))
+            .values_list("pk", "warning_id", "powiat_id", "valid_from")
+        ):
+            existing[(wid, t4)] = pk
+            if valid_from != warnings[wid].valid_from:
+                drifted.add(wid)
+        if drifted:
+            WarningCoverage.objects.filter(warning_id__in=sorted(drifted)).update(valid_from=Subquery(
+                Warning.objects.filter(id=OuterRef("warning_id")).values("valid_from")[:1]
+            ))
+
+        if wanted:
+            wanted_pairs = {(wid, t4) for wid, teryts in wanted.items() for t4 in teryts}
+
+            stale = [pk for (wid, t4), pk in existing.items() if wid in wanted and (wid, t4) not in wanted_pairs]
+            if stale:
+                WarningCoverage.objects.filter(pk__in=stale).delete()
+            missing = wanted_pairs.difference(existing)
+            if missing:
+                WarningCoverage.objects.bulk_create(
+                    [WarningCoverage(warning_id=wid, powiat_id=t4, valid_from=warnings[wid].valid_from)
+                     for wid, t4 in sorted(missing)],
+                    ignore_conflicts=True,
+                )
+            stats.coverage_removed = len(stale)
+            stats.coverage_added = len(missing)
+
+        _bump_generation()
+        ids = list(warnings)
+        transaction.on_commit(lambda: forget_fragments(ids))
+
+    stats.upserted = len(warnings)
+    stats.duration_ms = (time.perf_counter() - started) * 1000
+    return stats
+
+
 def upsert_imgw(items: list[dict]) -> int:
     """
     Upsert rekordow IMGW po id + M2M z powiatami (TERYT-4).
-    Zwraca liczbe zaktualizowanych/dodanych ostrzezen.
+    Zwraca liczbe zaktualizowanych/dodanych ostrzezen (szczegoly: ingest_imgw()).
     """
-    upserted = 0
+    return ingest_imgw(items).upserted
+
+
+def sync_imgw(*, force: bool = False, fence: Optional[int] = None) -> IngestStats:
+    """
+    Pobiera feed IMGW i zapisuje tylko to, co sie zmienilo od ostatniego pobrania.
+    - zapytanie warunkowe (ETag / Last-Modified z IngestState); 304 -> brak zapisu
+    - identyczny odcisk calej odpowiedzi -> brak zapisu
+    - w pozostalych przypadkach ingest_imgw() tylko dla ostrzezen o zmienionym odcisku
+    force=True -> bez naglowkow warunkowych i z zapisem wszystkich ostrzezen.
+    fence: token dzierzawy (meteo.lease); zapisy w jednej transakcji z check_fence(),
+    nieaktualny token -> LeaseLost i nic nie zostaje zapisane.
+    """
+    state, _ = IngestState.objects.get_or_create(source=IMGW_SOURCE)
+    if force:
+        r = fetch_imgw_conditional()
+    else:
+        r = fetch_imgw_conditional(state.etag, state.last_modified)
+    now = timezone.now()
+
+    with transaction.atomic():
+        if fence is not None:
+            check_fence(IMGW_SOURCE, fence)
+        return _store_imgw_response(state, r, now, force)
+
+
+def _store_imgw_response(state: IngestState, r: requests.Response, now: datetime, force: bool) -> IngestStats:
+    """Zapis odpowiedzi IMGW (czesc sync_imgw() w transakcji)."""
+    state.fetched_at = now
+    if r.status_code == 304:
+        state.save(update_fields=["fetched_at"])
+        return IngestStats(feed_unchanged=True)
+
+    state.etag = r.headers.get("ETag", "")
+    state.last_modified = r.headers.get("Last-Modified", "")
+    body_hash = _sha256(r.content)
+    if body_hash == state.body_hash and not force:
+        state.save(update_fields=["fetched_at", "etag", "last_modified"])
+        return IngestStats(feed_unchanged=True)
+
+    items = r.json()
+    hashes = {}
+    changed = []
+    unchanged = 0  # tylko pozycje z id, ktorych odcisk faktycznie porownano
     for it in items:
         wid = str(it.get("id") or "").strip()
         if not wid:
             continue
+        h = _item_hash(it)
+        if force or state.item_hashes.get(wid) != h:
+            changed.append(it)
+        else:
+            unchanged += 1
+        hashes[wid] = h
 
-        obj, _ = Warning.objects.update_or_create(
-            id=wid,
-            defaults=dict(
-                event_name=(it.get("nazwa_zdarzenia") or "").strip(),
-                level=int(str(it.get("stopien") or "0")),
-                probability=int(str(it.get("prawdopodobienstwo") or "0")),
-                valid_from=_pl_to_utc(it.get("obowiazuje_od")),
-                valid_to=_pl_to_utc(it.get("obowiazuje_do")),
-                published_at=_pl_to_utc(it.get("opublikowano")),
-                content=it.get("tresc") or "",
-                comment=it.get("komentarz") or "",
-                office=it.get("biuro") or "",
-            ),
-        )
-        # powiazanie z powiatami (lista teryt-4)
-        teryts = [
-            str(x).strip()
-            for x in (it.get("teryt") or [])
-            if str(x).isdigit() and len(str(x)) == 4
-        ]
-        if teryts:
-            powiaty = []
-            for t4 in teryts:
-                p, _ = Powiat.objects.get_or_create(teryt4=t4)
-                powiaty.append(p)
-            obj.coverage.set(powiaty)
+    stats = ingest_imgw(changed)
+    stats.unchanged = unchanged
+
+    state.body_hash = body_hash
+    state.item_hashes = hashes
+    if changed:
+        state.changed_at = now
+    # generation zmienia ingest_imgw() - nie nadpisujemy jej stara wartoscia
+    state.save(update_fields=[
+        "fetched_at", "etag", "last_modified", "body_hash", "item_hashes", "changed_at",
+    ])
+    return stats
+
+
+# --- koordynacja odswiezania feedu IMGW ---
+
+@dataclass
+class RefreshResult:
+    """Wynik refresh_imgw(): czy dane sa aktualne i jak bardzo sa stare."""
+    ok: bool                            # ostatnia proba pobrania IMGW udana
+    refreshed: bool                     # ten wywolujacy dostal wynik swiezego pobrania
+    fetched_at: Optional[datetime]      # kiedy ostatnio udalo sie pobrac feed
+    age_seconds: Optional[float]        # wiek danych w DB (None = nigdy nie pobrane)
+    revalidating: bool = False          # odpowiedz z danych sprzed chwili, pobieranie w tle
+
+
+_refresh_lock = threading.Lock()
+_refresh_bg_lock = threading.Lock()
+_refresh_state = {
+    "seq": 0,           # licznik zakonczonych prob pobrania
+    "ok": False,        # wynik ostatniej proby
+    "last_ok": None,    # time.monotonic() ostatniego udanego pobrania
+    "fetched_at": None, # to samo jako aware datetime (do odpowiedzi)
+    "background": False, # trwa odswiezanie w tle (stale-while-revalidate)
+    "follower_gave_up": None,  # time.monotonic(), gdy posiadacz dzierzawy ostatnio nie zdazyl
+}
+
+
+def _refresh_result(refreshed: bool, revalidating: bool = False) -> RefreshResult:
+    # pobranie z innego procesu tez sie liczy: IngestState.fetched_at (czytane z current_generation)
+    current_generation()
+    stamps = [t for t in (_refresh_state["fetched_at"], _generation["fetched_at"]) if t]
+    fetched_at = max(stamps) if stamps else None
+    age = None
+    if fetched_at is not None:
+        age = round(max(0.0, (timezone.now() - fetched_at).total_seconds()), 3)
+    # zanim ten proces sam sprobuje, o dostepnosci IMGW swiadczy udane pobranie gdziekolwiek
+    ok = _refresh_state["ok"] if _refresh_state["seq"] else fetched_at is not None
+    return RefreshResult(
+        ok=ok,
+        refreshed=refreshed,
+        fetched_at=fetched_at,
+        age_seconds=age,
+        revalidating=revalidating,
+    )
 
-        upserted += 1
 
-    return upserted
+def _follower_result(ttl: float) -> RefreshResult:
+    """
+    Feed pobiera posiadacz dzierzawy: czekamy (najwyzej settings.METEO_INGEST_FOLLOWER_WAIT s,
+    poza _refresh_lock), az jego pobranie odswiezy dane ponizej TTL; nie zdazy -> ok=False
+    (jak nieudane pobranie) i przez lease_ttl() kolejne wywolania nie czekaja, tylko od razu
+    dostaja dane z DB - posiadacz, ktory nie pobiera (np. IMGW lezy), nie wstrzymuje zapytan.
+    """
+    wait = float(getattr(settings, "METEO_INGEST_FOLLOWER_WAIT", 10))
+    gave_up = _refresh_state["follower_gave_up"]
+    if gave_up is not None and time.monotonic() - gave_up < lease_ttl():
+        wait = 0.0
+    wait_until = time.monotonic() + wait
+    while True:
+        _generation["checked"] = 0.0  # IngestState.fetched_at prosto z DB
+        result = _refresh_result(refreshed=False)
+        result.ok = result.age_seconds is not None and result.age_seconds < ttl
+        if result.ok:
+            _refresh_state["follower_gave_up"] = None
+            return result
+        if time.monotonic() >= wait_until:
+            if wait:
+                _refresh_state["follower_gave_up"] = time.monotonic()
+            return result
+        time.sleep(0.5)
+
+
+def imgw_data_age() -> Optional[float]:
+    """Wiek danych IMGW w sekundach (bez pobierania); None gdy jeszcze nie pobrano."""
+    return _refresh_result(refreshed=False).age_seconds
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def run_in_executor(fn, *args, **kwargs) -> Future:
+    """
+    fn(*args, **kwargs) we wspolnej (per proces) puli watkow zapytan
+    (settings.METEO_REQUEST_WORKERS, np. pobranie feedu dla /warnings/live);
+    polaczenia DB watku zamykane po zadaniu.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(getattr(settings, "METEO_REQUEST_WORKERS", 8)),
+                    thread_name_prefix="meteo-request",
+                )
+
+    def _task():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return _executor.submit(_task)
+
+
+_refresh_pool: Optional[ThreadPoolExecutor] = None
+_refresh_future: Optional[Future] = None
+_refresh_future_lock = threading.Lock()
+
+
+def refresh_imgw_future(*, max_stale: Optional[float] = None) -> Future:
+    """
+    refresh_imgw() bez blokowania watku zapytania. Przypadki bez pobierania -> gotowy Future;
+    pobieranie idzie w jednym watku "meteo-refresh", a wszystkie zapytania czekajace w tym
+    czasie dostaja ten sam Future (czekajacy nie zajmuja watkow puli).
+    """
+    global _refresh_pool, _refresh_future
+    result = refresh_imgw(max_stale=max_stale, wait=False)
+    if result is not None:
+        done = Future()
+        done.set_result(result)
+        return done
+    with _refresh_future_lock:
+        if _refresh_future is None or _refresh_future.done():
+            if _refresh_pool is None:
+                _refresh_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="meteo-refresh")
+            _refresh_future = _refresh_pool.submit(_refresh_task)
+        return _refresh_future
+
+
+def _refresh_task() -> RefreshResult:
+    try:
+        return refresh_imgw()
+    finally:
+        connections.close_all()  # watek ma wlasne polaczenie do DB
+
+
+def _refresh_in_background() -> bool:
+    """Uruchamia refresh_imgw() w watku w tle; False, gdy jedno juz trwa."""
+    with _refresh_bg_lock:
+        if _refresh_state["background"]:
+            return False
+        _refresh_state["background"] = True
+
+    def _run():
+        try:
+            refresh_imgw()
+        finally:
+            _refresh_state["background"] = False
+            connections.close_all()  # watek ma wlasne polaczenie do DB
+
+    threading.Thread(target=_run, name="imgw-revalidate", daemon=True).start()
+    return True
+
+
+def _rebuild_snapshot() -> None:
+    # po commicie nowych danych snapshot /warnings/all w tle (meteo.snapshot importuje services)
+    from .snapshot import rebuild_in_background
+    rebuild_in_background()
+
+
+def refresh_imgw(*, force: bool = False, max_stale: Optional[float] = None,
+                 wait: bool = True) -> Optional[RefreshResult]:
+    """
+    Odswieza feed IMGW (fetch + upsert) z ograniczeniem czestotliwosci.
+    - dane mlodsze niz settings.METEO_IMGW_REFRESH_TTL (s, domyslnie 60) -> brak pobrania
+    - rownolegle wywolania w procesie wspoldziela jedno pobranie (single-flight):
+      kto czekal na blokadzie, dostaje wynik proby zakonczonej w miedzyczasie
+    - force=True -> pomija okno swiezosci (ale nadal single-flight)
+    - otwarty bezpiecznik IMGW (meteo.upstream) -> od razu ok=False
+    - max_stale (s): dane starsze niz TTL, ale mlodsze niz max_stale -> odpowiedz od razu,
+      pobieranie w tle (stale-while-revalidate); czekamy tylko na starsze albo brak danych
+    - pobiera tylko posiadacz dzierzawy IngestLease (settings.METEO_INGEST_LEASE_TTL);
+      pozostale procesy/wezly czekaja na jego pobranie jak na wlasne (_follower_result),
+      wygasla dzierzawa -> przejecie
+    - wait=False -> None zamiast czekania na pobranie (refresh_imgw_future)
+    Nie rzuca wyjatkow: blad IMGW konczy sie ok=False.
+    """
+    ttl = float(getattr(settings, "METEO_IMGW_REFRESH_TTL", 60))
+
+    def _is_fresh() -> bool:
+        age = _refresh_result(refreshed=False).age_seconds
+        return age is not None and age < ttl
+
+    if not force and _is_fresh():
+        return _refresh_result(refreshed=False)
+    if upstream("imgw").breaker.is_open():
+        # IMGW lezy - od razu dane z DB, bez czekania na blokadzie i timeoucie
+        _refresh_state["ok"] = False
+        return _refresh_result(refreshed=False)
+    if not force and max_stale is not None:
+        age = _refresh_result(refreshed=False).age_seconds
+        if age is not None and age < max_stale:
+            _refresh_in_background()
+            return _refresh_result(refreshed=False, revalidating=True)
+
+    if not wait:
+        return None
+    seen_seq = _refresh_state["seq"]
+    with _refresh_lock:
+        # ktos inny skonczyl pobieranie, gdy czekalismy -> korzystamy z jego wyniku
+        if _refresh_state["seq"] != seen_seq:
+            return _refresh_result(refreshed=True)
+        if not force and _is_fresh():
+            return _refresh_result(refreshed=False)
+        result = _fetch_as_leader()
+    # pobiera inny proces/wezel - czekamy na niego juz bez blokady (rownolegle z innymi)
+    return result if result is not None else _follower_result(ttl)
+
+
+def _fetch_as_leader() -> Optional[RefreshResult]:
+    """Pobranie i zapis feedu pod _refresh_lock; None, gdy dzierzawe ma inny proces."""
+    fence = None
+    if lease_ttl():
+        fence = acquire_lease(IMGW_SOURCE)
+        if fence is None:
+            return None
+
+    try:
+        stats = sync_imgw(fence=fence)
+    except LeaseLost:
+        # dzierzawe przejal ktos inny w trakcie pobierania - jego zapis wygrywa
+        return None
+    except Exception:
+        _refresh_state["ok"] = False
+    else:
+        _refresh_state["ok"] = True
+        _refresh_state["last_ok"] = time.monotonic()
+        _refresh_state["fetched_at"] = timezone.now()
+        if stats.upserted:
+            _rebuild_snapshot()
+    finally:
+        _refresh_state["seq"] += 1
+
+    return _refresh_result(refreshed=True)
@@ -0,0 +1,171 @@
+# meteo/snapshot.py
+"""
+Ogolnopolski snapshot aktywnych ostrzezen (/api/meteo/warnings/all).
+
+Tresc: {"counties": {teryt4: [id, ...]}, "warnings": {id: ostrzezenie}} - kazde
+ostrzezenie raz, powiaty tylko przez id. Budowany raz na generacje danych
+(IngestState.generation) i okno miedzy granicami valid_from/valid_to w calym kraju
+(ETag = generacja + okno, tresc bez chwili budowy);
+trzymany w pamieci procesu jako gotowe bajty: surowe, gzip i brotli (gdy jest
+pakiet 'brotli'). Z settings.METEO_SNAPSHOT_DIR pliki warnings-all.json[.gz|.br]
+sa tez zapisywane na dysk (np. dla nginx gzip_static / brotli_static).
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .fragments import warning_fragments
+from .renderers import FastJSONRenderer
+from .services import current_generation
+from .warning_index import WarningIndex, warning_index
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - bez brotli tylko gzip
+    brotli = None
+
+FILE_NAME = "warnings-all.json"
+
+
+@dataclass
+class Snapshot:
+    generation: int
+    built_at: datetime
+    valid_from: Optional[datetime]  # ostatnia granica przed budowa (poczatek okna)
+    valid_until: Optional[datetime]  # najblizsza granica; potem trzeba przebudowac
+    body: bytes
+    gzip: bytes
+    br: Optional[bytes]
+    etag: str  # generacja + okno; tresci bez kompresji, warianty maja wlasne (etag_for)
+
+    def etag_for(self, encoding: str) -> str:
+        """Silny ETag wariantu: inne bajty (br/gzip) -> inny ETag."""
+        return self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+
+    def content(self, encoding: str) -> bytes:
+        return {"br": self.br, "gzip": self.gzip}.get(encoding) or self.body
+
+    def is_current(self, generation: int, now: datetime) -> bool:
+        return self.generation >= generation and (self.valid_until is None or now <= self.valid_until)
+
+
+def build_snapshot(now: Optional[datetime] = None) -> Snapshot:
+    now = now or timezone.now()
+    idx = warning_index() or WarningIndex.build()
+
+    counties = {}
+    rows = {}
+    boundaries = []
+    previous = []
+    for teryt4 in sorted(idx.teryts()):
+        active = idx.active(teryt4, now)
+        if active:
+            counties[teryt4] = [r["id"] for r in active]
+            rows.update((r["id"], r) for r in active)
+        boundary = idx.next_transition(teryt4, now)
+        if boundary is not None:
+            boundaries.append(boundary)
+        boundary = idx.previous_transition(teryt4, now)
+        if boundary is not None:
+            previous.append(boundary)
+    ids = sorted(rows)
+    valid_from = max(previous) if previous else None
+    valid_until = min(boundaries) if boundaries else None
+
+    # tresc zalezy tylko od generacji i okna miedzy granicami (bez chwili budowy), wiec
+    # przebudowa w tym samym oknie daje te same bajty i ten sam ETag
+    body = FastJSONRenderer().render({
+        "generation": idx.generation,
+        "valid_from": valid_from,
+        "valid_until": valid_until,
+        "count": len(ids),
+        "counties": counties,
+        "warnings": dict(zip(ids, warning_fragments(rows[i] for i in ids))),
+    })
+    snap = Snapshot(
+        generation=idx.generation,
+        built_at=now,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        body=body,
+        gzip=gzip.compress(body, compresslevel=9, mtime=0),
+        br=brotli.compress(body, quality=11) if brotli is not None else None,
+        etag=_etag(idx.generation, valid_from, valid_until),
+    )
+    out_dir = getattr(settings, "METEO_SNAPSHOT_DIR", None)
+    if out_dir:
+        _write_files(snap, Path(out_dir))
+    return snap
+
+
+def _etag(generation: int, valid_from: Optional[datetime], valid_until: Optional[datetime]) -> str:
+    raw = f"{generation}|{valid_from.isoformat() if valid_from else ''}|{valid_until.isoformat() if valid_until else ''}"
+    return '"%s"' % hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _write_files(snap: Snapshot, out_dir: Path) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    variants = {FILE_NAME: snap.body, FILE_NAME + ".gz": snap.gzip}
+    if snap.br is not None:
+        variants[FILE_NAME + ".br"] = snap.br
+    for name, data in variants.items():
+        tmp = out_dir / f".{name}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, out_dir / name)  # atomowo - serwer plikow nie widzi polowy pliku
+
+
+_snapshot: Optional[Snapshot] = None
+_lock = threading.Lock()
+
+
+def current_snapshot() -> Snapshot:
+    """Snapshot dla aktualnej generacji i chwili; przebudowa najwyzej raz naraz."""
+    global _snapshot
+    snap = _snapshot
+    if snap is not None and snap.is_current(current_generation(), timezone.now()):
+        return snap
+    with _lock:
+        snap = _snapshot
+        if snap is None or not snap.is_current(current_generation(), timezone.now()):
+            snap = _snapshot = build_snapshot()
+        return snap
+
+
+_rebuilding = {"active": False}
+_rebuild_lock = threading.Lock()
+
+
+def rebuild_in_background() -> bool:
+    """
+    Przebudowa snapshotu w watku w tle (po zapisie nowych danych, zeby pierwsze
+    zapytanie /warnings/all nie czekalo); False, gdy jedna juz trwa.
+    """
+    with _rebuild_lock:
+        if _rebuilding["active"]:
+            return False
+        _rebuilding["active"] = True
+
+    def _run():
+        global _snapshot
+        try:
+            with _lock:
+                _snapshot = build_snapshot()
+        except Exception:
+            pass  # zbudujemy przy zapytaniu (current_snapshot)
+        finally:
+            _rebuilding["active"] = False
+            connections.close_all()  # watek ma wlasne polaczenie do DB
+
+    threading.Thread(target=_run, name="meteo-snapshot", daemon=True).start()
+    return True
@@ -0,0 +1,198 @@
+# meteo/teryt_grid.py
+"""
+Prekompilowana siatka (raster) lat/lon -> powiat, czytana przez mmap.
+
+Plik (little-endian):
+  naglowek  HEADER (magic, wersja, lon0, lat0, dlon, dlat, ncols, nrows, dlugosc tabeli)
+  tabela    JSON [[teryt4, nazwa], ...] (dopelniony do parzystej dlugosci)
+  komorki   uint16 nrows*ncols, wiersz 0 = poludnie (lat0)
+Wartosc komorki: 0 = poza powiatami, N = tabela[N-1], BOUNDARY_CELL = komorka
+na granicy -> odpowiedz trzeba policzyc dokladnie (PRG / cache / Geoportal).
+
+Plik otwierany jest tylko do odczytu przez mmap, wiec wszystkie workery
+gunicorna wspoldziela te same strony pamieci z page cache.
+"""
+from __future__ import annotations
+
+import json
+import math
+import mmap
+import struct
+import sys
+import threading
+from array import array
+from typing import Iterable, Optional
+
+from django.conf import settings
+
+MAGIC = b"TGRD"
+VERSION = 1
+HEADER = struct.Struct("<4sHxxddddIII")
+BOUNDARY_CELL = 0xFFFF
+MAX_COUNTIES = BOUNDARY_CELL - 1
+
+# zwracane przez lookup() zamiast (teryt4, nazwa), gdy komorka lezy na granicy
+BOUNDARY = object()
+
+METERS_PER_DEG_LAT = 111_320.0
+
+
+class TerytGrid:
+    """Odczyt siatki z pliku przez mmap; lookup = dwa mnozenia i jeden odczyt."""
+
+    def __init__(self, path):
+        with open(path, "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.lon0, self.lat0, self.dlon, self.dlat,
+         self.ncols, self.nrows, table_len) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a TERYT grid file (v{VERSION})")
+        start = HEADER.size
+        self.table = [tuple(t) for t in json.loads(self._mm[start:start + table_len])]
+        self._cells_offset = start + table_len + (table_len & 1)
+        self._inv_dlon = 1.0 / self.dlon
+        self._inv_dlat = 1.0 / self.dlat
+        self._cell = struct.Struct("<H")
+
+    def lookup(self, lat: float, lon: float):
+        """(teryt4, nazwa), None (poza powiatami) albo BOUNDARY."""
+        col = int((lon - self.lon0) * self._inv_dlon)
+        row = int((lat - self.lat0) * self._inv_dlat)
+        if not (0 <= col < self.ncols and 0 <= row < self.nrows) or lon < self.lon0 or lat < self.lat0:
+            return None
+        (v,) = self._cell.unpack_from(self._mm, self._cells_offset + 2 * (row * self.ncols + col))
+        if v == 0:
+            return None
+        if v == BOUNDARY_CELL:
+            return BOUNDARY
+        return self.table[v - 1]
+
+    def close(self):
+        self._mm.close()
+
+
+def build_grid(
+    parts: Iterable[tuple[str, str, list]],
+    out_path,
+    *,
+    cell_m: float = 100.0,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+) -> dict:
+    """
+    Rasteryzuje wielokaty (teryt4, nazwa, pierscienie) do pliku siatki.
+    - wnetrza: scanline po srodkach komorek (regula parzystosci w obrebie czesci)
+    - granice: kazda komorka, przez ktora przechodzi krawedz, dostaje BOUNDARY_CELL
+    bbox=(lon_min, lat_min, lon_max, lat_max); domyslnie zasieg wielokatow.
+    Zwraca krotkie statystyki (wymiary, liczba powiatow i komorek granicznych).
+    """
+    parts = [(t4, name, [r for r in rings if len(r) >= 3]) for t4, name, rings in parts]
+    parts = [p for p in parts if p[2]]
+    if not parts:
+        raise ValueError("no polygons to rasterize")
+
+    if bbox is None:
+        xs = [x for _, _, rings in parts for ring in rings for x, _ in ring]
+        ys = [y for _, _, rings in parts for ring in rings for _, y in ring]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+    lon0, lat0, lon1, lat1 = bbox
+
+    dlat = cell_m / METERS_PER_DEG_LAT
+    dlon = cell_m / (METERS_PER_DEG_LAT * math.cos(math.radians((lat0 + lat1) / 2)))
+    ncols = max(1, math.ceil((lon1 - lon0) / dlon))
+    nrows = max(1, math.ceil((lat1 - lat0) / dlat))
+
+    table: list[tuple[str, str]] = []
+    table_idx: dict[tuple[str, str], int] = {}
+    cells = array("H", bytes(2 * ncols * nrows))
+
+    # 1) wnetrza wielokatow
+    for teryt4, name, rings in parts:
+        key = (teryt4, name)
+        if key not in table_idx:
+            if len(table) >= MAX_COUNTIES:
+                raise ValueError("too many counties for a uint16 grid")
+            table.append(key)
+            table_idx[key] = len(table)
+        value = table_idx[key]
+
+        rows: dict[int, list[tuple[float, float, float, float]]] = {}
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if y1 == y2:
+                    continue
+                # wiersze, ktorych srodek (lat0 + (r + 0.5) * dlat) lezy w [min(y), max(y))
+                r0 = max(0, math.ceil((min(y1, y2) - lat0) / dlat - 0.5))
+                r1 = min(nrows - 1, math.ceil((max(y1, y2) - lat0) / dlat - 0.5) - 1)
+                for r in range(r0, r1 + 1):
+                    rows.setdefault(r, []).append((x1, y1, x2, y2))
+
+        for r, edges in rows.items():
+            yc = lat0 + (r + 0.5) * dlat
+            xs = sorted(
+                x1 + (yc - y1) * (x2 - x1) / (y2 - y1)
+                for x1, y1, x2, y2 in edges
+                if (y1 > yc) != (y2 > yc)
+            )
+            base = r * ncols
+            for xa, xb in zip(xs[0::2], xs[1::2]):
+                c0 = max(0, math.ceil((xa - lon0) / dlon - 0.5))
+                c1 = min(ncols - 1, math.floor((xb - lon0) / dlon - 0.5))
+                if c1 >= c0:
+                    cells[base + c0:base + c1 + 1] = array("H", [value]) * (c1 - c0 + 1)
+
+    # 2) komorki przeciete przez krawedzie -> dokladne sprawdzenie przy zapytaniu
+    boundary = 0
+    for _, _, rings in parts:
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                steps = max(1, math.ceil(max(abs(x2 - x1) / dlon, abs(y2 - y1) / dlat) * 2))
+                for i in range(steps):
+                    ax = x1 + (x2 - x1) * i / steps
+                    ay = y1 + (y2 - y1) * i / steps
+                    bx = x1 + (x2 - x1) * (i + 1) / steps
+                    by = y1 + (y2 - y1) * (i + 1) / steps
+                    for r in range(max(0, math.floor((min(ay, by) - lat0) / dlat)),
+                                   min(nrows - 1, math.floor((max(ay, by) - lat0) / dlat)) + 1):
+                        for c in range(max(0, math.floor((min(ax, bx) - lon0) / dlon)),
+                                       min(ncols - 1, math.floor((max(ax, bx) - lon0) / dlon)) + 1):
+                            k = r * ncols + c
+                            if cells[k] != BOUNDARY_CELL:
+                                cells[k] = BOUNDARY_CELL
+                                boundary += 1
+
+    table_bytes = json.dumps(table, ensure_ascii=False).encode("utf-8")
+    if sys.byteorder != "little":
+        cells.byteswap()
+    with open(out_path, "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, lon0, lat0, dlon, dlat, ncols, nrows, len(table_bytes)))
+        fh.write(table_bytes)
+        if len(table_bytes) & 1:
+            fh.write(b"\0")
+        fh.write(cells.tobytes())
+
+    return {
+        "cols": ncols,
+        "rows": nrows,
+        "counties": len(table),
+        "boundary_cells": boundary,
+        "bytes": HEADER.size + len(table_bytes) + 2 * ncols * nrows,
+    }
+
+
+_grid: Optional[TerytGrid] = None
+_grid_loaded = False
+_grid_lock = threading.Lock()
+
+
+def get_teryt_grid() -> Optional[TerytGrid]:
+    """Wspoldzielona siatka z settings.METEO_TERYT_GRID_PATH (None, gdy nie ustawiono)."""
+    global _grid, _grid_loaded
+    if _grid_loaded:
+        return _grid
+    with _grid_lock:
+        if not _grid_loaded:
+            path = getattr(settings, "METEO_TERYT_GRID_PATH", None)
+            if path:
+                _grid = TerytGrid(path)
+            _grid_loaded = True
+    return _grid
@@ -1,3 +1,1182 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from meteo import lease, services, snapshot, warning_index
+from meteo.export import export_warnings
+from meteo.hitcounter import HitBuffer
+from meteo.lru import MISS, LRUCache
+from meteo.models import IngestLease, IngestState, Powiat, TerytCache, TerytCell, Warning, WarningCoverage
+from meteo.prg import CountyIndex
+from meteo.services import (
+    IMGW_SOURCE, IngestStats, RefreshResult, ingest_imgw, refresh_imgw, sync_imgw, teryt4_from_latlon,
+)
+from meteo.teryt_grid import BOUNDARY, TerytGrid, build_grid
+from meteo.upstream import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, UpstreamClient, UpstreamUnavailable, upstream,
+)
+from meteo.views import _decode_cursor, _encode_cursor, _history_qs_for_teryt, _pick_encoding
+from meteo.warning_index import ROW_FIELDS, WarningIndex
+
+
+def _reset_process_state():
+    """Stan per proces (cache generacji, indeks, dzierzawy) - testy wycofuja DB pod nim."""
+    cache.clear()
+    services._generation.update(value=None, changed_at=None, fetched_at=None, checked=0.0)
+    services._refresh_state.update(seq=0, ok=False, last_ok=None, fetched_at=None, background=False,
+                                   follower_gave_up=None)
+    lease._known.clear()
+    lease._observed.clear()
+    lease._held.clear()
+    services._teryt_lru = None
+    warning_index._index = None
+    snapshot._snapshot = None
+
+
+def _item(wid, teryts, start="2025-07-01 12:00:00", end="2025-07-01 18:00:00", **kw):
+    return {
+        "id": wid, "nazwa_zdarzenia": "Burze", "stopien": "2", "prawdopodobienstwo": "80",
+        "obowiazuje_od": start, "obowiazuje_do": end, "opublikowano": "2025-07-01 10:00:00",
+        "tresc": "Burze z gradem", "komentarz": "", "biuro": "BP", "teryt": teryts, **kw,
+    }
+
+
+class _FeedResponse:
+    def __init__(self, items, status=200, etag="E1"):
+        self.status_code = status
+        self.content = json.dumps(items).encode()
+        self.headers = {"ETag": etag} if status == 200 else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+
+    def coverage(self):
+        return set(WarningCoverage.objects.values_list("warning_id", "powiat_id"))
+
+    def test_ingest_upserts_warnings_and_coverage(self):
+        stats = ingest_imgw([_item("w1", ["1465", "1261"]), _item("w2", ["1465"])])
+        self.assertEqual(stats.upserted, 2)
+        self.assertEqual(stats.coverage_added, 3)
+        self.assertEqual(self.coverage(), {("w1", "1465"), ("w1", "1261"), ("w2", "1465")})
+        self.assertEqual(IngestState.objects.get(source=IMGW_SOURCE).generation, 1)
+
+        stats = ingest_imgw([_item("w1", ["1261", "0201"], stopien="3")])
+        self.assertEqual((stats.upserted, stats.coverage_added, stats.coverage_removed), (1, 1, 1))
+        self.assertEqual(self.coverage(), {("w1", "1261"), ("w1", "0201"), ("w2", "1465")})
+        self.assertEqual(Warning.objects.get(id="w1").level, 3)
+        self.assertEqual(IngestState.objects.get(source=IMGW_SOURCE).generation, 2)
+
+    def test_ingest_without_teryt_keeps_coverage(self):
+        ingest_imgw([_item("w1", ["1465"])])
+        ingest_imgw([_item("w1", [], tresc="Poprawiona tresc")])
+        self.assertEqual(self.coverage(), {("w1", "1465")})
+        self.assertEqual(Warning.objects.get(id="w1").content, "Poprawiona tresc")
+
+    def test_coverage_follows_warning_start(self):
+        ingest_imgw([_item("w1", ["1465", "1261"])])
+        ingest_imgw([_item("w1", [], start="2025-07-01 14:00:00")])
+        starts = set(WarningCoverage.objects.values_list("valid_from", flat=True))
+        self.assertEqual(starts, {Warning.objects.get(id="w1").valid_from})
+
+    def test_query_count_does_not_grow_with_feed(self):
+        ingest_imgw([_item("w0", ["1465"])])  # IngestState juz istnieje w obu pomiarach
+        small = ingest_imgw([_item(f"a{i}", ["1465", "1261"]) for i in range(3)])
+        large = ingest_imgw([_item(f"b{i}", ["1465", "1261", "0201"]) for i in range(60)])
+        self.assertEqual(large.upserted, 60)
+        self.assertEqual(large.queries, small.queries)
+        self.assertEqual(services.upsert_imgw([_item("a0", ["1465"])]), 1)
+
+
+    def test_sync_writes_only_changed_warnings(self):
+        feed = [_item("w1", ["1465"]), _item("w2", ["1261"])]
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse(feed)):
+            stats = sync_imgw()
+        self.assertEqual((stats.upserted, stats.unchanged), (2, 0))
+
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse(feed)):
+            self.assertTrue(sync_imgw().feed_unchanged)
+
+        feed[1] = _item("w2", ["1261", "1465"])
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse(feed)) as fetch:
+            stats = sync_imgw()
+        fetch.assert_called_once_with("E1", "")
+        self.assertEqual((stats.upserted, stats.unchanged, stats.coverage_added), (1, 1, 1))
+
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse([], status=304)):
+            self.assertTrue(sync_imgw().feed_unchanged)
+        self.assertEqual(Warning.objects.count(), 2)
+
+    def test_sync_force_rewrites_everything(self):
+        feed = [_item("w1", ["1465"]), _item("w2", ["1261"])]
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse(feed)):
+            sync_imgw()
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=_FeedResponse(feed)) as fetch:
+            stats = sync_imgw(force=True)
+        fetch.assert_called_once_with()
+        self.assertEqual((stats.upserted, stats.unchanged), (2, 0))
+
+@override_settings(METEO_IMGW_REFRESH_TTL=60, METEO_INGEST_LEASE_TTL=0)
+class RefreshTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        patcher = mock.patch("meteo.services.sync_imgw", return_value=IngestStats())
+        self.sync = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetched(self, seconds_ago):
+        services._refresh_state.update(seq=1, ok=True, fetched_at=timezone.now() - timedelta(seconds=seconds_ago))
+
+    def test_fresh_data_is_not_fetched_again(self):
+        self.fetched(10)
+        result = refresh_imgw()
+        self.sync.assert_not_called()
+        self.assertTrue(result.ok)
+        self.assertFalse(result.refreshed)
+        self.assertAlmostEqual(result.age_seconds, 10, delta=1)
+
+    def test_stale_data_is_fetched_once(self):
+        self.fetched(120)
+        result = refresh_imgw()
+        self.assertTrue(result.refreshed and result.ok)
+        self.assertLess(result.age_seconds, 1)
+        refresh_imgw()
+        self.sync.assert_called_once()
+
+    def test_waiters_share_the_running_fetch(self):
+        results = []
+        with mock.patch("meteo.services.current_generation", return_value=0):
+            with services._refresh_lock:  # pobieranie "trwa" w innym watku
+                waiter = threading.Thread(target=lambda: results.append(refresh_imgw()))
+                waiter.start()
+                time.sleep(0.1)
+                self.fetched(0)
+                services._refresh_state["seq"] += 1
+            waiter.join(5)
+        self.assertTrue(results[0].refreshed and results[0].ok)
+        self.sync.assert_not_called()
+
+    def test_failed_fetch_reports_unavailable(self):
+        self.sync.side_effect = ConnectionError("IMGW down")
+        result = refresh_imgw()
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.age_seconds)
+
+    def test_stale_data_within_max_stale_is_served_and_revalidated(self):
+        self.fetched(120)
+        with mock.patch("meteo.services._refresh_in_background", return_value=True) as background:
+            result = refresh_imgw(max_stale=300)
+        background.assert_called_once()
+        self.sync.assert_not_called()
+        self.assertTrue(result.ok and result.revalidating)
+        self.assertFalse(result.refreshed)
+        self.assertAlmostEqual(result.age_seconds, 120, delta=1)
+
+    def test_data_older_than_max_stale_is_fetched_before_answering(self):
+        self.fetched(400)
+        with mock.patch("meteo.services._refresh_in_background") as background:
+            result = refresh_imgw(max_stale=300)
+        background.assert_not_called()
+        self.sync.assert_called_once()
+        self.assertTrue(result.refreshed and not result.revalidating)
+
+    def test_only_one_background_refresh_at_a_time(self):
+        services._refresh_state["background"] = True
+        with mock.patch("threading.Thread") as thread:
+            self.assertFalse(services._refresh_in_background())
+        thread.assert_not_called()
+
+    def test_views_take_max_stale_from_the_query(self):
+        self.fetched(120)
+        with mock.patch("meteo.services._refresh_in_background", return_value=True) as background:
+            body = self.client.get("/api/meteo/history/teryt/1465", {"max_stale": "300"}).json()
+        background.assert_called_once()
+        self.sync.assert_not_called()
+        self.assertTrue(body["imgw_available"])
+        self.assertAlmostEqual(body["data_age_s"], 120, delta=1)
+
+
+# dwa sasiednie kwadraty 0.2 x 0.2 stopnia; pierwszy z dziura w srodku
+_SQUARE_A = [(20.0, 50.0), (20.2, 50.0), (20.2, 50.2), (20.0, 50.2)]
+_HOLE_A = [(20.08, 50.08), (20.12, 50.08), (20.12, 50.12), (20.08, 50.12)]
+_SQUARE_B = [(20.2, 50.0), (20.4, 50.0), (20.4, 50.2), (20.2, 50.2)]
+_PARTS = [("0001", "Powiat A", [_SQUARE_A, _HOLE_A]), ("0002", "Powiat B", [_SQUARE_B])]
+
+
+class CountyLookupTests(TestCase):
+    def test_county_index_point_in_polygon(self):
+        index = CountyIndex(_PARTS, cell_deg=0.05)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.lookup(50.05, 20.05), ("0001", "Powiat A"))
+        self.assertEqual(index.lookup(50.15, 20.19), ("0001", "Powiat A"))
+        self.assertEqual(index.lookup(50.1, 20.3), ("0002", "Powiat B"))
+        self.assertIsNone(index.lookup(50.1, 20.1))  # dziura
+        self.assertIsNone(index.lookup(50.1, 19.9))
+        self.assertIsNone(index.lookup(50.3, 20.1))
+        # drugie zapytanie o te sama komorke idzie przez zapamietany wynik (_uniform)
+        self.assertEqual(index.lookup(50.04, 20.04), ("0001", "Powiat A"))
+
+    def test_offline_index_answers_before_geoportal(self):
+        index = CountyIndex(_PARTS, cell_deg=0.05)
+        with mock.patch("meteo.services.get_county_index", return_value=index), \
+                mock.patch("meteo.services.geoportal_teryt", side_effect=AssertionError("no network")):
+            self.assertEqual(teryt4_from_latlon(50.1, 20.3), ("0002", "Powiat B"))
+            self.assertEqual(teryt4_from_latlon(50.05, 20.05, use_cache=False), ("0001", "Powiat A"))
+            with override_settings(METEO_GEOPORTAL_FALLBACK=False):
+                self.assertEqual(teryt4_from_latlon(50.1, 20.1), (None, None))
+        with mock.patch("meteo.services.get_county_index", return_value=index), \
+                mock.patch("meteo.services.geoportal_teryt", return_value=("1465", "Warszawa")) as geoportal:
+            self.assertEqual(teryt4_from_latlon(52.2, 21.0, use_cache=False), ("1465", "Warszawa"))
+        geoportal.assert_called_once_with(52.2, 21.0)
+
+    def test_grid_matches_polygons_and_marks_boundaries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "teryt.grid"
+            stats = build_grid(_PARTS, path, cell_m=500)
+            self.assertEqual(stats["counties"], 2)
+            self.assertGreater(stats["boundary_cells"], 0)
+            grid = TerytGrid(path)
+            try:
+                self.assertEqual(grid.lookup(50.03, 20.03), ("0001", "Powiat A"))
+                self.assertEqual(grid.lookup(50.1, 20.3), ("0002", "Powiat B"))
+                self.assertIs(grid.lookup(50.1, 20.2), BOUNDARY)  # wspolna krawedz
+                self.assertIsNone(grid.lookup(50.1, 20.1))  # srodek dziury
+                self.assertIsNone(grid.lookup(49.0, 20.1))
+                self.assertIsNone(grid.lookup(50.1, 21.0))
+            finally:
+                grid.close()
+
+    def test_grid_boundary_cells_fall_through_to_polygons(self):
+        index = CountyIndex(_PARTS, cell_deg=0.05)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "teryt.grid"
+            build_grid(_PARTS, path, cell_m=500)
+            grid = TerytGrid(path)
+            try:
+                with mock.patch("meteo.services.get_teryt_grid", return_value=grid), \
+                        mock.patch("meteo.services.get_county_index", return_value=index), \
+                        mock.patch("meteo.services.geoportal_teryt", side_effect=AssertionError("no network")):
+                    self.assertEqual(teryt4_from_latlon(50.03, 20.03), ("0001", "Powiat A"))
+                    self.assertEqual(teryt4_from_latlon(50.1, 20.2001), ("0002", "Powiat B"))
+            finally:
+                grid.close()
+
+
+class TerytCacheTierTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        patcher = mock.patch("meteo.services.hit_buffer")
+        self.hits = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_lru_evicts_least_recently_used_and_expires(self):
+        lru = LRUCache(maxsize=2, ttl=10, negative_ttl=1)
+        with mock.patch("meteo.lru.time.monotonic", return_value=100.0) as clock:
+            lru.set("a", 1)
+            lru.set("b", 2)
+            self.assertEqual(lru.get("a"), 1)
+            lru.set("c", 3)  # "b" najdawniej uzywany
+            self.assertIs(lru.get("b"), MISS)
+            lru.delete("c")
+            lru.set("none", None, negative=True)
+            clock.return_value = 101.5
+            self.assertIs(lru.get("none"), MISS)
+            self.assertEqual(lru.get("a"), 1)
+            clock.return_value = 111.0
+            self.assertIs(lru.get("a"), MISS)
+        self.assertEqual(lru.stats()["expired"], 2)
+
+    def test_second_lookup_is_served_from_memory(self):
+        with mock.patch("meteo.services.geoportal_teryt", return_value=("1465", "Warszawa")) as geoportal:
+            self.assertEqual(teryt4_from_latlon(52.2297, 21.0122), ("1465", "Warszawa"))
+            with self.assertNumQueries(0):
+                self.assertEqual(teryt4_from_latlon(52.2297, 21.0122), ("1465", "Warszawa"))
+            services.teryt_lru().clear()
+            with self.assertNumQueries(1):  # drugi poziom: TerytCache
+                self.assertEqual(teryt4_from_latlon(52.2297, 21.0122), ("1465", "Warszawa"))
+        geoportal.assert_called_once()
+        self.assertEqual(TerytCache.objects.get().teryt4, "1465")
+        self.assertEqual(self.hits.record.call_count, 2)
+
+    def test_points_outside_counties_are_cached_too(self):
+        with mock.patch("meteo.services.geoportal_teryt", return_value=(None, None)) as geoportal:
+            self.assertEqual(teryt4_from_latlon(55.5, 18.0), (None, None))
+            self.assertEqual(teryt4_from_latlon(55.5, 18.0), (None, None))
+        geoportal.assert_called_once()
+        self.assertIsNone(TerytCache.objects.get().teryt4)
+
+
+class HitBufferTests(TestCase):
+    def setUp(self):
+        self.rows = [TerytCache.objects.create(lat=50 + i, lon=20, teryt4="1465") for i in range(2)]
+        self.buffer = HitBuffer(flush_interval=3600, flush_threshold=3)
+        self.buffer._hooks_installed = True  # bez atexit/SIGTERM w procesie testow
+        self.addCleanup(lambda: self.buffer._timer and self.buffer._timer.cancel())
+
+    def hits(self):
+        return dict(TerytCache.objects.values_list("pk", "hits"))
+
+    def test_hits_are_written_in_one_batch(self):
+        a, b = self.rows
+        self.buffer.record(a.pk)
+        self.buffer.record(a.pk)
+        self.assertEqual(self.buffer.pending(), 2)
+        self.assertEqual(self.hits(), {a.pk: 0, b.pk: 0})
+        with self.assertNumQueries(1):
+            self.buffer.record(b.pk)  # prog 3 trafien -> flush
+        self.assertEqual(self.hits(), {a.pk: 2, b.pk: 1})
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertGreater(TerytCache.objects.get(pk=a.pk).last_used, a.last_used)
+
+    def test_failed_flush_keeps_counters(self):
+        a, _ = self.rows
+        self.buffer.record(a.pk)
+        with mock.patch.object(TerytCache.objects, "filter", side_effect=RuntimeError("db down")), \
+                self.assertLogs("meteo.hitcounter", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending(), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.hits()[a.pk], 1)
+
+
+class _InlineExecutor:
+    """Zamiast watku "meteo-cells": zapamietuje zadania, run() wykonuje je w tym watku."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        with mock.patch("meteo.services.connections"):  # nie zamykamy polaczenia testu
+            for fn, args in self.tasks:
+                fn(*args)
+        self.tasks.clear()
+
+
+@override_settings(METEO_TERYT_CACHE_MODE="cell", METEO_TERYT_CELL_DEG=0.01)
+class CellModeTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        self.executor = _InlineExecutor()
+        for name, value in (("_cell_checks", self.executor), ("_cell_pending", set())):
+            patcher = mock.patch.object(services, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("meteo.services.hit_buffer")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_homogeneous_cell_answers_other_points(self):
+        with mock.patch("meteo.services.geoportal_teryt", return_value=("1465", "Warszawa")) as geoportal:
+            self.assertEqual(teryt4_from_latlon(52.2312, 21.0134), ("1465", "Warszawa"))
+            self.assertEqual(geoportal.call_count, 1)  # probki komorki nie w watku zapytania
+            self.executor.run()
+            self.assertEqual(geoportal.call_count, 6)
+            self.assertTrue(TerytCell.objects.get().homogeneous)
+
+            self.assertEqual(teryt4_from_latlon(52.2388, 21.0177), ("1465", "Warszawa"))
+        self.assertEqual(geoportal.call_count, 6)
+        self.assertEqual(TerytCache.objects.count(), 1)
+
+    def test_boundary_cell_keeps_exact_lookups(self):
+        answers = {(52.235, 21.015): ("1432", "Powiat otwocki")}  # srodek komorki po drugiej stronie granicy
+
+        def geoportal(lat, lon):
+            return answers.get((lat, lon), ("1465", "Warszawa"))
+
+        with mock.patch("meteo.services.geoportal_teryt", side_effect=geoportal) as mocked:
+            teryt4_from_latlon(52.2312, 21.0134)
+            self.executor.run()
+            self.assertFalse(TerytCell.objects.get().homogeneous)
+            teryt4_from_latlon(52.2388, 21.0177)
+        self.assertEqual(mocked.call_count, 7)
+        self.assertEqual(TerytCache.objects.count(), 2)
+
+    def test_offline_samples_are_checked_without_geoportal(self):
+        index = CountyIndex(_PARTS, cell_deg=0.05)
+
+        def offline(lat, lon):
+            # punkt zapytania poza indeksem (MISS), probki komorki z indeksu
+            return services.MISS if (lat, lon) == (50.052, 20.053) else index.lookup(lat, lon)
+
+        with mock.patch("meteo.services._teryt_offline", side_effect=offline), \
+                mock.patch("meteo.services.geoportal_teryt", return_value=("0001", "Powiat A")) as geoportal:
+            teryt4_from_latlon(50.052, 20.053)
+        geoportal.assert_called_once()
+        self.assertEqual(self.executor.tasks, [])
+        self.assertTrue(TerytCell.objects.get().homogeneous)
+
+
+class TerytPrewarmTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        patcher = mock.patch("meteo.management.commands.teryt_prewarm.geoportal_teryt",
+                             return_value=("1465", "Warszawa"))
+        self.geoportal = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def prewarm(self, path, *args):
+        out = StringIO()
+        call_command("teryt_prewarm", str(path), "--rate", "0", *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_points_are_resolved_once(self):
+        TerytCache.objects.create(lat=52.1, lon=21.0, teryt4="1465", area_name="Warszawa")
+        path = self.tmp / "points.csv"
+        path.write_text("lat,lon\n52.1,21.0\n52.2,21.0\n52.2,21.0\n52.3,21.0\nbad,21.0\n")
+        out = self.prewarm(path, "--batch", "2", "--checkpoint", str(self.tmp / "done"))
+        self.assertIn("Prewarm done: 2 inserted, 2 already cached, 1 failed", out)
+        self.assertEqual(self.geoportal.call_count, 2)
+        self.assertEqual(TerytCache.objects.count(), 3)
+        self.assertEqual((self.tmp / "done").read_text(), "5")
+
+        out = self.prewarm(path, "--checkpoint", str(self.tmp / "done"))  # wznowienie: nic do zrobienia
+        self.assertIn("Prewarm done: 0 inserted, 0 already cached, 0 failed", out)
+        self.assertEqual(self.geoportal.call_count, 2)
+
+    def test_export_rows_are_imported_without_geoportal(self):
+        TerytCache.objects.create(lat=52.1, lon=21.0, teryt4="1465", area_name="Warszawa", hits=5)
+        TerytCache.objects.create(lat=55.5, lon=18.0, teryt4=None)
+        export = self.tmp / "export.jsonl"
+        call_command("teryt_cache_export", str(export), stdout=StringIO())
+        TerytCache.objects.all().delete()
+
+        out = self.prewarm(export)
+        self.assertIn("2 inserted", out)
+        self.geoportal.assert_not_called()
+        self.assertEqual(
+            set(TerytCache.objects.values_list("teryt4", flat=True)), {"1465", None},
+        )
+
+
+class WarningIndexTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        self.now = timezone.now().replace(microsecond=0)
+        h = self.hours
+        specs = [
+            # id, powiaty, od, do, stopien
+            ("old", ["1465"], h(-24 * 40), h(-24 * 39), 1),
+            ("past", ["1465", "1261"], h(-30), h(-20), 2),
+            ("active1", ["1465"], h(-2), h(4), 1),
+            ("active2", ["1465", "1261"], h(-1), h(4), 3),
+            ("tie_a", ["1465"], h(2), h(6), 2),
+            ("tie_b", ["1465"], h(2), h(5), 2),
+            ("future", ["1261"], h(10), h(12), 1),
+        ]
+        Powiat.objects.bulk_create([Powiat(teryt4="1465"), Powiat(teryt4="1261")])
+        for wid, teryts, vf, vt, level in specs:
+            Warning.objects.create(id=wid, event_name="Burze", level=level, probability=80,
+                                   valid_from=vf, valid_to=vt)
+            WarningCoverage.objects.bulk_create(
+                [WarningCoverage(warning_id=wid, powiat_id=t4, valid_from=vf) for t4 in teryts]
+            )
+
+    def hours(self, n):
+        return self.now + timedelta(hours=n)
+
+    def ids(self, rows):
+        return [r["id"] for r in rows]
+
+    def orm_history(self, teryt4, since=None, until=None, active_at=None):
+        return self.ids(_history_qs_for_teryt(teryt4, since, until, active_at).values(*ROW_FIELDS))
+
+    def test_matches_orm(self):
+        h = self.hours
+        with override_settings(METEO_WARNING_INDEX_HISTORY_DAYS=None):
+            idx = WarningIndex.build()
+        for t4 in ("1465", "1261", "0000"):
+            at = timezone.now()
+            self.assertEqual(self.ids(idx.active(t4, at)), self.ids(Warning.current_for_powiat(t4).values("id")))
+            future = Warning.objects.filter(coverage__teryt4=t4, valid_from__gt=self.now).order_by("valid_from", "id")
+            self.assertEqual(self.ids(idx.future(t4, self.now)), self.ids(future.values("id")))
+            for since, until, active_at in [
+                (None, None, None), (h(-25), None, None), (None, h(0), None),
+                (h(3), h(-3), None), (None, None, h(-25)), (None, None, h(2)),
+            ]:
+                with self.subTest(teryt4=t4, since=since, until=until, active_at=active_at):
+                    self.assertEqual(self.ids(idx.history(t4, since, until, active_at)),
+                                     self.orm_history(t4, since, until, active_at))
+
+    def test_transitions_match_orm(self):
+        h = self.hours
+        for at in (h(-24 * 45), h(-24 * 39) + timedelta(minutes=1), h(-25), h(0), h(4), h(20)):
+            for t4 in ("1465", "1261"):
+                with self.subTest(teryt4=t4, at=at):
+                    with override_settings(METEO_WARNING_INDEX_ENABLED=False):
+                        expected = (warning_index.next_transition(t4, at), warning_index.previous_transition(t4, at))
+                    warning_index._index = None
+                    self.assertEqual(
+                        (warning_index.next_transition(t4, at), warning_index.previous_transition(t4, at)),
+                        expected,
+                    )
+
+    def test_bounded_index_covers_only_recent_history(self):
+        h = self.hours
+        idx = WarningIndex.build()  # domyslnie 30 dni
+        self.assertNotIn("old", idx.rows)
+        self.assertTrue(idx.covers(since=h(-25)))
+        self.assertFalse(idx.covers())
+        self.assertFalse(idx.covers(active_at=h(-24 * 39)))
+        self.assertEqual(self.ids(idx.history("1465", since=h(-25))), self.orm_history("1465", since=h(-25)))
+        # previous_transition pamieta koniec ostrzezenia sprzed horyzontu
+        self.assertEqual(idx.previous_transition("1465", h(-24 * 35)), h(-24 * 39))
+        self.assertIsNone(idx.previous_transition("1261", h(-24 * 35)))
+
+    def test_history_endpoint_falls_back_to_orm_before_horizon(self):
+        response = self.client.get("/api/meteo/history/teryt/1465", {"refresh": "0"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i["id"] for i in response.json()["items"]], self.orm_history("1465"))
+        self.assertIn("old", [i["id"] for i in response.json()["items"]])
+
+    def test_index_serves_pages_inside_horizon(self):
+        url = "/api/meteo/history/teryt/1465"
+        with mock.patch("meteo.views._history_qs_for_teryt", side_effect=AssertionError("ORM query")):
+            first = self.client.get(url, {"refresh": "0", "limit": "2"}).json()
+        self.assertEqual([i["id"] for i in first["items"]], ["tie_b", "tie_a"])
+        rest = self.client.get(url, {"refresh": "0", "limit": "10", "cursor": first["next"]}).json()
+        self.assertEqual([i["id"] for i in rest["items"]], ["active2", "active1", "past", "old"])
+
+
+
+class HistoryCursorTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        self.start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        Powiat.objects.create(teryt4="1465")
+        ids = ["a", "b", "c", "d", "e"]  # ten sam valid_from - kolejnosc rozstrzyga id
+        for wid in ids:
+            Warning.objects.create(id=wid, event_name="Upal", level=1, probability=80,
+                                   valid_from=self.start, valid_to=self.start + timedelta(hours=6))
+        Warning.objects.create(id="z", event_name="Upal", level=1, probability=80,
+                               valid_from=self.start - timedelta(hours=1), valid_to=self.start)
+        for wid in ids + ["z"]:
+            WarningCoverage.objects.create(warning_id=wid, powiat_id="1465")
+
+    def test_cursor_round_trip(self):
+        row = {"valid_from": self.start, "id": "w/1"}
+        self.assertEqual(_decode_cursor(_encode_cursor(row)), (self.start, "w/1"))
+        for bad in ("", "not-a-cursor", _encode_cursor({"valid_from": self.start.replace(tzinfo=None), "id": "x"})):
+            with self.assertRaises(ValueError):
+                _decode_cursor(bad)
+
+    def pages(self):
+        seen, cursor = [], None
+        while True:
+            params = {"refresh": "0", "limit": "2", **({"cursor": cursor} if cursor else {})}
+            response = self.client.get("/api/meteo/history/teryt/1465", params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(body["count"], 2)
+            seen.append([i["id"] for i in body["items"]])
+            cursor = body["next"]
+            if cursor is None:
+                return seen
+
+    def test_pagination_breaks_ties_by_id(self):
+        expected = [["e", "d"], ["c", "b"], ["a", "z"]]
+        self.assertEqual(self.pages(), expected)
+        with override_settings(METEO_WARNING_INDEX_ENABLED=False):
+            cache.clear()
+            self.assertEqual(self.pages(), expected)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/meteo/history/teryt/1465", {"refresh": "0", "cursor": "@@"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_keyset_page_is_read_from_the_index(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite-specific")
+        qs = _history_qs_for_teryt("1465", None, None, None, before=(self.start, "c"))[:101]
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("coverage_history_keyset", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertEqual([r["id"] for r in qs.values("id")], ["b", "a", "z"])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        ingest_imgw([
+            _item("w1", ["1465", "1261"], start="2025-07-01 12:00:00", end="2025-07-01 18:00:00"),
+            _item("w2", ["1465"], start="2025-07-02 12:00:00", end="2025-07-02 18:00:00"),
+            _item("w3", ["0201"], start="2025-07-03 12:00:00", end="2025-07-03 18:00:00"),
+        ])
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_ndjson_matches_api_rows(self):
+        response = self.client.get("/api/meteo/export")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in self.lines(response)]
+        self.assertEqual([(r["id"], r["teryt"]) for r in rows],
+                         [("w1", ["1261", "1465"]), ("w2", ["1465"]), ("w3", ["0201"])])
+        api = self.client.get("/api/meteo/history/teryt/1465", {"refresh": "0"}).json()["items"]
+        exported = {r["id"]: {k: v for k, v in r.items() if k != "teryt"} for r in rows}
+        for item in api:
+            self.assertEqual(exported[item["id"]], item)
+
+    def test_csv_per_teryt_with_filters(self):
+        response = self.client.get("/api/meteo/export",
+                                   {"format": "csv", "per_teryt": "1", "teryt": "1465", "since": "2025-07-02"})
+        rows = list(csv.DictReader(self.lines(response)))
+        self.assertEqual([(r["id"], r["teryt4"]) for r in rows], [("w2", "1465")])
+
+    def test_one_coverage_query_per_chunk(self):
+        with self.assertNumQueries(3):  # ostrzezenia + pokrycie dla 2 paczek
+            lines = list(export_warnings("ndjson", chunk_size=2))
+        self.assertEqual(len(lines), 3)
+
+    def test_rejects_bad_parameters(self):
+        for params in ({"format": "xml"}, {"since": "wczoraj"}, {"teryt": "14"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/meteo/export", params).status_code, 400)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "warnings.csv"
+            call_command("export_warnings", str(path), "--format", "csv", "--per-teryt", stderr=StringIO())
+            self.assertEqual(len(path.read_text().splitlines()), 1 + 4)  # naglowek + pary
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _run_inline(fn, *args, **kwargs):
+    """Zamiast run_in_executor: zadanie w watku testu, wynik albo wyjatek w gotowym Future."""
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class BatchTests(TestCase):
+    url = "/api/meteo/warnings/batch"
+
+    def setUp(self):
+        _reset_process_state()
+        now = timezone.now()
+        ingest_imgw([_item("w1", ["1465"]), _item("w2", ["1465"])])
+        Warning.objects.filter(id="w1").update(valid_from=now - timedelta(hours=1), valid_to=now + timedelta(hours=2))
+        Warning.objects.filter(id="w2").update(valid_from=now + timedelta(hours=3), valid_to=now + timedelta(hours=5))
+        fresh = RefreshResult(ok=True, refreshed=False, fetched_at=now, age_seconds=1.0)
+        for target, kw in (("refresh_imgw_future", {"return_value": _done(fresh)}),
+                           ("teryt4_from_latlon_many", {"side_effect": self.lookup})):
+            patcher = mock.patch(f"meteo.views.{target}", **kw)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def lookup(points, timeout=None):
+        known = {(52.23, 21.01): ("1465", "Warszawa"), (52.25, 21.0): ("1465", "Warszawa"),
+                 (50.06, 19.94): ("1261", "Krakow")}
+        return [known.get(p) for p in points]
+
+    def post(self, points):
+        return self.client.post(self.url, {"points": points}, content_type="application/json")
+
+    def test_rows_are_grouped_by_county(self):
+        response = self.post([{"lat": 52.23, "lon": 21.01}, [52.25, 21.0], {"lat": 50.06, "lon": 19.94}])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r["teryt4"] for r in body["results"]], ["1465", "1465", "1261"])
+        self.assertEqual(sorted(body["areas"]), ["1261", "1465"])
+        self.assertEqual([i["id"] for i in body["areas"]["1465"]["items"]], ["w1"])
+        self.assertEqual([i["id"] for i in body["areas"]["1465"]["future_items"]], ["w2"])
+        self.assertEqual(body["results"][0]["currently_active_IMGW_alerts"], 1)
+        self.assertEqual(body["areas"]["1261"]["items"], [])
+        self.assertTrue(body["imgw_available"])
+        self.teryt4_from_latlon_many.assert_called_once()
+
+    def test_failed_lookup_is_reported_per_point(self):
+        body = self.post([[52.23, 21.01], [0.0, 0.0]]).json()
+        self.assertEqual(body["results"][1]["teryt4"], None)
+        self.assertIn("error", body["results"][1])
+        self.assertEqual(body["results"][0]["teryt4"], "1465")
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([{"lat": "x", "lon": 1}]).status_code, 400)
+        with override_settings(METEO_BATCH_MAX_POINTS=2):
+            self.assertEqual(self.post([[52.23, 21.01]] * 3).status_code, 400)
+
+    @override_settings(METEO_REQUEST_DEADLINE=0.2)
+    def test_refresh_and_lookup_share_the_deadline(self):
+        self.refresh_imgw_future.return_value = Future()  # pobieranie nie konczy sie
+        started = time.monotonic()
+        body = self.post([[52.23, 21.01]]).json()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(body["imgw_available"])
+        self.assertEqual(body["results"][0]["teryt4"], "1465")
+        self.assertLessEqual(self.teryt4_from_latlon_many.call_args.kwargs["timeout"], 0.2)
+
+
+@override_settings(METEO_SNAPSHOT_DIR=None)
+class SnapshotTests(TestCase):
+    url = "/api/meteo/warnings/all"
+
+    def setUp(self):
+        _reset_process_state()
+        self.now = timezone.now()
+        ingest_imgw([_item("w1", ["1465", "1261"]), _item("w2", ["1465"])])
+        Warning.objects.filter(id="w1").update(valid_from=self.now - timedelta(hours=1),
+                                               valid_to=self.now + timedelta(hours=2))
+        Warning.objects.filter(id="w2").update(valid_from=self.now + timedelta(hours=3),
+                                               valid_to=self.now + timedelta(hours=5))
+        services._generation["checked"] = 0.0
+
+    def test_pick_encoding_honours_q_values(self):
+        for header, expected in [
+            ("", "identity"),
+            ("gzip, br", "br"),  # rowne q -> kolejnosc serwera
+            ("gzip;q=0.9, br;q=0.5", "gzip"),
+            ("br;q=0, gzip", "gzip"),
+            ("*;q=0.1, identity;q=0.5", "identity"),
+            ("*", "br"),
+            ("gzip;q=abc", "identity"),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(_pick_encoding(header, ("br", "gzip")), expected)
+
+    def test_rebuild_in_the_same_window_keeps_body_and_etag(self):
+        first = snapshot.build_snapshot(self.now)
+        second = snapshot.build_snapshot(self.now + timedelta(minutes=30))
+        self.assertEqual((first.etag, first.body), (second.etag, second.body))
+        self.assertEqual(first.valid_until, self.now + timedelta(hours=2))
+        self.assertEqual(json.loads(first.body)["counties"], {"1261": ["w1"], "1465": ["w1"]})
+        later = snapshot.build_snapshot(self.now + timedelta(hours=2, minutes=30))
+        self.assertNotEqual(later.etag, first.etag)  # nowe okno (w1 wygaslo)
+        ingest_imgw([_item("w3", ["0201"])])
+        warning_index._index = None
+        services._generation["checked"] = 0.0
+        self.assertNotEqual(snapshot.build_snapshot(self.now).etag, first.etag)  # nowa generacja
+
+    def test_each_encoding_has_its_own_etag(self):
+        plain = self.client.get(self.url)
+        packed = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip;q=1, identity;q=0.5")
+        self.assertEqual(packed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(packed.content), plain.content)
+        self.assertNotEqual(packed["ETag"], plain["ETag"])
+        self.assertIn("Accept-Encoding", packed["Vary"])
+
+        again = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=packed["ETag"])
+        self.assertEqual(again.status_code, 304)
+        other = self.client.get(self.url, HTTP_IF_NONE_MATCH=packed["ETag"])
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=plain["ETag"]).status_code, 304)
+
+
+class _Reply:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class UpstreamClientTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = 1000.0
+        for target, kw in (("time.sleep", {}), ("time.monotonic", {"side_effect": lambda: self.clock})):
+            patcher = mock.patch(target, **kw)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def client_with(self, side_effect, **options):
+        client = UpstreamClient("test", backoff=0.01, **options)
+        client.session.get = mock.Mock(side_effect=side_effect)
+        return client
+
+    def test_read_timeout_is_not_retried(self):
+        client = self.client_with(requests.ReadTimeout("slow"))
+        with self.assertRaises(requests.ReadTimeout):
+            client.get("http://imgw.test/")
+        self.assertEqual(client.session.get.call_count, 1)
+        self.assertEqual(client.stats()["failures"], 1)
+
+    def test_connection_errors_are_retried_up_to_the_limit(self):
+        client = self.client_with(requests.ConnectionError("refused"), retries=2)
+        with self.assertRaises(requests.ConnectionError):
+            client.get("http://imgw.test/")
+        self.assertEqual(client.session.get.call_count, 3)
+        self.assertEqual((client.stats()["retries"], client.stats()["failures"]), (2, 1))
+
+    def test_retryable_status_then_success(self):
+        client = self.client_with([_Reply(503), _Reply(200)])
+        self.assertEqual(client.get("http://imgw.test/").status_code, 200)
+        self.assertEqual(client.stats()["retries"], 1)
+        self.assertEqual(client.stats()["breaker"]["consecutive_failures"], 0)
+
+    def test_retry_budget_limits_retries(self):
+        client = self.client_with(requests.ConnectionError("refused"), retries=5,
+                                  retry_budget_ratio=0, retry_budget_min_per_s=0)
+        client.budget._tokens = 1
+        with self.assertRaises(requests.ConnectionError):
+            client.get("http://imgw.test/")
+        self.assertEqual(client.session.get.call_count, 2)
+        self.assertEqual(client.stats()["retry_budget_exhausted"], 1)
+
+    def test_attempts_stay_within_total_timeout(self):
+        def slow(*args, timeout, **kw):
+            self.clock += 2.0
+            raise requests.ConnectTimeout("slow connect")
+
+        client = self.client_with(slow, retries=5, total_timeout=5.0, connect_timeout=3.05)
+        with self.assertRaises(requests.ConnectTimeout):
+            client.get("http://imgw.test/")
+        timeouts = [c.kwargs["timeout"] for c in client.session.get.call_args_list]
+        self.assertEqual(len(timeouts), 2)  # po 4 s nie starczy czasu na trzecia probe
+        self.assertEqual(timeouts[0], (3.05, 5.0))
+        self.assertLessEqual(max(timeouts[1]), 3.0)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = 1_000_000.0
+        patcher = mock.patch("time.time", lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failures=2, reset=30, cache_alias="default")
+
+    def state(self):
+        return self.breaker.status()["state"]
+
+    def test_opens_after_failures_and_closes_after_probe(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.state(), CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.is_open())
+
+        self.clock += 31
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow())  # jedna proba
+        self.assertEqual(self.state(), HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.is_open())
+
+        self.breaker.record_success()
+        self.assertEqual(self.state(), CLOSED)
+        self.assertEqual(self.breaker.status()["consecutive_failures"], 0)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock += 31
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_abandoned_probe_expires(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock += 31
+        self.assertTrue(self.breaker.allow())  # proba porzucona - brak record_*
+        self.clock += 31
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.state(), HALF_OPEN)
+
+
+class UpstreamErrorViewTests(TestCase):
+    point = {"lat": "52.23", "lon": "21.01"}
+
+    def setUp(self):
+        _reset_process_state()
+        fresh = RefreshResult(ok=True, refreshed=False, fetched_at=timezone.now(), age_seconds=1.0)
+        for target, kw in (("refresh_imgw_future", {"return_value": _done(fresh)}),
+                           ("run_in_executor", {"side_effect": _run_inline})):
+            patcher = mock.patch(f"meteo.views.{target}", **kw)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def open_breaker(self, name):
+        breaker = upstream(name).breaker
+        for _ in range(breaker.failures):
+            breaker.record_failure()
+        return UpstreamUnavailable(f"{name}: circuit open")
+
+    def test_point_views_map_geoportal_errors(self):
+        unavailable = self.open_breaker("geoportal")
+        for url in ("/api/meteo/warnings", "/api/meteo/history", "/api/meteo/warnings/future"):
+            with self.subTest(url=url):
+                with mock.patch("meteo.views.teryt4_from_latlon", side_effect=unavailable):
+                    response = self.client.get(url, self.point)
+                self.assertEqual(response.status_code, 503)
+                self.assertGreaterEqual(int(response["Retry-After"]), 1)
+                with mock.patch("meteo.views.teryt4_from_latlon", side_effect=requests.ReadTimeout("slow")):
+                    self.assertEqual(self.client.get(url, self.point).status_code, 502)
+
+    def test_live_maps_imgw_and_geoportal_errors(self):
+        url = "/api/meteo/warnings/live"
+        with mock.patch("meteo.views.fetch_imgw", side_effect=self.open_breaker("imgw")), \
+                mock.patch("meteo.views.teryt4_from_latlon", return_value=("1465", "Warszawa")):
+            response = self.client.get(url, self.point)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+
+        with mock.patch("meteo.views.fetch_imgw", return_value=[]), \
+                mock.patch("meteo.views.teryt4_from_latlon", side_effect=requests.ConnectionError("down")):
+            self.assertEqual(self.client.get(url, self.point).status_code, 502)
+
+
+@override_settings(METEO_POINT_BBOX=(14.0, 48.9, 24.2, 54.9))
+class PointLocateTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        fresh = RefreshResult(ok=True, refreshed=False, fetched_at=timezone.now(), age_seconds=1.0)
+        for target, kw in (("refresh_imgw_future", {"return_value": _done(fresh)}),
+                           ("run_in_executor", {"side_effect": _run_inline}),
+                           ("teryt4_from_latlon", {"return_value": ("1465", "Warszawa")})):
+            patcher = mock.patch(f"meteo.views.{target}", **kw)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_lookup_runs_on_the_request_pool(self):
+        response = self.client.get("/api/meteo/warnings", {"lat": "52.23", "lon": "21.01"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["area"]["teryt4"], "1465")
+        self.run_in_executor.assert_called_once_with(self.teryt4_from_latlon, 52.23, 21.01)
+        self.refresh_imgw_future.assert_called_once()
+
+    def test_bad_or_foreign_points_skip_lookup_and_refresh(self):
+        for url in ("/api/meteo/warnings", "/api/meteo/history", "/api/meteo/warnings/future",
+                    "/api/meteo/warnings/live"):
+            for (lat, lon), expected in ((("95", "21"), 400), (("nan", "21"), 400), (("40.4", "-3.7"), 404)):
+                with self.subTest(url=url, lat=lat, lon=lon):
+                    response = self.client.get(url, {"lat": lat, "lon": lon})
+                    self.assertEqual(response.status_code, expected)
+        self.run_in_executor.assert_not_called()
+        self.refresh_imgw_future.assert_not_called()
+
+    @override_settings(METEO_REQUEST_DEADLINE=0.1)
+    def test_slow_lookup_times_out(self):
+        self.run_in_executor.side_effect = None
+        self.run_in_executor.return_value = Future()  # Geoportal nie odpowiada
+        started = time.monotonic()
+        response = self.client.get("/api/meteo/history", {"lat": "52.23", "lon": "21.01"})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response.status_code, 504)
+
+
+@override_settings(METEO_GENERATION_POLL=60, METEO_INGEST_LEASE_TTL=0)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        now = timezone.now()
+        ingest_imgw([_item("w1", ["1465"]), _item("w2", ["1465"])])
+        Warning.objects.filter(id="w1").update(valid_from=now - timedelta(hours=1), valid_to=now + timedelta(hours=2))
+        Warning.objects.filter(id="w2").update(valid_from=now + timedelta(hours=3), valid_to=now + timedelta(hours=5))
+        services._generation["checked"] = 0.0
+
+    def test_hit_skips_the_row_query(self):
+        for url, rows in (("/api/meteo/warnings/teryt/1465", "_current_rows"),
+                          ("/api/meteo/history/teryt/1465?refresh=0", "_history_rows"),
+                          ("/api/meteo/warnings/future/teryt/1465?refresh=0", "_future_rows")):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with mock.patch(f"meteo.views.{rows}", side_effect=AssertionError("row query on a hit")):
+                    second = self.client.get(url)
+                self.assertEqual(second.status_code, 200)
+                self.assertEqual(second.json()["items"], first.json()["items"])
+                self.assertEqual((second["ETag"], second["Last-Modified"]), (first["ETag"], first["Last-Modified"]))
+
+    def test_new_generation_misses(self):
+        url = "/api/meteo/warnings/teryt/1465"
+        self.assertEqual(self.client.get(url).json()["count"], 1)
+        Warning.objects.filter(id="w2").update(valid_from=timezone.now() - timedelta(minutes=5))
+        ingest_imgw([_item("w3", ["0201"])])
+        services._generation["checked"] = 0.0
+        self.assertEqual(self.client.get(url).json()["count"], 2)
+
+    @override_settings(METEO_RESPONSE_CACHE=None)
+    def test_disabled_cache_always_queries(self):
+        url = "/api/meteo/warnings/teryt/1465"
+        self.client.get(url)
+        with mock.patch("meteo.views._current_rows", return_value=[]) as rows:
+            self.assertEqual(self.client.get(url).json()["count"], 0)
+        rows.assert_called_once()
+
+@override_settings(METEO_GENERATION_POLL=60, METEO_INGEST_LEASE_TTL=0)
+class ConditionalGetTests(TestCase):
+    url = "/api/meteo/warnings/teryt/1465"
+
+    def setUp(self):
+        _reset_process_state()
+        now = timezone.now()
+        ingest_imgw([_item("w1", ["1465"])])
+        Warning.objects.filter(id="w1").update(valid_from=now - timedelta(hours=1), valid_to=now + timedelta(hours=2))
+        services._generation["checked"] = 0.0
+
+    def test_matching_etag_costs_no_queries(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()["count"], 1)
+        self.assertTrue(first["ETag"].startswith('W/"'))
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], first["ETag"])
+        third = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(third.status_code, 304)
+
+    def test_new_generation_changes_the_etag(self):
+        first = self.client.get(self.url)
+        ingest_imgw([_item("w2", ["1465"])])
+        services._generation["checked"] = 0.0
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+
+@override_settings(METEO_IMGW_REFRESH_TTL=60, METEO_GENERATION_POLL=60)
+class CacheControlTests(TestCase):
+    url = "/api/meteo/warnings/teryt/1465"
+
+    def setUp(self):
+        _reset_process_state()
+        ingest_imgw([_item("w1", ["1465"])])
+        services._generation["checked"] = 0.0
+
+    def max_age(self):
+        response = self.client.get(self.url)
+        self.assertIn("public", response["Cache-Control"])
+        return int(re.search(r"max-age=(\d+)", response["Cache-Control"]).group(1))
+
+    def set_validity(self, starts_in, ends_in):
+        now = timezone.now()
+        Warning.objects.filter(id="w1").update(
+            valid_from=now + timedelta(seconds=starts_in), valid_to=now + timedelta(seconds=ends_in),
+        )
+        warning_index._index = None
+
+    def test_max_age_stops_at_the_next_boundary(self):
+        self.set_validity(-600, 30)  # koniec obowiazywania za 30 s
+        self.assertIn(self.max_age(), (28, 29, 30))
+        self.set_validity(15, 600)  # poczatek za 15 s
+        self.assertIn(self.max_age(), (13, 14, 15))
+
+    def test_max_age_stops_at_the_next_possible_ingest(self):
+        self.set_validity(-600, 3600)
+        services._refresh_state.update(seq=1, ok=True, fetched_at=timezone.now() - timedelta(seconds=50))
+        self.assertIn(self.max_age(), (8, 9, 10))
+        services._refresh_state.update(fetched_at=timezone.now() - timedelta(seconds=90))
+        self.assertEqual(self.max_age(), 0)
+
+
+class IngestLeaseTests(TestCase):
+    def setUp(self):
+        _reset_process_state()
+        self.addCleanup(lease._held.clear)  # atexit nie zwalnia dzierzaw z wycofanej bazy testu
+
+    def set_foreign(self, expires_in, token=5):
+        IngestLease.objects.update_or_create(source=IMGW_SOURCE, defaults={
+            "holder": "other-host:1:abcd", "token": token,
+            "expires_at": timezone.now() + timedelta(seconds=expires_in),
+        })
+
+    def test_acquire_and_renew(self):
+        token = lease.acquire_lease(IMGW_SOURCE)
+        self.assertEqual(token, 1)
+        self.assertEqual(lease.acquire_lease(IMGW_SOURCE), token)
+        lease.check_fence(IMGW_SOURCE, token)
+        self.assertTrue(lease.lease_status(IMGW_SOURCE)["held_here"])
+
+    def test_expired_lease_is_taken_over_with_new_token(self):
+        self.set_foreign(expires_in=-1)
+        self.assertEqual(lease.acquire_lease(IMGW_SOURCE), 6)
+        with self.assertRaises(lease.LeaseLost):
+            lease.check_fence(IMGW_SOURCE, 5)
+
+    def test_valid_foreign_lease_is_remembered(self):
+        self.set_foreign(expires_in=60)
+        self.assertIsNone(lease.acquire_lease(IMGW_SOURCE))
+        with self.assertNumQueries(0):
+            self.assertIsNone(lease.acquire_lease(IMGW_SOURCE))
+        self.assertEqual(lease.acquire_lease(IMGW_SOURCE, steal=True), 6)
+
+    def test_stale_fence_rolls_back_sync(self):
+        token = lease.acquire_lease(IMGW_SOURCE)
+        self.set_foreign(expires_in=60, token=token + 1)  # inny wezel przejal dzierzawe
+        feed = _FeedResponse([_item("w1", ["1465"])])
+        with mock.patch("meteo.services.fetch_imgw_conditional", return_value=feed):
+            with self.assertRaises(lease.LeaseLost):
+                sync_imgw(fence=token)
+        self.assertFalse(Warning.objects.exists())
+        state = IngestState.objects.get(source=IMGW_SOURCE)
+        self.assertIsNone(state.fetched_at)
+        self.assertEqual(state.generation, 0)
+
+    def test_release_lets_the_next_holder_in(self):
+        token = lease.acquire_lease(IMGW_SOURCE)
+        lease.release_lease(IMGW_SOURCE, token)
+        IngestLease.objects.filter(source=IMGW_SOURCE).update(holder="other-host:1:abcd")
+        self.assertEqual(lease.acquire_lease(IMGW_SOURCE), token + 1)
+
+    @override_settings(METEO_INGEST_LEASE_TTL=90)
+    def test_follower_waits_outside_the_refresh_lock(self):
+        self.set_foreign(expires_in=60)
+
+        def follow(ttl):
+            self.assertFalse(services._refresh_lock.locked())
+            return services._refresh_result(refreshed=False)
+
+        with mock.patch("meteo.services._follower_result", side_effect=follow) as follower, \
+                mock.patch("meteo.services.sync_imgw") as sync:
+            refresh_imgw()
+        follower.assert_called_once()
+        sync.assert_not_called()
+
+    @override_settings(METEO_INGEST_LEASE_TTL=90, METEO_INGEST_FOLLOWER_WAIT=0.05)
+    def test_follower_gives_up_once_per_lease_ttl(self):
+        self.set_foreign(expires_in=60)
+        real_sleep = time.sleep
+        with mock.patch("time.sleep", side_effect=lambda s: real_sleep(0.01)) as sleep:
+            self.assertFalse(refresh_imgw().ok)  # posiadacz nie pobral w czasie
+            self.assertTrue(sleep.called)
+            sleep.reset_mock()
+            self.assertFalse(refresh_imgw().ok)  # kolejne wywolanie nie czeka
+            sleep.assert_not_called()
+
+            IngestState.objects.create(source=IMGW_SOURCE, fetched_at=timezone.now())
+            self.assertTrue(refresh_imgw().ok)  # posiadacz pobral - dane z DB
+        self.assertIsNone(services._refresh_state["follower_gave_up"])
 
-# Create your tests here.
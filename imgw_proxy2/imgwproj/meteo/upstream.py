@@ -0,0 +1,291 @@
+# meteo/upstream.py
+"""
+Wspolny klient HTTP do zrodel zewnetrznych (IMGW, Geoportal).
+
+Kazde zrodlo ma wlasna requests.Session z pula polaczen (keep-alive), timeouty
+connect/read, limit czasu calego wywolania (total_timeout), ponowienia bledow polaczenia
+i 429/502/503/504 (nie timeoutow odczytu) z losowym (full jitter) odstepem i budzet ponowien:
+ponowienie kosztuje 1 zeton, kazde zapytanie dodaje retry_budget_ratio zetonu,
+a co sekunde przybywa retry_budget_min_per_s - przy awarii zrodla liczba
+ponowien nie mnozy ruchu. Czasy odpowiedzi trafiaja do histogramu (status_view).
+
+Bezpiecznik (CircuitBreaker) na zrodlo: po breaker_failures nieudanych wywolaniach
+z rzedu stan "open" - wywolania koncza sie od razu UpstreamUnavailable, bez sieci;
+po breaker_reset sekundach jeden proces puszcza probe ("half_open"): sukces zamyka,
+blad otwiera ponownie; proba porzucona (worker zabity w trakcie) wygasa z kluczem probe
+i nastepny worker probuje od nowa. Stan jest w Django cache (breaker_cache, alias CACHES):
+z backendem wspoldzielonym (Redis, Memcached, DB) widza go wszystkie workery, z domyslnym
+LocMemCache kazdy proces ma wlasny bezpiecznik.
+Ustawienia: settings.METEO_UPSTREAMS = {"imgw": {...}, "geoportal": {...}} (klucze jak DEFAULTS).
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+DEFAULTS = {
+    "connect_timeout": 3.05,  # s
+    "read_timeout": 10.0,  # s
+    "retries": 2,  # ponowienia po pierwszej probie
+    "total_timeout": 25.0,  # s na wszystkie proby razem (nie wiecej niz timeout workera)
+    "backoff": 0.2,  # s; odstep losowany z [0, backoff * 2**proba]
+    "backoff_max": 2.0,  # s
+    "pool_maxsize": 10,  # polaczen keep-alive na zrodlo
+    "retry_budget_ratio": 0.2,  # zetonu na zapytanie
+    "retry_budget_min_per_s": 1.0,
+    "breaker_failures": 5,  # nieudanych wywolan z rzedu do otwarcia
+    "breaker_reset": 30.0,  # s w stanie open przed proba
+    "breaker_cache": "default",  # alias CACHES ze stanem bezpiecznika
+}
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+UPSTREAMS = ("imgw", "geoportal")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Bezpiecznik otwarty - wywolanie odrzucone bez laczenia sie ze zrodlem."""
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # ostatni kubelek: powyzej najwiekszej granicy
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect_left(self.buckets, ms)] += 1
+            self.total_ms += ms
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            n = sum(self.counts)
+            labels = [f"le_{b}" for b in self.buckets] + ["inf"]
+            return {
+                "count": n,
+                "avg_ms": round(self.total_ms / n, 1) if n else None,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class RetryBudget:
+    def __init__(self, ratio: float, min_per_s: float, cap: float = 100.0):
+        self.ratio = ratio
+        self.min_per_s = min_per_s
+        self.cap = cap
+        self._tokens = cap
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.cap, self._tokens + (now - self._last) * self.min_per_s)
+        self._last = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Stan w cache pod meteo:cb:<nazwa>: {"state", "opened_at"} + licznik bledow
+    (cache.incr) + klucz probe (cache.add - probe puszcza tylko jeden worker).
+    Niedostepny cache = bezpiecznik przepuszcza wszystko.
+    """
+
+    def __init__(self, name: str, failures: int, reset: float, cache_alias: str):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.cache_alias = cache_alias
+        self._key = f"meteo:cb:{name}"
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _state(self) -> dict:
+        return self.cache.get(self._key + ":state") or {"state": CLOSED, "opened_at": None}
+
+    def allow(self) -> bool:
+        """Czy wolno wywolac zrodlo (w stanie open po reset - tylko jedna proba)."""
+        try:
+            st = self._state()
+            if st["state"] == CLOSED:
+                return True
+            if time.time() - st["opened_at"] < self.reset:
+                return False
+            if not self.cache.add(self._key + ":probe", 1, timeout=max(1, int(self.reset))):
+                return False
+            self.cache.set(self._key + ":state", {**st, "state": HALF_OPEN}, timeout=None)
+            return True
+        except Exception:
+            return True
+
+    def is_open(self) -> bool:
+        """Tylko odczyt: True, gdy allow() na pewno odmowi (bez zajmowania proby)."""
+        try:
+            st = self._state()
+            if st["state"] == CLOSED:
+                return False
+            if st["state"] == HALF_OPEN:
+                # proba trwa, dopoki zyje jej klucz; wygasly = proba porzucona, allow() pusci nowa
+                return self.cache.get(self._key + ":probe") is not None
+            return time.time() - st["opened_at"] < self.reset
+        except Exception:
+            return False
+
+    def record_success(self) -> None:
+        try:
+            if self._state()["state"] != CLOSED:
+                self.cache.set(self._key + ":state", {"state": CLOSED, "opened_at": None}, timeout=None)
+                self.cache.delete(self._key + ":probe")
+            self.cache.delete(self._key + ":failures")
+        except Exception:
+            pass
+
+    def record_failure(self) -> None:
+        try:
+            st = self._state()
+            key = self._key + ":failures"
+            self.cache.add(key, 0, timeout=None)
+            failures = self.cache.incr(key)
+            if st["state"] == HALF_OPEN or (st["state"] == CLOSED and failures >= self.failures):
+                self.cache.set(self._key + ":state", {"state": OPEN, "opened_at": time.time()}, timeout=None)
+                self.cache.delete(self._key + ":probe")
+        except Exception:
+            pass
+
+    def status(self) -> dict:
+        try:
+            st = self._state()
+            failures = self.cache.get(self._key + ":failures") or 0
+        except Exception as e:
+            return {"state": "unknown", "error": str(e)}
+        out = {"state": st["state"], "consecutive_failures": failures}
+        if st["state"] == OPEN:
+            out["retry_in_s"] = max(0.0, round(st["opened_at"] + self.reset - time.time(), 1))
+        return out
+
+
+class UpstreamClient:
+    def __init__(self, name: str, **options):
+        self.name = name
+        self.options = {**DEFAULTS, **options}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(self.options["pool_maxsize"]))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.budget = RetryBudget(self.options["retry_budget_ratio"], self.options["retry_budget_min_per_s"])
+        self.latency = LatencyHistogram()
+        self.breaker = CircuitBreaker(
+            name, int(self.options["breaker_failures"]), float(self.options["breaker_reset"]),
+            self.options["breaker_cache"],
+        )
+        self.requests = self.retries = self.failures = self.budget_exhausted = self.rejected = 0
+
+    def get(self, url: str, *, params=None, headers=None, read_timeout: Optional[float] = None) -> requests.Response:
+        """
+        GET z ponowieniami (bledy polaczenia, 429/502/503/504) w limicie total_timeout;
+        timeout odczytu nie jest ponawiany (zrodlo juz odpowiada za wolno).
+        Zwraca ostatnia odpowiedz (tez z bledem HTTP - raise_for_status po stronie wywolujacego);
+        wyjatek requests, gdy zadna proba nie dostala odpowiedzi;
+        UpstreamUnavailable od razu, gdy bezpiecznik jest otwarty.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+        opts = self.options
+        read = read_timeout or opts["read_timeout"]
+        deadline = time.monotonic() + float(opts["total_timeout"])
+        self.requests += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            timeout = (min(opts["connect_timeout"], remaining), min(read, remaining))
+            started = time.perf_counter()
+            retryable = False
+            try:
+                r = self.session.get(url, params=params, headers=headers, timeout=timeout)
+                error = None
+                retryable = r.status_code in RETRY_STATUSES
+            except requests.ConnectionError as e:  # w tym ConnectTimeout
+                r, error = None, e
+                retryable = True
+            except requests.Timeout as e:  # ReadTimeout
+                r, error = None, e
+            self.latency.observe(time.perf_counter() - started)
+
+            if not retryable or attempt >= opts["retries"]:
+                break
+            pause = random.uniform(0, min(opts["backoff_max"], opts["backoff"] * 2 ** (attempt + 1)))
+            if deadline - time.monotonic() - pause < min(1.0, opts["connect_timeout"]):
+                break  # na kolejna probe nie starczy czasu
+            if not self.budget.withdraw():
+                self.budget_exhausted += 1
+                break
+            attempt += 1
+            self.retries += 1
+            time.sleep(pause)
+
+        if error is not None or r.status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if error is not None:
+            raise error
+        return r
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "retry_budget_exhausted": self.budget_exhausted,
+            "rejected_by_breaker": self.rejected,
+            "breaker": self.breaker.status(),
+            "latency": self.latency.snapshot(),
+        }
+
+
+_clients: dict[str, UpstreamClient] = {}
+_clients_lock = threading.Lock()
+
+
+def upstream(name: str) -> UpstreamClient:
+    """Wspoldzielony (per proces) klient dla zrodla name ("imgw", "geoportal")."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                options = (getattr(settings, "METEO_UPSTREAMS", None) or {}).get(name, {})
+                client = _clients[name] = UpstreamClient(name, **options)
+    return client
+
+
+def upstream_stats() -> dict:
+    return {name: upstream(name).stats() for name in UPSTREAMS}
@@ -9,16 +9,22 @@ from .views import (
     centroid_for_teryt,
     future_for_teryt,
     future_for_point,
+    export_warnings_view,
+    warnings_batch,
+    warnings_all,
 )
 
 urlpatterns = [
     path("warnings", warnings_for_point),
     path("warnings/teryt/<str:teryt4>", warnings_for_teryt),
     path("warnings/live", warnings_live),
+    path("warnings/batch", warnings_batch),  # POST {"points": [{"lat": .., "lon": ..}, ...]}
+    path("warnings/all", warnings_all),  # all counties, precompressed
     path("history", history_for_point),
     path("history/teryt/<str:teryt4>", history_for_teryt),
     path("status", status_view),
     path("centroid", centroid_for_teryt),  # /api/meteo/centroid?teryt=3216
     path("warnings/future/teryt/<str:teryt4>", future_for_teryt), # future alerts for (TERYT)
     path("warnings/future", future_for_point), # future alerts for (lat/lon)
+    path("export", export_warnings_view),  # /api/meteo/export?format=csv&since=2025-09-01
 ]
\ No newline at end of file
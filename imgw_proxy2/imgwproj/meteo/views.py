@@ -1,23 +1,35 @@
+import base64
 import json
-import requests
+import math
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q, Max
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_GET
 
+import requests
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import Warning, PointSnapshot
-from .serializers import WarningSerializer
-from .services import teryt4_from_latlon, fetch_imgw, upsert_imgw
-
-
-# PRG / Geoportal – warstwa powiatow
-GEO_URL = "https://mapy.geoportal.gov.pl/wss/ims/maps/PRG_gugik_wyszukiwarka/MapServer/1/query"
+from .models import Warning, PointSnapshot, Powiat
+from .export import CONTENT_TYPES, FORMATS, export_warnings
+from .fragments import warning_fragments
+from .lease import lease_status
+from .services import (
+    IMGW_SOURCE, parse_dt_local_utc, run_in_executor, teryt4_from_latlon, teryt4_from_latlon_many, fetch_imgw, refresh_imgw, refresh_imgw_future, imgw_data_age, teryt_lru, geoportal_county,
+)
+from .snapshot import current_snapshot
+from .upstream import UpstreamUnavailable, upstream, upstream_stats
+from .response_cache import cached_response, not_modified, response_validators, set_validators
+from .warning_index import ROW_FIELDS, warning_index
 
 
 @api_view(["GET"])
@@ -34,40 +46,42 @@ def warnings_for_point(request):
         return Response({"detail": "lat and lon are required floats"},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    # mapowanie punktu -> TERYT-4
-    teryt4, area = teryt4_from_latlon(lat, lon)
-    if not teryt4:
-        return Response({"detail": "county not found for this point"},
-                        status=status.HTTP_404_NOT_FOUND)
-
-    # fetch + zapis do bazy (best-effort)
-    imgw_ok = True
-    try:
-        items = fetch_imgw()
-        upsert_imgw(items)
-    except Exception:
-        imgw_ok = False
-
-    # aktywne TERAZ z DB (zadziała także, gdy IMGW padlo)
-    qs = Warning.current_for_powiat(teryt4)
-    data = WarningSerializer(qs, many=True).data
-    
-    future_count = (Warning.objects
-                .filter(coverage__teryt4=teryt4, valid_from__gt=timezone.now())
-                .distinct()
-                .count())
+    # mapowanie punktu -> TERYT-4, w tym czasie fetch + zapis do bazy (best-effort,
+    # nie czesciej niz METEO_IMGW_REFRESH_TTL; dane mlodsze niz max_stale -> od razu,
+    # odswiezanie w tle), czekamy najwyzej METEO_REQUEST_DEADLINE
+    located = _locate_and_refresh(request, lat, lon, optional=False)
+    if isinstance(located, Response):
+        return located
+    teryt4, area, imgw_ok, data_age = located
 
     # opcjonalny snapshot
     saved = None
-    if request.query_params.get("save") in ("1", "true", "True", "yes"):
+    save = request.query_params.get("save") in ("1", "true", "True", "yes")
+    validators = None
+    if not save:
+        # ETag/Last-Modified; 304 zanim zapytamy o wiersze
+        validators = response_validators("warnings_for_point", teryt4, {
+            "lat": lat, "lon": lon, "area": area, "imgw_available": imgw_ok,
+        }, data_age=data_age)
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+
+    # aktywne TERAZ z DB / indeksu (zadziała także, gdy IMGW padlo)
+    now = timezone.now()
+    rows = _current_rows(teryt4, now)
+    future_count = len(_future_rows(teryt4, now))
+
+    data = warning_fragments(rows)
+    if save:
         with transaction.atomic():
             snap = PointSnapshot.objects.create(
                 lat=lat, lon=lon, teryt4=teryt4, area_name=area or ""
             )
-            snap.warnings.set(qs)
+            snap.warnings.set([r["id"] for r in rows])
             saved = snap.id
 
-    return Response({
+    response = Response({
         "point": {"lat": lat, "lon": lon},
         "area": {"teryt4": teryt4, "name": area},
         "count": len(data),
@@ -75,67 +89,364 @@ def warnings_for_point(request):
         "currently_active_IMGW_alerts": len(data),
         "saved_snapshot_id": saved,
         "imgw_available": imgw_ok,
+        "data_age_s": data_age,
         "future_IMGW_alerts_for_this_teryt": future_count,   
     })
+    return set_validators(response, validators) if validators else response
+
+
+@api_view(["POST"])
+def warnings_batch(request):
+    """
+    Aktualne i przyszle ostrzezenia dla wielu punktow naraz.
+    Body: {"points": [{"lat": 52.23, "lon": 21.01}, ...]} (najwyzej METEO_BATCH_MAX_POINTS).
+    Jedno odswiezenie IMGW (rownolegle z mapowaniem), mapowanie wszystkich punktow w jednym przebiegu,
+    ostrzezenia raz na powiat ("areas"); "results" w kolejnosci punktow wskazuja powiat.
+    Punkt, ktorego nie udalo sie zmapowac w METEO_REQUEST_DEADLINE, ma teryt4=null i "error".
+    """
+    points = request.data.get("points") if isinstance(request.data, dict) else None
+    if not isinstance(points, list) or not points:
+        return Response({"detail": "points must be a non-empty list"}, status=400)
+    limit = int(getattr(settings, "METEO_BATCH_MAX_POINTS", 1000))
+    if len(points) > limit:
+        return Response({"detail": f"at most {limit} points per request"}, status=400)
+    coords = []
+    for i, p in enumerate(points):
+        try:
+            lat, lon = (p["lat"], p["lon"]) if isinstance(p, dict) else p
+            coords.append((float(lat), float(lon)))
+        except Exception:
+            return Response({"detail": f"points[{i}]: lat and lon are required floats"}, status=400)
+
+    # odswiezenie IMGW (wspolny Future) w tle mapowania; oba w jednym budzecie
+    # METEO_REQUEST_DEADLINE, po nim odpowiedz z DB z imgw_available=False
+    deadline = time.monotonic() + float(getattr(settings, "METEO_REQUEST_DEADLINE", 10))
+    refresh = refresh_imgw_future(max_stale=_max_stale(request))
+    # punkty nierozwiazane w czasie (Geoportal) -> None, reszta odpowiedzi normalnie
+    resolved = teryt4_from_latlon_many(coords, timeout=max(0.0, deadline - time.monotonic()))
+    result = _wait(refresh, deadline)
+    if result is _TIMED_OUT:
+        imgw_ok, data_age = False, imgw_data_age()
+    else:
+        imgw_ok, data_age = result.ok, result.age_seconds
+
+    now = timezone.now()
+    names = {hit[0]: hit[1] for hit in resolved if hit and hit[0]}
+    by_county = _county_rows_many(names, now)
+    areas = {
+        t4: {
+            "name": names[t4],
+            "items": warning_fragments(active),
+            "future_items": warning_fragments(future),
+        }
+        for t4, (active, future) in by_county.items()
+    }
+    results = []
+    for (lat, lon), hit in zip(coords, resolved):
+        if hit is None:
+            results.append({
+                "point": {"lat": lat, "lon": lon},
+                "teryt4": None,
+                "error": "county lookup failed or timed out",
+            })
+            continue
+        active, future = by_county.get(hit[0], ((), ()))
+        results.append({
+            "point": {"lat": lat, "lon": lon},
+            "teryt4": hit[0],
+            "currently_active_IMGW_alerts": len(active),
+            "future_IMGW_alerts_for_this_teryt": len(future),
+        })
+    return Response({
+        "count": len(results),
+        "results": results,
+        "areas": areas,
+        "imgw_available": imgw_ok,
+        "data_age_s": data_age,
+    })
 
 
 @api_view(["GET"])
 def status_view(request):
     last_pub = Warning.objects.aggregate(Max("published_at"))["published_at__max"]
-    return Response({"now": timezone.now(), "last_published": last_pub})
+    return Response({
+        "now": timezone.now(),
+        "last_published": last_pub,
+        "teryt_cache": teryt_lru().stats(),
+        "upstream": upstream_stats(),
+        "ingest_lease": lease_status(IMGW_SOURCE),
+    })
 
 
-def _parse_dt_local_utc(s: str | None):
+def _max_stale(request) -> float | None:
     """
-    Przyjmuje np. '2025-09-14' albo '2025-09-14T12:30:00' (czas lokalny PL)
-    i zwraca aware UTC. Gdy podano sama date – 00:00:00 lokalnie.
+    Akceptowalny wiek danych IMGW w sekundach: parametr max_stale albo
+    settings.METEO_IMGW_MAX_STALE. Mlodsze dane -> odpowiedz od razu (odswiezanie w tle).
     """
-    if not s:
-        return None
+    raw = request.query_params.get("max_stale")
     try:
-        if len(s) == 10:
-            dt = datetime.strptime(s, "%Y-%m-%d")
-        else:
-            dt = datetime.fromisoformat(s)
-    except Exception:
+        if raw is not None and float(raw) >= 0:
+            return float(raw)
+    except ValueError:
+        pass
+    return getattr(settings, "METEO_IMGW_MAX_STALE", None)
+
+
+def _maybe_refresh(request) -> tuple[bool, float | None]:
+    """
+    Wspolny parametr refresh=0|1 (domyslnie 1) dla historii i przyszlych ostrzezen,
+    z max_stale jak wyzej. Zwraca (imgw_available, data_age_s).
+    """
+    do_refresh = request.query_params.get("refresh", "1") not in ("0", "false", "False", "no")
+    if not do_refresh:
+        return True, imgw_data_age()
+    refresh = refresh_imgw(max_stale=_max_stale(request))
+    return refresh.ok, refresh.age_seconds
+
+
+_TIMED_OUT = object()
+
+
+def _start_refresh(request, optional: bool = True):
+    """
+    refresh_imgw_future() z max_stale zapytania; None, gdy refresh=0 (optional=True jak
+    w _maybe_refresh - historia i przyszle ostrzezenia).
+    """
+    if optional and request.query_params.get("refresh", "1") in ("0", "false", "False", "no"):
         return None
-    return dt.replace(tzinfo=ZoneInfo("Europe/Warsaw")).astimezone(ZoneInfo("UTC"))
+    return refresh_imgw_future(max_stale=_max_stale(request))
+
+
+def _wait(future, deadline: float):
+    """Wynik future albo _TIMED_OUT po monotonicznym terminie deadline."""
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        return _TIMED_OUT
+
+
+def _upstream_error(source: str, label: str, exc: Exception) -> Response:
+    """
+    Blad zrodla zewnetrznego (source jak w METEO_UPSTREAMS): otwarty bezpiecznik
+    (UpstreamUnavailable) -> 503 z Retry-After, inny blad -> 502.
+    """
+    if isinstance(exc, UpstreamUnavailable):
+        retry_in = upstream(source).breaker.status().get("retry_in_s") or 1
+        response = Response({"detail": f"{label} temporarily unavailable"}, status=503)
+        response["Retry-After"] = str(max(1, math.ceil(retry_in)))
+        return response
+    return Response({"detail": f"{label} error: {exc}"}, status=502)
 
 
-def _history_qs_for_teryt(teryt4: str, since_utc, until_utc, active_at_utc):
+def _check_point(lat: float, lon: float):
+    """
+    None dla punktu, ktory moze lezec w powiecie; inaczej Response: 400 dla wspolrzednych
+    spoza zakresu, 404 poza settings.METEO_POINT_BBOX (bez Geoportalu i bez odswiezania IMGW).
+    """
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        return Response({"detail": "lat must be within -90..90 and lon within -180..180"}, status=400)
+    bbox = getattr(settings, "METEO_POINT_BBOX", None)
+    if bbox and not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+        return Response({"detail": "county not found for this point"}, status=404)
+    return None
+
+
+def _lookup(lat: float, lon: float, deadline: float):
+    """
+    teryt4_from_latlon w puli zapytan (run_in_executor) najwyzej do monotonicznego terminu
+    deadline. Zwraca (teryt4, area) albo Response 404 / 502 / 503 / 504; mapowanie po
+    terminie konczy sie w tle (i trafia do cache).
+    """
+    try:
+        hit = _wait(run_in_executor(teryt4_from_latlon, lat, lon), deadline)
+    except requests.RequestException as e:
+        return _upstream_error("geoportal", "Geoportal", e)
+    if hit is _TIMED_OUT:
+        return Response({"detail": "county lookup timed out"}, status=504)
+    if not hit[0]:
+        return Response({"detail": "county not found for this point"}, status=404)
+    return hit
+
+
+def _locate_and_refresh(request, lat: float, lon: float, optional: bool = True):
+    """
+    Sprawdzenie punktu (_check_point), potem odswiezenie IMGW (_start_refresh; optional jak
+    tam) i w tym czasie geokodowanie w puli zapytan - oba czekaja najwyzej do konca
+    budzetu settings.METEO_REQUEST_DEADLINE (s) liczonego od startu.
+    Zwraca (teryt4, area, imgw_available, data_age_s) albo Response 400 / 404 / 502 / 503 / 504.
+    Punkt bez powiatu albo blad Geoportalu -> odpowiedz od razu, bez czekania na
+    odswiezenie (ono i tak jest wspolne).
+    Odswiezenie po terminie dalej trwa w tle; odpowiedz idzie z DB z imgw_available=False.
+    """
+    deadline = time.monotonic() + float(getattr(settings, "METEO_REQUEST_DEADLINE", 10))
+    rejected = _check_point(lat, lon)
+    if rejected is not None:
+        return rejected
+    refresh = _start_refresh(request, optional)
+    located = _lookup(lat, lon, deadline)
+    if isinstance(located, Response):
+        return located
+    teryt4, area = located
+    if refresh is None:
+        return teryt4, area, True, imgw_data_age()
+    result = _wait(refresh, deadline)
+    if result is _TIMED_OUT:
+        return teryt4, area, False, imgw_data_age()
+    return teryt4, area, result.ok, result.age_seconds
+
+
+def _history_qs_for_teryt(teryt4: str, since_utc, until_utc, active_at_utc, before=None):
     """
     Historia ostrzezen dla powiatu:
     - active_at_utc: co obowiazywalo w danej chwili
     - since/until: przeciecie przedzialow czasu
     - brak filtrow: pelna historia
+    - before: kursor (valid_from, id) - tylko wiersze starsze
+    Powiat, valid_from, sortowanie i kursor ida po kopii valid_from w WarningCoverage
+    (indeks coverage_history_keyset): wszystko w jednym filter(), wiec jeden join i bez
+    DISTINCT - para (ostrzezenie, powiat) jest unikalna.
     """
-    base = Warning.objects.filter(coverage__teryt4=teryt4).distinct()
+    cond = Q(warningcoverage__powiat_id=teryt4)
     if active_at_utc:
-        return base.filter(valid_from__lte=active_at_utc, valid_to__gte=active_at_utc) \
-                   .order_by("-valid_from")
-    if since_utc or until_utc:
+        cond &= Q(warningcoverage__valid_from__lte=active_at_utc, valid_to__gte=active_at_utc)
+    elif since_utc or until_utc:
         if since_utc and until_utc and since_utc > until_utc:
             since_utc, until_utc = until_utc, since_utc
-        cond = Q()
         if since_utc:
             cond &= Q(valid_to__gte=since_utc)
         if until_utc:
-            cond &= Q(valid_from__lte=until_utc)
-        return base.filter(cond).order_by("-valid_from")
-    return base.order_by("-valid_from")
+            cond &= Q(warningcoverage__valid_from__lte=until_utc)
+    if before:
+        cond &= Q(warningcoverage__valid_from__lte=before[0]) & (
+            Q(warningcoverage__valid_from__lt=before[0]) | Q(warningcoverage__warning_id__lt=before[1])
+        )
+    return Warning.objects.filter(cond).order_by("-warningcoverage__valid_from", "-warningcoverage__warning_id")
+
+
+def _current_rows(teryt4: str, now):
+    """Aktywne ostrzezenia powiatu: z indeksu w pamieci, a gdy zimny - z ORM."""
+    idx = warning_index()
+    if idx is not None:
+        return idx.active(teryt4, now)
+    return list(Warning.current_for_powiat(teryt4).values(*ROW_FIELDS))
+
+
+def _future_rows(teryt4: str, now):
+    idx = warning_index()
+    if idx is not None:
+        return idx.future(teryt4, now)
+    qs = Warning.objects.filter(
+        coverage__teryt4=teryt4,
+        valid_from__gt=now
+    ).order_by("valid_from", "id").distinct()
+    return list(qs.values(*ROW_FIELDS))
+
+
+def _history_rows(teryt4: str, since_utc, until_utc, active_at_utc, before=None, limit=None):
+    """
+    Strona historii: z indeksu w pamieci, gdy ma wszystkie wiersze (covers()) albo gdy
+    pelna strona konczy sie przed horyzontem (brakujace ostrzezenia zaczynaja sie przed
+    nim, wiec bylyby dopiero dalej); inaczej z ORM.
+    """
+    idx = warning_index()
+    if idx is not None:
+        if idx.covers(since_utc, until_utc, active_at_utc):
+            return idx.history(teryt4, since_utc, until_utc, active_at_utc, before=before, limit=limit)
+        if limit is not None:
+            rows = idx.history(teryt4, since_utc, until_utc, active_at_utc, before=before, limit=limit)
+            if len(rows) == limit and rows[-1]["valid_from"] >= idx.horizon:
+                return rows
+    qs = _history_qs_for_teryt(teryt4, since_utc, until_utc, active_at_utc, before=before)
+    if limit is not None:
+        qs = qs[:limit]
+    return list(qs.values(*ROW_FIELDS))
+
+
+def _county_rows_many(teryts, now) -> dict[str, tuple[list[dict], list[dict]]]:
+    """(aktywne, przyszle) dla wielu powiatow: z indeksu albo jednym zapytaniem ORM."""
+    idx = warning_index()
+    if idx is not None:
+        return {t4: (idx.active(t4, now), idx.future(t4, now)) for t4 in teryts}
+    result = {t4: ([], []) for t4 in teryts}
+    qs = (
+        Warning.objects.filter(coverage__teryt4__in=list(teryts), valid_to__gte=now)
+        .order_by()
+        .values(*ROW_FIELDS, "coverage__teryt4")
+    )
+    for row in qs:
+        t4 = row.pop("coverage__teryt4")
+        result[t4][0 if row["valid_from"] <= now else 1].append(row)
+    for active, future in result.values():
+        active.sort(key=lambda r: (-r["level"], r["valid_to"], r["id"]))
+        future.sort(key=lambda r: (r["valid_from"], r["id"]))
+    return result
+
+
+def _encode_cursor(row) -> str:
+    raw = json.dumps([row["valid_from"].isoformat(), row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(s: str):
+    """Kursor z pola "next" -> (valid_from, id); ValueError dla niepoprawnego."""
+    try:
+        raw = base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+        vf, wid = json.loads(raw)
+        valid_from = datetime.fromisoformat(vf)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if valid_from.tzinfo is None or not isinstance(wid, str):
+        raise ValueError("invalid cursor")
+    return valid_from, wid
+
+
+def _page_params(request):
+    """
+    Stronicowanie historii (keyset po (valid_from, id)): limit (domyslnie
+    METEO_HISTORY_PAGE_SIZE, najwyzej METEO_HISTORY_MAX_PAGE_SIZE) i cursor z pola "next".
+    Zwraca (limit, before); ValueError dla niepoprawnych parametrow.
+    """
+    default = int(getattr(settings, "METEO_HISTORY_PAGE_SIZE", 100))
+    maximum = int(getattr(settings, "METEO_HISTORY_MAX_PAGE_SIZE", 1000))
+    raw = request.query_params.get("limit")
+    try:
+        limit = int(raw) if raw else default
+    except ValueError:
+        raise ValueError("limit must be a positive integer") from None
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    cursor = request.query_params.get("cursor")
+    return min(limit, maximum), _decode_cursor(cursor) if cursor else None
+
+
+def _history_page(teryt4: str, since_utc, until_utc, active_at_utc, before, limit):
+    """Jedna strona historii + kursor nastepnej (None = ostatnia strona)."""
+    rows = _history_rows(teryt4, since_utc, until_utc, active_at_utc, before=before, limit=limit + 1)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _encode_cursor(rows[-1])
+    return rows, None
 
 
 @api_view(["GET"])
 def warnings_for_teryt(request, teryt4: str):
     """Aktualne TERAZ ostrzezenia dla zadanego TERYT-4."""
-    qs = Warning.current_for_powiat(teryt4)
-    data = WarningSerializer(qs, many=True).data
-    return Response({
-        "teryt4": teryt4,
-        "count": len(data),
-        "items": data,
-        "currently_active_IMGW_alerts": len(data),
-    })
+    data_age = imgw_data_age()
+    cached = cached_response("warnings_for_teryt", teryt4, {}, data_age=data_age)
+    response = not_modified(request, cached.validators)
+    if response is not None:
+        return response
+
+    payload = cached.payload
+    if payload is None:
+        data = warning_fragments(_current_rows(teryt4, timezone.now()))
+        payload = cached.store({
+            "teryt4": teryt4,
+            "count": len(data),
+            "items": data,
+            "currently_active_IMGW_alerts": len(data),
+        })
+    return set_validators(Response({**payload, "data_age_s": data_age}), cached.validators)
 
 
 @api_view(["GET"])
@@ -148,70 +459,92 @@ def history_for_point(request):
       until=YYYY-MM-DD[THH:MM:SS] (lokalny PL)
       active_at=YYYY-MM-DD[THH:MM:SS] (lokalny PL)
       refresh=0|1 (czy dociągnac IMGW przed odpowiedzia; domyslnie 1)
+      limit=N, cursor=<pole "next" z poprzedniej strony>
     """
     try:
         lat = float(request.query_params["lat"])
         lon = float(request.query_params["lon"])
     except Exception:
         return Response({"detail": "lat and lon are required floats"}, status=400)
-
-    imgw_ok = True
-    do_refresh = request.query_params.get("refresh", "1") not in ("0", "false", "False", "no")
-    if do_refresh:
-        try:
-            upsert_imgw(fetch_imgw())
-        except Exception:
-            imgw_ok = False
-
-    teryt4, area = teryt4_from_latlon(lat, lon)
-    if not teryt4:
-        return Response({"detail": "county not found for this point"}, status=404)
-
-    since_utc  = _parse_dt_local_utc(request.query_params.get("since"))
-    until_utc  = _parse_dt_local_utc(request.query_params.get("until"))
-    active_utc = _parse_dt_local_utc(request.query_params.get("active_at"))
-
-    qs = _history_qs_for_teryt(teryt4, since_utc, until_utc, active_utc)
-    data = WarningSerializer(qs, many=True).data
-    return Response({
+    try:
+        limit, before = _page_params(request)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    located = _locate_and_refresh(request, lat, lon)
+    if isinstance(located, Response):
+        return located
+    teryt4, area, imgw_ok, data_age = located
+
+    since_utc  = parse_dt_local_utc(request.query_params.get("since"))
+    until_utc  = parse_dt_local_utc(request.query_params.get("until"))
+    active_utc = parse_dt_local_utc(request.query_params.get("active_at"))
+
+    validators = response_validators("history_for_point", teryt4, {
+        "lat": lat, "lon": lon, "area": area, "imgw_available": imgw_ok,
+        "since": since_utc, "until": until_utc, "active_at": active_utc,
+        "limit": limit, "cursor": request.query_params.get("cursor"),
+    }, data_age=data_age)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    rows, next_cursor = _history_page(teryt4, since_utc, until_utc, active_utc, before, limit)
+
+    data = warning_fragments(rows)
+    response = Response({
         "point": {"lat": lat, "lon": lon},
         "area": {"teryt4": teryt4, "name": area},
         "filters": {"since": since_utc, "until": until_utc, "active_at": active_utc},
         "count": len(data),
         "items": data,
+        "next": next_cursor,
         "currently_active_IMGW_alerts": len(data),
         "imgw_available": imgw_ok,
+        "data_age_s": data_age,
     })
+    return set_validators(response, validators)
 
 
 @api_view(["GET"])
 def history_for_teryt(request, teryt4: str):
     """
     Historia ostrzezen dla zadanego TERYT-4.
-    Te same filtry co wyzej: since / until / active_at / refresh.
+    Te same filtry co wyzej: since / until / active_at / refresh / limit / cursor.
     """
-    imgw_ok = True
-    do_refresh = request.query_params.get("refresh", "1") not in ("0", "false", "False", "no")
-    if do_refresh:
-        try:
-            upsert_imgw(fetch_imgw())
-        except Exception:
-            imgw_ok = False
-
-    since_utc  = _parse_dt_local_utc(request.query_params.get("since"))
-    until_utc  = _parse_dt_local_utc(request.query_params.get("until"))
-    active_utc = _parse_dt_local_utc(request.query_params.get("active_at"))
-
-    qs = _history_qs_for_teryt(teryt4, since_utc, until_utc, active_utc)
-    data = WarningSerializer(qs, many=True).data
-    return Response({
-        "area": {"teryt4": teryt4},
-        "filters": {"since": since_utc, "until": until_utc, "active_at": active_utc},
-        "count": len(data),
-        "items": data,
-        "currently_active_IMGW_alerts": len(data),
-        "imgw_available": imgw_ok,
-    })
+    try:
+        limit, before = _page_params(request)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    imgw_ok, data_age = _maybe_refresh(request)
+
+    since_utc  = parse_dt_local_utc(request.query_params.get("since"))
+    until_utc  = parse_dt_local_utc(request.query_params.get("until"))
+    active_utc = parse_dt_local_utc(request.query_params.get("active_at"))
+
+    params = {"since": since_utc, "until": until_utc, "active_at": active_utc,
+              "limit": limit, "cursor": request.query_params.get("cursor")}
+    cached = cached_response(
+        "history_for_teryt", teryt4, {**params, "imgw_available": imgw_ok}, data_age=data_age,
+    )
+    response = not_modified(request, cached.validators)
+    if response is not None:
+        return response
+
+    payload = cached.payload
+    if payload is None:
+        rows, next_cursor = _history_page(teryt4, since_utc, until_utc, active_utc, before, limit)
+        data = warning_fragments(rows)
+        payload = cached.store({
+            "area": {"teryt4": teryt4},
+            "filters": {"since": since_utc, "until": until_utc, "active_at": active_utc},
+            "count": len(data),
+            "items": data,
+            "next": next_cursor,
+            "currently_active_IMGW_alerts": len(data),
+        })
+    response = Response({**payload, "imgw_available": imgw_ok, "data_age_s": data_age})
+    return set_validators(response, cached.validators)
 
 
 @api_view(["GET"])
@@ -225,17 +558,25 @@ def warnings_live(request):
     except Exception:
         return Response({"detail": "lat and lon are required floats"}, status=400)
 
-    # mapowanie punkt -> TERYT (z cache TerytCache, jeżeli wlaczony)
-    teryt4, area = teryt4_from_latlon(lat, lon)
-    if not teryt4:
-        return Response({"detail": "county not found for this point"}, status=404)
-
-    # pobierz feed IMGW (bez zapisu)
+    # pobranie feedu IMGW (bez zapisu) i mapowanie punkt -> TERYT (z cache TerytCache,
+    # jezeli wlaczony) rownolegle w puli, oba w budzecie METEO_REQUEST_DEADLINE
+    deadline = time.monotonic() + float(getattr(settings, "METEO_REQUEST_DEADLINE", 10))
+    rejected = _check_point(lat, lon)
+    if rejected is not None:
+        return rejected
+    fetch = run_in_executor(fetch_imgw)
+    located = _lookup(lat, lon, deadline)
+    if isinstance(located, Response):
+        fetch.cancel()
+        return located
+    teryt4, area = located
     try:
-        items = fetch_imgw()
-        imgw_ok = True
+        items = _wait(fetch, deadline)
     except Exception as e:
-        return Response({"detail": f"IMGW fetch failed: {e}"}, status=502)
+        return _upstream_error("imgw", "IMGW fetch", e)
+    if items is _TIMED_OUT:
+        return Response({"detail": "IMGW fetch timed out"}, status=504)
+    imgw_ok = True
 
     # filtruj ostrzezenia dla tego TERYT, ktore obowiazuja TERAZ
     now = datetime.now(ZoneInfo("UTC"))
@@ -274,92 +615,128 @@ def warnings_live(request):
     })
 
 
+def _pick_encoding(accept_encoding: str, available: tuple[str, ...]) -> str:
+    """
+    Kodowanie z available (w kolejnosci preferencji serwera) o najwyzszym q w Accept-Encoding;
+    q=0 = zabronione, "*" dotyczy niewymienionych. Nic nie pasuje -> "identity".
+    """
+    prefs = {}
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        prefs[coding] = q
+    best, best_q = "identity", prefs.get("identity", 0.0)
+    for coding in available:
+        q = prefs.get(coding, prefs.get("*", 0.0))
+        if q > 0 and q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+@require_GET
+def warnings_all(request):
+    """
+    Aktywne ostrzezenia dla calego kraju: {"counties": {teryt4: [id]}, "warnings": {id: {...}}}.
+    Tresc gotowa w pamieci (meteo.snapshot), wysylana jako br / gzip / bez kompresji
+    wg Accept-Encoding - bez serializacji przy zapytaniu.
+    """
+    snap = current_snapshot()
+    encoding = _pick_encoding(
+        request.headers.get("Accept-Encoding", ""),
+        ("br", "gzip") if snap.br is not None else ("gzip",),
+    )
+    etag = snap.etag_for(encoding)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(snap.content(encoding), content_type="application/json")
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    age = imgw_data_age()
+    if age is not None:
+        response["X-Data-Age"] = str(int(age))
+    patch_vary_headers(response, ("Accept-Encoding",))
+    max_age = float(getattr(settings, "METEO_IMGW_REFRESH_TTL", 60))
+    if snap.valid_until is not None:
+        max_age = min(max_age, (snap.valid_until - timezone.now()).total_seconds())
+    patch_cache_control(response, public=True, max_age=max(0, int(max_age)))
+    return response
+
+
+@require_GET
+def export_warnings_view(request):
+    """
+    Strumieniowy eksport ostrzezen (bez DRF - odpowiedz nie jest budowana w pamieci).
+    Query:
+      format=ndjson|csv (domyslnie ndjson)
+      since, until (lokalny PL, jak w historii), teryt=TERYT-4
+      per_teryt=1 - jeden wiersz na pare (ostrzezenie, TERYT-4)
+    """
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return JsonResponse({"detail": f"format must be one of {', '.join(FORMATS)}"}, status=400)
+    since_utc = parse_dt_local_utc(request.GET.get("since"))
+    until_utc = parse_dt_local_utc(request.GET.get("until"))
+    if (request.GET.get("since") and since_utc is None) or (request.GET.get("until") and until_utc is None):
+        return JsonResponse({"detail": "since/until must be YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"}, status=400)
+    teryt = (request.GET.get("teryt") or "").strip() or None
+    if teryt and (not teryt.isdigit() or len(teryt) != 4):
+        return JsonResponse({"detail": "teryt must be 4-digit string"}, status=400)
+    per_teryt = request.GET.get("per_teryt") in ("1", "true", "True", "yes")
+
+    response = StreamingHttpResponse(
+        export_warnings(fmt, since=since_utc, until=until_utc, teryt4=teryt, per_teryt=per_teryt),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    response["Content-Disposition"] = f'attachment; filename="warnings.{fmt}"'
+    return response
+
+
 # --------- Narzędzie pomocnicze: lat/lon dla zadanego TERYT-4 ---------
 
 @api_view(["GET"])
 def centroid_for_teryt(request):
     """
-    Zwraca (lat, lon) dla TERYT-4 z PRG.
-    Fallbacki:
-      1) centroid z serwera (returnCentroid)
-      2) środek z wierzchołków polygonu
-      3) środek bbox (returnExtentOnly)
+    Zwraca (lat, lon) i bbox dla TERYT-4 z zapisanej geometrii Powiat (bez sieci).
+    Dla powiatu jeszcze nieprzeliczonego (manage.py powiat_precompute) pyta raz
+    Geoportal (geoportal_county) i zapisuje wynik w Powiat.
     """
     teryt = (request.query_params.get("teryt") or "").strip()
     if not teryt.isdigit() or len(teryt) != 4:
         return Response({"detail": "teryt must be 4-digit string"}, status=400)
 
-    params = {
-        "f": "pjson",
-        "where": f"teryt='{teryt}'",
-        "outFields": "teryt,nazwa",
-        "returnGeometry": "true",
-        "returnCentroid": "true",
-        "outSR": 4326,  # WGS84 (lon/lat)
-    }
-    try:
-        r = requests.get(GEO_URL, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-    except Exception as e:
-        return Response({"detail": f"Geoportal error: {e}"}, status=502)
-
-    feats = data.get("features") or []
-    if not feats:
-        return Response({"detail": "not found"}, status=404)
-
-    a = feats[0].get("attributes") or {}
-    lon = lat = None
-
-    # 1) centroid z odpowiedzi
-    c = feats[0].get("centroid")
-    if isinstance(c, dict):
-        lon = c.get("x")
-        lat = c.get("y")
-
-    # 2) fallback – srodek z wierzchołków polygonu
-    if lon is None or lat is None:
-        geom = feats[0].get("geometry") or {}
-        rings = geom.get("rings") or []
-        xs, ys = [], []
-        for ring in rings:
-            for x, y in ring:
-                xs.append(x); ys.append(y)
-        if xs and ys:
-            lon = sum(xs) / len(xs)
-            lat = sum(ys) / len(ys)
-
-    # 3) fallback – srodek bbox (returnExtentOnly)
-    if lon is None or lat is None:
+    p = Powiat.objects.filter(teryt4=teryt, centroid_lat__isnull=False).first()
+    if p is None:
         try:
-            r2 = requests.get(
-                GEO_URL,
-                params={
-                    "f": "pjson",
-                    "where": f"teryt='{teryt}'",
-                    "returnExtentOnly": "true",
-                    "outSR": 4326,
-                },
-                timeout=10,
-            )
-            r2.raise_for_status()
-            ext = r2.json().get("extent") or {}
-            xmin, xmax = ext.get("xmin"), ext.get("xmax")
-            ymin, ymax = ext.get("ymin"), ext.get("ymax")
-            if None not in (xmin, xmax, ymin, ymax):
-                lon = (xmin + xmax) / 2.0
-                lat = (ymin + ymax) / 2.0
-        except Exception:
-            pass
-
-    if lon is None or lat is None:
-        return Response({"detail": "centroid unavailable"}, status=502)
-
+            geo = geoportal_county(teryt)
+        except Exception as e:
+            return _upstream_error("geoportal", "Geoportal", e)
+        if geo is None:
+            return Response({"detail": "not found"}, status=404)
+        if "centroid_lat" not in geo:
+            return Response({"detail": "centroid unavailable"}, status=502)
+        p, _ = Powiat.objects.update_or_create(teryt4=teryt, defaults=geo)
+
+    lat, lon = p.centroid_lat, p.centroid_lon
+    bbox = None
+    if p.bbox_min_lat is not None:
+        bbox = [p.bbox_min_lon, p.bbox_min_lat, p.bbox_max_lon, p.bbox_max_lat]
     return Response({
-        "teryt4": str(a.get("teryt")),
-        "name": a.get("nazwa"),
+        "teryt4": p.teryt4,
+        "name": p.name,
         "lat": float(lat),
         "lon": float(lon),
+        "bbox": bbox,
         "hint": f"http://127.0.0.1:8000/api/meteo/warnings?lat={lat}&lon={lon}"
     })
 
@@ -373,25 +750,23 @@ def future_for_teryt(request, teryt4: str):
     Przyszłe ostrzezenia (valid_from > now) dla podanego TERYT-4.
     Parametr opcjonalny: refresh=0|1 (domyślnie 1) – czy dociąagnac IMGW przed odpowiedzia.
     """
-    do_refresh = request.query_params.get("refresh", "1") not in ("0", "false", "False", "no")
-    imgw_ok = True
-    if do_refresh:
-        try:
-            upsert_imgw(fetch_imgw())
-        except Exception:
-            imgw_ok = False
+    imgw_ok, data_age = _maybe_refresh(request)
 
-    qs = Warning.objects.filter(
-        coverage__teryt4=teryt4,
-        valid_from__gt=timezone.now()
-    ).order_by("valid_from").distinct()  # albo Warning.future_for_powiat(teryt4)
+    cached = cached_response("future_for_teryt", teryt4, {"imgw_available": imgw_ok}, data_age=data_age)
+    response = not_modified(request, cached.validators)
+    if response is not None:
+        return response
 
-    return Response({
-        "teryt4": teryt4,
-        "count": qs.count(),
-        "items": WarningSerializer(qs, many=True).data,
-        "imgw_available": imgw_ok,
-    })
+    payload = cached.payload
+    if payload is None:
+        rows = _future_rows(teryt4, timezone.now())
+        payload = cached.store({
+            "teryt4": teryt4,
+            "count": len(rows),
+            "items": warning_fragments(rows),
+        })
+    response = Response({**payload, "imgw_available": imgw_ok, "data_age_s": data_age})
+    return set_validators(response, cached.validators)
 
 
 @api_view(["GET"])
@@ -406,27 +781,25 @@ def future_for_point(request):
     except Exception:
         return Response({"detail": "lat and lon are required floats"}, status=400)
 
-    teryt4, area = teryt4_from_latlon(lat, lon)
-    if not teryt4:
-        return Response({"detail": "county not found for this point"}, status=404)
+    located = _locate_and_refresh(request, lat, lon)
+    if isinstance(located, Response):
+        return located
+    teryt4, area, imgw_ok, data_age = located
 
-    do_refresh = request.query_params.get("refresh", "1") not in ("0", "false", "False", "no")
-    imgw_ok = True
-    if do_refresh:
-        try:
-            upsert_imgw(fetch_imgw())
-        except Exception:
-            imgw_ok = False
+    validators = response_validators("future_for_point", teryt4, {
+        "lat": lat, "lon": lon, "area": area, "imgw_available": imgw_ok,
+    }, data_age=data_age)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    rows = _future_rows(teryt4, timezone.now())
 
-    qs = Warning.objects.filter(
-        coverage__teryt4=teryt4,
-        valid_from__gt=timezone.now()
-    ).order_by("valid_from").distinct()  # albo Warning.future_for_powiat(teryt4)
-
-    return Response({
+    response = Response({
         "point": {"lat": lat, "lon": lon},
         "area": {"teryt4": teryt4, "name": area},
-        "count": qs.count(),
-        "items": WarningSerializer(qs, many=True).data,
+        "count": len(rows),
+        "items": warning_fragments(rows),
         "imgw_available": imgw_ok,
+        "data_age_s": data_age,
     })
+    return set_validators(response, validators)
@@ -0,0 +1,228 @@
+# meteo/warning_index.py
+"""
+Indeks przedzialow ostrzezen w pamieci procesu: TERYT-4 -> ostrzezenia posortowane po valid_from.
+
+Caly zbior ostrzezen jest maly (setki ostrzezen x ~380 powiatow), wiec zamiast
+joinu coverage + DISTINCT + ORDER BY przy kazdym zapytaniu trzymamy go w pamieci
+i przebudowujemy, gdy ingest zmieni IngestState.generation.
+Wiersze to dict z polami WarningSerializer + fingerprint (ROW_FIELDS).
+
+Pamiec: indeks jest w kazdym procesie (workerze), ok. 1-2 KB na ostrzezenie. Dlatego
+trzyma tylko ostrzezenia konczace sie nie wczesniej niz settings.METEO_WARNING_INDEX_HISTORY_DAYS
+dni przed budowa (None = cala historia); historie siegajaca dalej obsluguje ORM (covers()),
+z wyjatkiem pelnych stron konczacych sie przed horyzontem.
+"""
+from __future__ import annotations
+
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import IngestState, Warning, WarningCoverage
+from .serializers import WarningSerializer
+from .services import IMGW_SOURCE, current_generation
+
+WARNING_FIELDS = list(WarningSerializer.Meta.fields)
+ROW_FIELDS = WARNING_FIELDS + ["fingerprint"]  # + klucz cache fragmentow (meteo.fragments)
+
+
+class _CountyWarnings:
+    __slots__ = ("rows", "starts")
+
+    def __init__(self, rows: list[dict]):
+        self.rows = sorted(rows, key=lambda r: (r["valid_from"], r["id"]))
+        self.starts = [r["valid_from"] for r in self.rows]
+
+
+class WarningIndex:
+    def __init__(self, generation: int, rows: list[dict], coverage: list[tuple[str, str]],
+                 horizon: Optional[datetime] = None, before_horizon: Optional[dict[str, datetime]] = None):
+        self.generation = generation
+        self.horizon = horizon  # starsze (valid_to < horizon) ostrzezenia pominiete; None = wszystkie
+        self._before_horizon = before_horizon or {}  # teryt4 -> ostatnie valid_to pominietych
+        by_id = {r["id"]: r for r in rows}
+        grouped: dict[str, list[dict]] = defaultdict(list)
+        for wid, teryt4 in coverage:
+            row = by_id.get(wid)
+            if row is not None:
+                grouped[teryt4].append(row)
+        self.rows = by_id
+        self._counties = {t4: _CountyWarnings(rs) for t4, rs in grouped.items()}
+
+    @classmethod
+    def build(cls) -> "WarningIndex":
+        # Generacje czytamy z DB (nie z cache current_generation) PRZED danymi: przy READ COMMITTED
+        # dane moga byc nowsze niz numer, ale nigdy starsze - najwyzej przebudujemy sie raz za duzo.
+        days = getattr(settings, "METEO_WARNING_INDEX_HISTORY_DAYS", 30)
+        horizon = timezone.now() - timedelta(days=days) if days is not None else None
+        with transaction.atomic():
+            generation = (
+                IngestState.objects.filter(source=IMGW_SOURCE).values_list("generation", flat=True).first()
+            ) or 0
+            warnings = Warning.objects.order_by()
+            coverage = WarningCoverage.objects.all()
+            before_horizon = {}
+            if horizon is not None:
+                warnings = warnings.filter(valid_to__gte=horizon)
+                coverage = coverage.filter(warning__valid_to__gte=horizon)
+                before_horizon = dict(
+                    WarningCoverage.objects.filter(warning__valid_to__lt=horizon)
+                    .values("powiat_id").annotate(last=Max("warning__valid_to"))
+                    .values_list("powiat_id", "last")
+                )
+            rows = list(warnings.values(*ROW_FIELDS))
+            coverage = list(coverage.values_list("warning_id", "powiat_id"))
+        return cls(generation, rows, coverage, horizon, before_horizon)
+
+    def _county(self, teryt4: str) -> Optional[_CountyWarnings]:
+        return self._counties.get(teryt4)
+
+    def teryts(self) -> list[str]:
+        """Powiaty, dla ktorych sa jakiekolwiek ostrzezenia."""
+        return list(self._counties)
+
+    def active(self, teryt4: str, at: datetime) -> list[dict]:
+        """Obowiazujace w chwili at (valid_from <= at <= valid_to), jak Warning.current_for_powiat."""
+        c = self._county(teryt4)
+        if c is None:
+            return []
+        rows = [r for r in c.rows[:bisect_right(c.starts, at)] if r["valid_to"] >= at]
+        return sorted(rows, key=lambda r: (-r["level"], r["valid_to"], r["id"]))
+
+    def future(self, teryt4: str, after: datetime) -> list[dict]:
+        """Zaczynajace sie po chwili after, od najblizszego."""
+        c = self._county(teryt4)
+        if c is None:
+            return []
+        return c.rows[bisect_right(c.starts, after):]
+
+    def covers(self, since=None, until=None, active_at=None) -> bool:
+        """Czy history() z tymi filtrami ma wszystkie wiersze (nie siega przed horyzont)."""
+        if self.horizon is None:
+            return True
+        if active_at:
+            return active_at >= self.horizon
+        if since and until and since > until:
+            since = until
+        return since is not None and since >= self.horizon
+
+    def history(self, teryt4: str, since=None, until=None, active_at=None,
+                before: Optional[tuple[datetime, str]] = None, limit: Optional[int] = None) -> list[dict]:
+        """
+        Te same reguly co _history_qs_for_teryt (widok), sortowanie (-valid_from, -id).
+        before: kursor (valid_from, id) - tylko wiersze starsze; limit: najwyzej tyle wierszy.
+        """
+        c = self._county(teryt4)
+        if c is None:
+            return []
+        end = len(c.rows)
+        if active_at:
+            end = bisect_right(c.starts, active_at)
+        elif until:
+            if since and since > until:
+                since, until = until, since
+            end = bisect_right(c.starts, until)
+        if before:
+            end = min(end, bisect_right(c.starts, before[0]))
+            while end and (c.rows[end - 1]["valid_from"], c.rows[end - 1]["id"]) >= before:
+                end -= 1
+        min_end = active_at or since
+        if not min_end:
+            start = max(0, end - limit) if limit is not None else 0
+            return c.rows[start:end][::-1]
+        rows = []
+        for i in range(end - 1, -1, -1):
+            r = c.rows[i]
+            if r["valid_to"] >= min_end:
+                rows.append(r)
+                if limit is not None and len(rows) >= limit:
+                    break
+        return rows
+
+    def next_transition(self, teryt4: str, now: datetime) -> Optional[datetime]:
+        """
+        Najblizsza granica przedzialu po now: start (valid_from > now) albo koniec
+        (valid_to >= now; ostrzezenie obowiazuje wlacznie z valid_to). None = brak.
+        """
+        c = self._county(teryt4)
+        if c is None:
+            return None
+        candidates = []
+        i = bisect_right(c.starts, now)
+        if i < len(c.starts):
+            candidates.append(c.starts[i])
+        ends = [r["valid_to"] for r in c.rows[:i] if r["valid_to"] >= now]
+        if ends:
+            candidates.append(min(ends))
+        return min(candidates) if candidates else None
+
+    def previous_transition(self, teryt4: str, now: datetime) -> Optional[datetime]:
+        """Ostatnia granica przed now: start (valid_from <= now) albo koniec (valid_to < now)."""
+        older = self._before_horizon.get(teryt4)  # koniec ostrzezenia sprzed horyzontu
+        older = older if older is not None and older < now else None
+        c = self._county(teryt4)
+        i = bisect_right(c.starts, now) if c is not None else 0
+        if not i:
+            return older
+        ends = [r["valid_to"] for r in c.rows[:i] if r["valid_to"] < now]
+        return max([c.starts[i - 1], *ends, *([older] if older else [])])
+
+
+_index: Optional[WarningIndex] = None
+_build_lock = threading.Lock()
+
+
+def warning_index() -> Optional[WarningIndex]:
+    """
+    Indeks dla aktualnej generacji danych albo None (indeks "zimny").
+    Przebudowe robi jeden watek; pozostale w tym czasie dostaja None i pytaja ORM.
+    """
+    global _index
+    if not getattr(settings, "METEO_WARNING_INDEX_ENABLED", True):
+        return None
+    # build() czyta generacje z DB, wiec moze byc nowsza niz throttlowana current_generation()
+    idx = _index
+    if idx is not None and idx.generation >= current_generation():
+        return idx
+    if not _build_lock.acquire(blocking=False):
+        return None
+    try:
+        idx = _index
+        if idx is None or idx.generation < current_generation():
+            idx = _index = WarningIndex.build()
+        return idx
+    finally:
+        _build_lock.release()
+
+
+def next_transition(teryt4: str, now: datetime) -> Optional[datetime]:
+    """WarningIndex.next_transition z indeksu, a gdy zimny - jednym zapytaniem agregujacym."""
+    idx = warning_index()
+    if idx is not None and idx.covers(active_at=now):
+        return idx.next_transition(teryt4, now)
+    agg = Warning.objects.filter(coverage__teryt4=teryt4).aggregate(
+        next_start=Min("valid_from", filter=Q(valid_from__gt=now)),
+        next_end=Min("valid_to", filter=Q(valid_from__lte=now, valid_to__gte=now)),
+    )
+    candidates = [v for v in agg.values() if v is not None]
+    return min(candidates) if candidates else None
+
+
+def previous_transition(teryt4: str, now: datetime) -> Optional[datetime]:
+    """WarningIndex.previous_transition z indeksu, a gdy zimny - jednym zapytaniem agregujacym."""
+    idx = warning_index()
+    if idx is not None and idx.covers(active_at=now):
+        return idx.previous_transition(teryt4, now)
+    agg = Warning.objects.filter(coverage__teryt4=teryt4).aggregate(
+        last_start=Max("valid_from", filter=Q(valid_from__lte=now)),
+        last_end=Max("valid_to", filter=Q(valid_to__lt=now)),
+    )
+    candidates = [v for v in agg.values() if v is not None]
+    return max(candidates) if candidates else None